@@ -31,6 +31,11 @@ setuptools.setup(
         "pandas",
         "dynamicsizerecarray>=0.1.0",
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+        "lz4": ["lz4"],
+        "arrow": ["pyarrow"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
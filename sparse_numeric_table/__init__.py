@@ -74,7 +74,10 @@ from .version import __version__
 
 from ._file_io import open
 from ._file_io import concatenate_files
+from ._file_io import AlignedBlockLooper
+from ._dataset import Dataset
 from ._sparse_numeric_table import SparseNumericTable
+from .indexset import IndexSet
 
 from . import logic
 from . import validating
@@ -0,0 +1,144 @@
+"""
+Aggregations of the columns of a level which are computed block by block.
+Each block yields a small partial result. Partial results of blocks, which
+may be computed in parallel, are merged in any order.
+"""
+
+import numpy as np
+
+AGGREGATIONS = ["count", "sum", "mean", "min", "max", "hist"]
+
+
+def normalize_aggregations(aggregations, column_keys):
+    """
+    Returns the aggregations as a dict of lists of (name, parameter).
+
+    Parameters
+    ----------
+    aggregations : dict
+        For each column a list of aggregations, e.g.
+        {"energy": ["count", "sum", "mean", "min", "max", ("hist", bins)]}.
+        The 'bins' of a histogram are its bin edges. Each aggregation may
+        appear only once per column.
+    column_keys : list of str
+        The column keys of the level.
+    """
+    out = {}
+    for column_key in aggregations:
+        if column_key not in column_keys:
+            raise KeyError(f"Column '{column_key:s}' is not in level.")
+        out[column_key] = []
+        for aggregation in aggregations[column_key]:
+            if isinstance(aggregation, str):
+                name, parameter = aggregation, None
+            else:
+                name, parameter = aggregation
+            if name not in AGGREGATIONS:
+                raise KeyError(
+                    f"Expected aggregation to be in {AGGREGATIONS}. "
+                    f"But it is '{name:s}'."
+                )
+            if name in [other for other, _ in out[column_key]]:
+                raise KeyError(
+                    f"Aggregation '{name:s}' appears more than once "
+                    f"for column '{column_key:s}'."
+                )
+            if name == "hist":
+                parameter = np.asarray(parameter)
+                assert parameter.ndim == 1 and parameter.shape[0] >= 2, (
+                    "Expected the bin edges of 'hist' to be an array "
+                    "with at least two edges."
+                )
+            out[column_key].append((name, parameter))
+    return out
+
+
+def make_partial(values, aggregations):
+    """
+    Returns the partial aggregation of a column's 'values' in one block.
+    """
+    out = {"count": values.shape[0]}
+    names = [name for name, _ in aggregations]
+    if "sum" in names or "mean" in names:
+        out["sum"] = np.sum(values)
+    if values.shape[0] > 0:
+        if "min" in names:
+            out["min"] = np.min(values)
+        if "max" in names:
+            out["max"] = np.max(values)
+    for name, bin_edges in aggregations:
+        if name == "hist":
+            out["hist"] = np.histogram(values, bins=bin_edges)[0]
+    return out
+
+
+def merge_partials(a, b):
+    """
+    Returns the partial aggregation of the union of the rows of 'a' and 'b'.
+    """
+    out = {"count": a["count"] + b["count"]}
+    if "sum" in a:
+        out["sum"] = a["sum"] + b["sum"]
+    for name, func in [("min", min), ("max", max)]:
+        if name in a and name in b:
+            out[name] = func(a[name], b[name])
+        elif name in a or name in b:
+            out[name] = a[name] if name in a else b[name]
+    if "hist" in a:
+        out["hist"] = a["hist"] + b["hist"]
+    return out
+
+
+def finalize(partial, aggregations):
+    """
+    Returns the requested aggregations from the merged 'partial'.
+    Mean, min, and max are None when there are no rows.
+    """
+    out = {}
+    for name, _ in aggregations:
+        if name == "count":
+            out["count"] = int(partial["count"])
+        elif name == "sum":
+            out["sum"] = partial["sum"]
+        elif name == "mean":
+            if partial["count"] > 0:
+                out["mean"] = partial["sum"] / partial["count"]
+            else:
+                out["mean"] = None
+        elif name in ("min", "max"):
+            out[name] = partial.get(name, None)
+        elif name == "hist":
+            out["hist"] = partial["hist"]
+    return out
+
+
+def make_partials_of_block(get_column, mask, aggregations):
+    """
+    Returns the partial aggregations of all columns in one block.
+    """
+    out = {}
+    for column_key in aggregations:
+        column = get_column(column_key)
+        values = column if mask is None else column[mask]
+        out[column_key] = make_partial(
+            values=values, aggregations=aggregations[column_key]
+        )
+    return out
+
+
+def merge_partials_of_blocks(partials_of_blocks, aggregations, dtypes):
+    """
+    Returns the merged partial aggregations of all columns.
+    'dtypes' is a dict of the column's dtypes which is used when there
+    are no blocks.
+    """
+    out = {}
+    for column_key in aggregations:
+        merged = make_partial(
+            values=np.zeros(shape=0, dtype=dtypes[column_key]),
+            aggregations=aggregations[column_key],
+        )
+        for partials in partials_of_blocks:
+            merged = merge_partials(merged, partials[column_key])
+        out[column_key] = merged
+    return out
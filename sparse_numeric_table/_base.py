@@ -1,8 +1,8 @@
 from ._sparse_numeric_table import SparseNumericTable
 from . import logic
+from .indexset import IndexSet
 
 import copy
-import pandas as pd
 import numpy as np
 from dynamicsizerecarray import DynamicSizeRecarray
 
@@ -15,17 +15,210 @@ def make_mask_of_right_in_left(left_indices, right_indices):
     ----------
     left_indices : list of indices
 
-    right_indices : list of indices
+    right_indices : list of indices, IndexMembership, or IndexSet
+        When the same 'right_indices' are tested against many 'left_indices',
+        pass an IndexMembership to prepare them only once.
 
     Example
     -------
     [0, 1, 0, 0] = make_mask_of_right_in_left([1,2,3,4], [0,2,9])
     """
-    left_df = pd.DataFrame({"i": left_indices})
-    right_df = pd.DataFrame({"i": right_indices})
-    mask_df = pd.merge(left_df, right_df, on="i", how="left", indicator=True)
-    indicator_df = mask_df["_merge"]
-    mask = np.array(indicator_df == "both", dtype=bool)
+    membership = make_index_membership(right_indices)
+    return membership.mask(left_indices)
+
+
+def make_index_membership(indices):
+    """
+    Returns an IndexMembership for 'indices'. Does nothing when 'indices' is
+    already an IndexMembership or an IndexSet.
+    """
+    if isinstance(indices, (IndexMembership, IndexSet)):
+        return indices
+    return IndexMembership(indices)
+
+
+class IndexMembership:
+    """
+    The 'right_indices' of make_mask_of_right_in_left() prepared once so that
+    many 'left_indices' (e.g. the blocks of a level) can be tested for
+    membership without preparing them again.
+
+    When the indices are dense, membership is looked up in a table.
+    Otherwise it is looked up by binary search in the sorted indices.
+    """
+
+    DENSE_LOOKUP_MAX_SPAN_PER_INDEX = 8
+
+    def __init__(self, indices):
+        """
+        Parameters
+        ----------
+        indices : array like
+            The indices to test membership against. Duplicates are ignored.
+        """
+        indices = np.asarray(indices)
+        if _is_sorted_and_unique(indices):
+            self.sorted_indices = indices
+        else:
+            self.sorted_indices = np.unique(indices)
+        self._sorted_indices_by_dtype = {}
+        self._lookup = None
+
+        if self._is_integer() and self.size > 0:
+            span = int(self.max) - int(self.min) + 1
+            if span <= self.DENSE_LOOKUP_MAX_SPAN_PER_INDEX * self.size:
+                self._lookup = np.zeros(shape=span, dtype=bool)
+                self._lookup[self.sorted_indices - self.min] = True
+
+    @property
+    def size(self):
+        return self.sorted_indices.shape[0]
+
+    @property
+    def min(self):
+        return self.sorted_indices[0]
+
+    @property
+    def max(self):
+        return self.sorted_indices[-1]
+
+    def _is_integer(self):
+        return self.sorted_indices.dtype.kind in ("i", "u")
+
+    def mask(self, left_indices):
+        """
+        Returns a mask for 'left_indices' indicating wheter an index is in
+        this membership.
+        """
+        left = np.asarray(left_indices)
+        if self.size == 0 or left.shape[0] == 0:
+            return np.zeros(shape=left.shape[0], dtype=bool)
+
+        if not (self._is_integer() and left.dtype.kind in ("i", "u")):
+            return np.isin(left, self.sorted_indices)
+
+        right = self._get_sorted_indices_as(dtype=left.dtype)
+        if right.shape[0] == 0:
+            return np.zeros(shape=left.shape[0], dtype=bool)
+
+        if self._lookup is not None:
+            lo = right[0]
+            hi = right[-1]
+            lookup = self._lookup[int(lo) - int(self.min) :]
+            out = (left >= lo) & (left <= hi)
+            out[out] = lookup[left[out] - lo]
+            return out
+
+        pos = np.searchsorted(right, left)
+        pos[pos == right.shape[0]] = 0
+        return right[pos] == left
+
+    def any_in_range(self, start, stop):
+        """
+        Returns True when any index 'i' is in start <= i <= stop.
+        """
+        if self.size == 0:
+            return False
+        if self._is_integer():
+            info = np.iinfo(self.sorted_indices.dtype)
+            if stop < info.min or start > info.max:
+                return False
+            start = max(start, info.min)
+            stop = min(stop, info.max)
+        lo = np.searchsorted(self.sorted_indices, start, side="left")
+        hi = np.searchsorted(self.sorted_indices, stop, side="right")
+        return hi > lo
+
+    def _get_sorted_indices_as(self, dtype):
+        if dtype == self.sorted_indices.dtype:
+            return self.sorted_indices
+        if dtype not in self._sorted_indices_by_dtype:
+            self._sorted_indices_by_dtype[dtype] = _cast_indices(
+                indices=self.sorted_indices, dtype=dtype
+            )
+        return self._sorted_indices_by_dtype[dtype]
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"{self.__class__.__name__:s}(size={self.size:d})"
+
+
+def _is_sorted_and_unique(x):
+    return x.ndim == 1 and bool(np.all(x[1:] > x[:-1]))
+
+
+def _cast_indices(indices, dtype):
+    """
+    Returns the integer 'indices' casted to integer 'dtype'. Indices which
+    can not be represented in 'dtype' are dropped.
+    """
+    src = np.iinfo(indices.dtype)
+    dst = np.iinfo(dtype)
+    lo = max(src.min, dst.min)
+    hi = min(src.max, dst.max)
+    if lo > hi:
+        return np.zeros(shape=0, dtype=dtype)
+    mask = (indices >= indices.dtype.type(lo)) & (
+        indices <= indices.dtype.type(hi)
+    )
+    return indices[mask].astype(dtype)
+
+
+OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+
+def assert_conditions_are_valid(conditions, column_keys):
+    """
+    Parameters
+    ----------
+    conditions : list of tuples
+        Each condition is (column_key, operator, value),
+        e.g. ("energy", ">", 1e3).
+    column_keys : list of str
+        The column keys of the level.
+    """
+    for condition in conditions:
+        assert len(condition) == 3, (
+            "Expected condition to be (column_key, operator, value), "
+            f"but it is {condition}."
+        )
+        column_key, operator, _ = condition
+        if column_key not in column_keys:
+            raise KeyError(f"Column '{column_key:s}' is not in level.")
+        if operator not in OPERATORS:
+            raise KeyError(
+                f"Expected operator to be in {list(OPERATORS.keys())}. "
+                f"But it is '{operator:s}'."
+            )
+
+
+def make_mask_of_conditions(get_column, conditions, mask):
+    """
+    Returns 'mask' reduced to the rows which fulfill all 'conditions'.
+    Stops reading columns as soon as no row is left.
+
+    Parameters
+    ----------
+    get_column : function(column_key) -> array
+        Returns a column of the level.
+    conditions : list of tuples
+        See assert_conditions_are_valid().
+    mask : array of bools
+        The rows to start with.
+    """
+    for column_key, operator, value in conditions:
+        if not np.any(mask):
+            break
+        mask = mask & OPERATORS[operator](get_column(column_key), value)
     return mask
 
 
@@ -79,34 +272,99 @@ def _query(
     indices=None,
     levels_and_columns=None,
     sort=False,
+    where=None,
+    **kwargs,
 ):
     """
     Query levels and columns on either a SparseNumericTable or on
     archive.Reader.
+    Further 'kwargs' are passed on to the handle's _get_level().
     """
-    if levels_and_columns is None:
-        levels_and_columns = {}
-        for level_key in handle.list_level_keys():
-            levels_and_columns[level_key] = handle.list_column_keys(
-                level_key=level_key
-            )
+    levels_and_columns, where = _prepare_query(
+        handle=handle,
+        levels_and_columns=levels_and_columns,
+        where=where,
+    )
 
     out = SparseNumericTable(index_key=copy.copy(handle._index_key))
 
+    if indices is not None:
+        membership = make_index_membership(indices)
+    else:
+        membership = None
+
     for level_key in levels_and_columns:
         out[level_key] = handle._get_level(
             level_key=level_key,
             column_keys=levels_and_columns[level_key],
-            indices=indices,
+            indices=membership,
+            conditions=where.get(level_key, None),
+            **kwargs,
         )
 
     if sort:
         assert indices is not None
         out = logic.sort_table_on_common_indices(
             table=out,
-            common_indices=indices,
+            common_indices=_make_sort_indices(
+                indices=indices,
+                levels_indices=[out[lk][out.index_key] for lk in out],
+                where=where,
+            ),
             inplace=True,
         )
 
     out.shrink_to_fit()
     return out
+
+
+def _make_sort_indices(indices, levels_indices, where):
+    """
+    Returns the indices to sort the levels of a query on. When conditions in
+    'where' removed rows, only the 'indices' which are left in all levels
+    are kept, in the order of 'indices'.
+
+    Parameters
+    ----------
+    indices : list of indices
+        The queried indices.
+    levels_indices : list of arrays
+        The index column of each queried level.
+    where : dict
+        The conditions of the query.
+    """
+    indices = np.asarray(indices)
+    if not any(where.values()):
+        return indices
+    mask = np.ones(shape=indices.shape[0], dtype=bool)
+    for level_indices in levels_indices:
+        mask &= make_mask_of_right_in_left(
+            left_indices=indices, right_indices=level_indices
+        )
+    return indices[mask]
+
+
+def _prepare_query(handle, levels_and_columns=None, where=None):
+    """
+    Returns the 'levels_and_columns' and the 'where' conditions of a query
+    with defaults filled in. Raises when a condition is not valid.
+    """
+    if levels_and_columns is None:
+        levels_and_columns = {}
+        for level_key in handle.list_level_keys():
+            levels_and_columns[level_key] = handle.list_column_keys(
+                level_key=level_key
+            )
+
+    if where is None:
+        where = {}
+    for level_key in where:
+        assert level_key in levels_and_columns, (
+            f"Expected level '{level_key:s}' in 'where' "
+            "to be in 'levels_and_columns'."
+        )
+        assert_conditions_are_valid(
+            conditions=where[level_key],
+            column_keys=handle.list_column_keys(level_key=level_key),
+        )
+    return levels_and_columns, where
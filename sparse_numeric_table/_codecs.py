@@ -0,0 +1,201 @@
+"""
+Codecs to compress the payload of a column's block.
+
+The codec of a block is encoded in the extension of the block's filename
+inside the zip file, e.g. 'level/000000/column.<f8.zst'. An optional
+byte-shuffle filter is encoded as an extension in front of the codec's
+extension, e.g. 'level/000000/column.<f8.shuffle.zst'.
+"""
+
+import gzip
+import importlib
+import numpy as np
+
+SHUFFLE_EXTENSION = ".shuffle"
+
+
+def _gzip_compress(payload, level):
+    if level is None:
+        return gzip.compress(payload)
+    return gzip.compress(payload, compresslevel=level)
+
+
+def _gzip_decompress(payload):
+    return gzip.decompress(payload)
+
+
+def _zstd_compress(payload, level):
+    zstandard = _import_optional(module_name="zstandard", codec="zstd")
+    if level is None:
+        level = 3
+    return zstandard.ZstdCompressor(level=level).compress(payload)
+
+
+def _zstd_decompress(payload):
+    zstandard = _import_optional(module_name="zstandard", codec="zstd")
+    return zstandard.ZstdDecompressor().decompress(payload)
+
+
+def _lz4_compress(payload, level):
+    lz4_frame = _import_optional(module_name="lz4.frame", codec="lz4")
+    if level is None:
+        level = 0
+    return lz4_frame.compress(payload, compression_level=level)
+
+
+def _lz4_decompress(payload):
+    lz4_frame = _import_optional(module_name="lz4.frame", codec="lz4")
+    return lz4_frame.decompress(payload)
+
+
+def _import_optional(module_name, codec):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as err:
+        raise ImportError(
+            f"Codec '{codec:s}' requires the module '{module_name:s}'. "
+            f"Install with: pip install "
+            f"sparse_numeric_table_sebastian-achim-mueller[{codec:s}]"
+        ) from err
+
+
+CODECS = {}
+
+
+def register(name, extension, compress, decompress):
+    """
+    Adds a codec to the registry.
+
+    Parameters
+    ----------
+    name : str
+        Name of the codec, e.g. 'gzip'. Used in open(mode='w', codec=name).
+    extension : str
+        Extension of the block's filename, e.g. '.gz'. Must be unique among
+        the codecs. An empty extension means no compression.
+    compress : function(payload, level) -> bytes
+        Compresses the payload. When 'level' is None the codec's default
+        level is used.
+    decompress : function(payload) -> bytes
+        Decompresses the payload.
+    """
+    assert name not in CODECS, f"Codec '{name:s}' is already registered."
+    for other in CODECS:
+        assert CODECS[other]["extension"] != extension, (
+            f"Extension '{extension:s}' is already used by "
+            f"codec '{other:s}'."
+        )
+    assert extension != SHUFFLE_EXTENSION
+    assert extension == "" or extension.startswith(".")
+    assert "." not in extension[1:]
+    CODECS[name] = {
+        "extension": extension,
+        "compress": compress,
+        "decompress": decompress,
+    }
+
+
+register(
+    name="none",
+    extension="",
+    compress=lambda payload, level: payload,
+    decompress=lambda payload: payload,
+)
+register(
+    name="gzip",
+    extension=".gz",
+    compress=_gzip_compress,
+    decompress=_gzip_decompress,
+)
+register(
+    name="zstd",
+    extension=".zst",
+    compress=_zstd_compress,
+    decompress=_zstd_decompress,
+)
+register(
+    name="lz4",
+    extension=".lz4",
+    compress=_lz4_compress,
+    decompress=_lz4_decompress,
+)
+
+
+def assert_codec_is_valid(codec):
+    if codec not in CODECS:
+        raise KeyError(
+            f"Expected 'codec' to be in {list(CODECS.keys())}. "
+            f"But it is '{codec:s}'."
+        )
+
+
+def make_extensions(codec, shuffle):
+    """
+    Returns the extensions to be appended to a block's filename.
+    """
+    out = SHUFFLE_EXTENSION if shuffle else ""
+    return out + CODECS[codec]["extension"]
+
+
+def parse_extensions(extensions):
+    """
+    Returns the codec and the shuffle flag of a block from the extensions
+    of its filename.
+
+    Parameters
+    ----------
+    extensions : list of str
+        The extensions following the column's dtype, e.g. ['.shuffle', '.gz'].
+
+    Returns
+    -------
+    (codec, shuffle) : (str, bool)
+    """
+    extensions = list(extensions)
+    shuffle = False
+    if len(extensions) > 0 and extensions[0] == SHUFFLE_EXTENSION:
+        shuffle = True
+        extensions = extensions[1:]
+
+    if len(extensions) == 0:
+        return "none", shuffle
+
+    assert len(extensions) == 1, f"Expected one codec in {extensions}."
+    for codec in CODECS:
+        if CODECS[codec]["extension"] == extensions[0]:
+            return codec, shuffle
+    raise KeyError(f"Unknown codec with extension '{extensions[0]:s}'.")
+
+
+def encode(payload, codec, level=None, shuffle=False, itemsize=1):
+    """
+    Returns the payload shuffled (optional) and compressed by codec.
+    """
+    if shuffle:
+        payload = byte_shuffle(payload=payload, itemsize=itemsize)
+    return CODECS[codec]["compress"](payload, level)
+
+
+def decode(payload, codec, shuffle=False, itemsize=1):
+    """
+    Returns the payload decompressed by codec and unshuffled (optional).
+    """
+    payload = CODECS[codec]["decompress"](payload)
+    if shuffle:
+        payload = byte_unshuffle(payload=payload, itemsize=itemsize)
+    return payload
+
+
+def byte_shuffle(payload, itemsize):
+    """
+    Groups the n-th bytes of all items together. For floats this puts the
+    slowly changing sign and exponent bytes next to each other which makes
+    the payload more compressible.
+    """
+    a = np.frombuffer(payload, dtype=np.uint8)
+    return a.reshape((-1, itemsize)).T.tobytes()
+
+
+def byte_unshuffle(payload, itemsize):
+    a = np.frombuffer(payload, dtype=np.uint8)
+    return a.reshape((itemsize, -1)).T.tobytes()
@@ -0,0 +1,555 @@
+from . import _aggregate
+from . import _base
+from . import _file_io
+from . import logic
+from ._sparse_numeric_table import SparseNumericTable
+from .indexset import IndexSet
+
+import concurrent.futures
+from multiprocessing import shared_memory
+import copy
+import glob
+import numpy as np
+import os
+import dynamicsizerecarray
+
+
+class Dataset:
+    """
+    Many files (shards) of sparse numeric tables with the same dtypes and
+    index_key which are queried as if they were one table.
+
+    On open, a catalog of the levels, blocks and index ranges of all shards
+    is built. A query only opens the shards which have blocks that may
+    contain the queried indices. Opened shards are kept open until close().
+
+    With 'processes', a query is split into tasks of a few blocks of one
+    level in one shard. The tasks run in a pool of processes which write
+    their rows into shared memory created by the calling process. The
+    queried indices are sent to each process only once.
+    """
+
+    def __init__(
+        self,
+        paths,
+        workers=None,
+        block_cache_size=0,
+        processes=None,
+        blocks_per_task=16,
+    ):
+        """
+        Parameters
+        ----------
+        paths : str, or list of str
+            Either a directory which contains the shards as '*.zip' files,
+            or a list of paths to shards.
+        workers : int (default=None)
+            Number of threads to read shards in parallel. No threads when
+            None.
+        block_cache_size : int (default=0)
+            Passed on to each shard's reader.
+        processes : int (default=None)
+            Number of processes to run queries in. No processes when None.
+        blocks_per_task : int (default=16)
+            Maximum number of blocks read in one task when running queries
+            in processes.
+        """
+        if isinstance(paths, (str, os.PathLike)):
+            paths = sorted(glob.glob(os.path.join(paths, "*.zip")))
+        self.paths = [os.fspath(path) for path in paths]
+        assert len(self.paths) > 0, "Expected at least one shard."
+        self.workers = workers
+        self.block_cache_size = block_cache_size
+        self.processes = processes
+        assert blocks_per_task > 0, "Expected blocks_per_task > 0."
+        self.blocks_per_task = blocks_per_task
+        self._readers = {}
+
+        self._index_key = None
+        self.dtypes = None
+        self.catalog = {}
+        for shard_id, path in enumerate(self.paths):
+            with _file_io.open(file=path, mode="r") as reader:
+                self._add_to_catalog(shard_id=shard_id, reader=reader)
+
+    def _add_to_catalog(self, shard_id, reader):
+        if self.dtypes is None:
+            self._index_key = reader.index_key
+            self.dtypes = reader.dtypes
+            for level_key in self.dtypes:
+                self.catalog[level_key] = []
+
+        assert reader.index_key == self._index_key, (
+            f"Expected index_key of shard '{self.paths[shard_id]:s}' "
+            f"to be '{self._index_key:s}'."
+        )
+        assert _file_io._dtypes_are_equal(reader.dtypes, self.dtypes), (
+            f"Expected dtypes of shard '{self.paths[shard_id]:s}' "
+            "to be equal to the dtypes of the other shards."
+        )
+
+        for level_key in self.dtypes:
+            for block_key in reader.info[level_key][self._index_key]:
+                stats = reader.get_index_stats(
+                    level_key=level_key, block_key=block_key
+                )
+                if stats is None:
+                    stats = _file_io._make_index_stats(
+                        reader._read_level_column_block(
+                            level_key=level_key,
+                            column_key=self._index_key,
+                            block_key=block_key,
+                        )
+                    )
+                self.catalog[level_key].append((shard_id, block_key, stats))
+
+    @property
+    def index_key(self):
+        return copy.copy(self._index_key)
+
+    def list_level_keys(self):
+        return list(self.dtypes.keys())
+
+    def list_column_keys(self, level_key):
+        return [column_key for column_key, _ in self.dtypes[level_key]]
+
+    def list_shard_ids(self, level_key, indices=None):
+        """
+        Returns the ids of the shards which have blocks in the level that
+        may contain any of the 'indices'.
+        """
+        return list(
+            self._list_block_keys(level_key=level_key, indices=indices)
+        )
+
+    def _list_block_keys(self, level_key, indices=None):
+        """
+        Returns a dict with the keys of the blocks in the level which may
+        contain any of the 'indices' for each shard id.
+        """
+        if indices is not None:
+            indices = _base.make_index_membership(indices)
+
+        out = {}
+        for shard_id, block_key, stats in self.catalog[level_key]:
+            if indices is None or _file_io._may_contain_any(stats, indices):
+                if shard_id not in out:
+                    out[shard_id] = []
+                out[shard_id].append(block_key)
+        return out
+
+    def _get_reader(self, shard_id):
+        if shard_id not in self._readers:
+            self._readers[shard_id] = _file_io.open(
+                file=self.paths[shard_id],
+                mode="r",
+                block_cache_size=self.block_cache_size,
+            )
+        return self._readers[shard_id]
+
+    def _get_level(
+        self,
+        level_key,
+        column_keys,
+        indices=None,
+        conditions=None,
+        workers=None,
+    ):
+        if indices is not None:
+            indices = _base.make_index_membership(indices)
+
+        shard_ids = self.list_shard_ids(level_key=level_key, indices=indices)
+        readers = [self._get_reader(shard_id) for shard_id in shard_ids]
+
+        out_dtype = _base._sub_level_dtypes(
+            level_dtype=self.dtypes[level_key],
+            column_keys=column_keys,
+        )
+        column_keys = [column_key for column_key, _ in out_dtype]
+
+        def plan_level(reader):
+            return reader._plan_level_blocks(
+                level_key=level_key,
+                indices=indices,
+                conditions=conditions,
+                workers=1,
+                keep_column_keys=column_keys,
+            )
+
+        shard_plans = self._map(plan_level, readers, workers)
+        shard_sizes = [sum([p[2] for p in plans]) for plans in shard_plans]
+
+        out = dynamicsizerecarray.DynamicSizeRecarray(
+            dtype=out_dtype, shape=sum(shard_sizes)
+        )
+        out_recarray = out.to_recarray()
+        starts = np.cumsum([0] + shard_sizes)
+
+        def fill_level(i):
+            readers[i]._fill_level(
+                level_key=level_key,
+                column_keys=column_keys,
+                block_plans=shard_plans[i],
+                out_recarray=out_recarray[starts[i] : starts[i + 1]],
+                workers=1,
+            )
+
+        self._map(fill_level, range(len(readers)), workers)
+        return out
+
+    def _map(self, func, items, workers=None):
+        """
+        Returns the results of 'func' on 'items' in order. Uses a pool of
+        threads when there are more than one 'workers'.
+        """
+        if workers is None:
+            workers = self.workers
+        if workers is None or workers <= 1:
+            return list(map(func, items))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(func, items))
+
+    def query(
+        self,
+        indices=None,
+        levels_and_columns=None,
+        sort=False,
+        where=None,
+        workers=None,
+        processes=None,
+    ):
+        """
+        Same as SparseNumericTableReader.query() but on all shards. The rows
+        of a level are in the order of the shards.
+
+        Parameters
+        ----------
+        indices : list of indices (default=None)
+            Only rows with these indices are returned. All rows when None.
+        levels_and_columns : dict (default=None)
+            Only these levels and columns are returned. All when None.
+        sort : bool (default=False)
+            Sort the rows of each level in the order of 'indices'. With
+            'where', only the indices left in all levels are kept.
+        where : dict (default=None)
+            Only rows which fulfill all conditions of their level are
+            returned, e.g. {"level": [("column", ">", 1e3)]}.
+        workers : int (default=None)
+            Number of threads to read shards in parallel. When None, the
+            dataset's 'workers' is used.
+        processes : int (default=None)
+            Number of processes to run the query in. When None, the
+            dataset's 'processes' is used.
+        """
+        if processes is None:
+            processes = self.processes
+        if processes is not None and processes > 1:
+            return self._query_in_processes(
+                processes=processes,
+                indices=indices,
+                levels_and_columns=levels_and_columns,
+                sort=sort,
+                where=where,
+            )
+        return _base._query(
+            handle=self,
+            indices=indices,
+            levels_and_columns=levels_and_columns,
+            sort=sort,
+            where=where,
+            workers=workers,
+        )
+
+    def aggregate(
+        self,
+        level_key,
+        aggregations,
+        indices=None,
+        where=None,
+        workers=None,
+    ):
+        """
+        Same as SparseNumericTableReader.aggregate() but on all shards. The
+        shards are aggregated one by one and the results are merged.
+        """
+        aggregations = _aggregate.normalize_aggregations(
+            aggregations=aggregations,
+            column_keys=self.list_column_keys(level_key=level_key),
+        )
+        if indices is not None:
+            indices = _base.make_index_membership(indices)
+
+        shard_ids = self.list_shard_ids(level_key=level_key, indices=indices)
+        readers = [self._get_reader(shard_id) for shard_id in shard_ids]
+
+        def aggregate_shard(reader):
+            return reader._aggregate_partials(
+                level_key=level_key,
+                aggregations=aggregations,
+                indices=indices,
+                conditions=where,
+                workers=1,
+            )
+
+        partials_of_shards = self._map(aggregate_shard, readers, workers)
+
+        partials = _aggregate.merge_partials_of_blocks(
+            partials_of_blocks=partials_of_shards,
+            aggregations=aggregations,
+            dtypes=dict(self.dtypes[level_key]),
+        )
+        out = {}
+        for column_key in aggregations:
+            out[column_key] = _aggregate.finalize(
+                partial=partials[column_key],
+                aggregations=aggregations[column_key],
+            )
+        return out
+
+    def _query_in_processes(
+        self,
+        processes,
+        indices=None,
+        levels_and_columns=None,
+        sort=False,
+        where=None,
+    ):
+        levels_and_columns, where = _base._prepare_query(
+            handle=self,
+            levels_and_columns=levels_and_columns,
+            where=where,
+        )
+        if indices is not None:
+            membership = _base.make_index_membership(indices)
+        else:
+            membership = None
+
+        tasks = []
+        try:
+            for level_key in levels_and_columns:
+                level_dtype = _base._sub_level_dtypes(
+                    level_dtype=self.dtypes[level_key],
+                    column_keys=levels_and_columns[level_key],
+                )
+                num_rows_of_blocks = {}
+                for shard_id, block_key, stats in self.catalog[level_key]:
+                    num_rows_of_blocks[(shard_id, block_key)] = stats[
+                        "num_rows"
+                    ]
+                shards = self._list_block_keys(
+                    level_key=level_key, indices=membership
+                )
+                for shard_id in shards:
+                    block_keys = shards[shard_id]
+                    step = self.blocks_per_task
+                    for start in range(0, len(block_keys), step):
+                        task_block_keys = block_keys[start : start + step]
+                        max_num_rows = sum(
+                            num_rows_of_blocks[(shard_id, block_key)]
+                            for block_key in task_block_keys
+                        )
+                        tasks.append(
+                            (
+                                _create_shared_memory(
+                                    num_rows=max_num_rows,
+                                    level_dtype=level_dtype,
+                                ),
+                                max_num_rows,
+                                self.paths[shard_id],
+                                level_key,
+                                levels_and_columns[level_key],
+                                task_block_keys,
+                                where.get(level_key, None),
+                            )
+                        )
+
+            with concurrent.futures.ProcessPoolExecutor(
+                processes,
+                initializer=_init_worker,
+                initargs=(_indices_to_send(membership),),
+            ) as pool:
+                futures = [
+                    pool.submit(_read_level_into_shared_memory, task)
+                    for task in tasks
+                ]
+                results = _collect_results(futures)
+
+            out = SparseNumericTable(index_key=self.index_key)
+            for level_key in levels_and_columns:
+                level_results = [
+                    (task[0], num_rows)
+                    for task, num_rows in zip(tasks, results)
+                    if task[3] == level_key
+                ]
+                out[level_key] = _concatenate_from_shared_memory(
+                    level_dtype=_base._sub_level_dtypes(
+                        level_dtype=self.dtypes[level_key],
+                        column_keys=levels_and_columns[level_key],
+                    ),
+                    results=level_results,
+                )
+        finally:
+            for task in tasks:
+                _unlink_shared_memory(task[0])
+
+        if sort:
+            assert indices is not None
+            out = logic.sort_table_on_common_indices(
+                table=out,
+                common_indices=_base._make_sort_indices(
+                    indices=indices,
+                    levels_indices=[out[lk][self.index_key] for lk in out],
+                    where=where,
+                ),
+                inplace=True,
+            )
+        return out
+
+    def close(self):
+        for shard_id in self._readers:
+            self._readers[shard_id].close()
+        self._readers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__:s}(num_shards={len(self.paths):d})"
+
+
+_WORKER = {}
+
+
+def _indices_to_send(membership):
+    """
+    Returns the indices of a membership in a compact form to be sent to the
+    worker processes.
+    """
+    if membership is None or isinstance(membership, IndexSet):
+        return membership
+    return membership.sorted_indices
+
+
+def _init_worker(indices):
+    """
+    Runs once in each worker process. Keeps the indices and the readers of
+    the shards for all tasks of the query.
+    """
+    _WORKER["readers"] = {}
+    if indices is None:
+        _WORKER["indices"] = None
+    else:
+        _WORKER["indices"] = _base.make_index_membership(indices)
+
+
+def _get_worker_reader(path):
+    readers = _WORKER["readers"]
+    if path not in readers:
+        readers[path] = _file_io.open(file=path, mode="r")
+    return readers[path]
+
+
+def _create_shared_memory(num_rows, level_dtype):
+    """
+    Returns the name of a new shared memory for 'num_rows' rows. The
+    calling process creates and unlinks it, so it is tracked only once.
+    Pages which are never written to are not allocated.
+    """
+    shm = shared_memory.SharedMemory(
+        create=True,
+        size=max(1, num_rows * np.dtype(level_dtype).itemsize),
+    )
+    shm.close()
+    return shm.name
+
+
+def _read_level_into_shared_memory(task):
+    """
+    Reads the selected rows of a few blocks of one level in one shard into
+    the shared memory made for the task. Runs in a worker process.
+
+    Returns
+    -------
+    num_rows : int
+        The number of rows written to the shared memory.
+    """
+    (
+        name,
+        max_num_rows,
+        path,
+        level_key,
+        column_keys,
+        block_keys,
+        conditions,
+    ) = task
+    reader = _get_worker_reader(path)
+    level = reader._read_level(
+        level_key=level_key,
+        column_keys=column_keys,
+        indices=_WORKER["indices"],
+        conditions=conditions,
+        workers=1,
+        block_keys=block_keys,
+    ).to_recarray()
+    assert level.shape[0] <= max_num_rows
+    if level.shape[0] == 0:
+        return 0
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        part = np.ndarray(shape=level.shape, dtype=level.dtype, buffer=shm.buf)
+        part[:] = level
+        del part
+    finally:
+        shm.close()
+    return level.shape[0]
+
+
+def _collect_results(futures):
+    """
+    Returns the results of all 'futures' in order. Raises the first error
+    of a failed task after all tasks are done.
+    """
+    results = []
+    error = None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as err:
+            error = err if error is None else error
+    if error is not None:
+        raise error
+    return results
+
+
+def _concatenate_from_shared_memory(level_dtype, results):
+    dtype = np.dtype(level_dtype)
+    out = dynamicsizerecarray.DynamicSizeRecarray(
+        dtype=level_dtype, shape=sum([num_rows for _, num_rows in results])
+    )
+    out_recarray = out.to_recarray()
+    start = 0
+    for name, num_rows in results:
+        if num_rows == 0:
+            continue
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            part = np.ndarray(shape=num_rows, dtype=dtype, buffer=shm.buf)
+            out_recarray[start : start + num_rows] = part
+            del part
+        finally:
+            shm.close()
+        start += num_rows
+    return out
+
+
+def _unlink_shared_memory(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
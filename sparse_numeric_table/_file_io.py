@@ -1,12 +1,35 @@
 import zipfile
+import concurrent.futures
 import numpy as np
 import posixpath
+import builtins
+import os
+import struct
+import functools
+import queue
+import threading
+import weakref
+import collections
+import bisect
 import dynamicsizerecarray
-import gzip
 import copy
+import json
 
 from . import _base
+from . import _aggregate
+from . import _groupby
+from . import _codecs
+from . import _lazy
 from . import logic
+from ._sparse_numeric_table import SparseNumericTable
+
+INDEX_STATS_FILENAME = "__index_stats__.json"
+MANIFEST_FILENAME = "__manifest__.{:06d}.json"
+FORMAT_VERSION_FILENAME = "__format_version__.txt"
+
+# 1: Blocks of columns and the index_key. No member for the version.
+# 2: Adds the statistics of the index of each block, and manifests.
+FORMAT_VERSION = 2
 
 
 def open(
@@ -17,6 +40,12 @@ def open(
     index_key=None,
     compress=True,
     block_size=262_144,
+    workers=None,
+    codec=None,
+    level=None,
+    shuffle=False,
+    block_cache_size=0,
+    sorted_index=False,
 ):
     """
     Write or read a SparseNumericTable.
@@ -30,11 +59,14 @@ def open(
     file : file handle or path (str)
         See zipfile.Zipfile(file)?
     mode : str (default="r")
-        Either "w"rite or "r"ead.
+        Either "w"rite, "r"ead, or "a"ppend. Append adds new blocks to an
+        existing table without rewriting it. When the file does not exist
+        yet, append is the same as write.
     dtypes_and_index_key_from : SparseNumericTable
         When mode="w" (writing), the 'dtypes' and 'index_key' must be known.
         Either from a 'SparseNumericTable' or from parameters 'dtypes' and
-        'index_key'.
+        'index_key'. When mode="a" (appending) to an existing table, they
+        are optional and must match the existing table.
     dtypes : dict
         See parameter 'dtypes_and_index_key_from'.
     index_key : str
@@ -43,10 +75,50 @@ def open(
         Compress internal blocks using gzip when True.
     block_size : int (default=262_144)
         The maximum size of a level block.
+    workers : int (default=None)
+        When mode="r" (reading), the number of threads used to read and
+        decompress the blocks of a level. Blocks are read one after another
+        when None.
+        When mode="w" (writing), the number of threads used to compress the
+        blocks. The blocks are then written by a background thread and
+        append_table() only blocks when too many blocks are pending.
+        Blocks are compressed and written by the caller when None.
+    codec : str (default=None)
+        When mode="w" (writing), the codec to compress internal blocks with.
+        One of ['none', 'gzip', 'zstd', 'lz4']. Overrides 'compress'.
+    level : int (default=None)
+        The codec's compression level. The codec's default when None.
+    shuffle : bool (default=False)
+        Byte-shuffle the blocks of float columns before compression.
+    block_cache_size : int (default=0)
+        When mode="r" (reading), the size in bytes of a cache for decoded
+        blocks which is shared by all queries on the reader. The least
+        recently used blocks are dropped first. No cache when 0.
+    sorted_index : bool (default=False)
+        When mode="w" or "a", require the index of each level to be
+        strictly increasing across all appended rows and record this in the
+        table. Readers then find blocks by binary search.
     """
+    if str.lower(mode) == "a" and _exists(file):
+        return _open_append(
+            file=file,
+            dtypes=dtypes,
+            index_key=index_key,
+            dtypes_and_index_key_from=dtypes_and_index_key_from,
+            compress=compress,
+            block_size=block_size,
+            codec=codec,
+            level=level,
+            shuffle=shuffle,
+            workers=workers,
+            sorted_index=sorted_index,
+        )
+
     if str.lower(mode) == "r":
-        return SparseNumericTableReader(file=file)
-    elif str.lower(mode) == "w":
+        return SparseNumericTableReader(
+            file=file, workers=workers, block_cache_size=block_cache_size
+        )
+    elif str.lower(mode) in ["w", "a"]:
         dtypes, index_key = _get_dtypes_and_index_key(
             dtypes=dtypes,
             index_key=index_key,
@@ -58,26 +130,115 @@ def open(
             index_key=index_key,
             compress=compress,
             block_size=block_size,
+            codec=codec,
+            level=level,
+            shuffle=shuffle,
+            workers=workers,
+            sorted_index=sorted_index,
         )
     else:
         raise KeyError(
-            f"Expected 'mode' to be in ['r', 'w']. But it is '{mode:s}'"
+            f"Expected 'mode' to be in ['r', 'w', 'a']. But it is '{mode:s}'"
+        )
+
+
+def _count_manifests(zip_file):
+    num = 0
+    while True:
+        try:
+            zip_file.getinfo(MANIFEST_FILENAME.format(num))
+        except KeyError:
+            return num
+        num += 1
+
+
+def _exists(file):
+    """
+    Returns False only when 'file' is a path to a file which does not exist.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.exists(file)
+    return True
+
+
+def _open_append(
+    file,
+    dtypes,
+    index_key,
+    dtypes_and_index_key_from,
+    sorted_index=False,
+    **kwargs,
+):
+    with SparseNumericTableReader(file=file) as existing:
+        existing_dtypes = existing.dtypes
+        existing_index_key = existing.index_key
+        existing_has_manifest = existing.has_manifest
+        existing_format_version = existing.format_version
+        next_block_ids = {}
+        last_indices = {}
+        for lk in existing.list_level_keys():
+            block_keys = existing.info[lk][existing.index_key]
+            next_block_ids[lk] = 1 + max([int(bk) for bk in block_keys])
+            if sorted_index:
+                assert existing.is_index_sorted(level_key=lk), (
+                    "mode='a' with 'sorted_index' requires the index of "
+                    f"level '{lk:s}' in the existing table to be sorted."
+                )
+                last_indices[lk] = existing.get_index_max(level_key=lk)
+
+    if dtypes is not None or dtypes_and_index_key_from is not None:
+        dtypes, index_key = _get_dtypes_and_index_key(
+            dtypes=dtypes,
+            index_key=index_key,
+            dtypes_and_index_key_from=dtypes_and_index_key_from,
         )
+        assert _dtypes_are_equal(dtypes, existing_dtypes), (
+            "mode='a' requires 'dtypes' to match the dtypes of the "
+            "existing table."
+        )
+        assert index_key == existing_index_key, (
+            f"mode='a' requires 'index_key' '{index_key:s}' to match the "
+            f"index_key '{existing_index_key:s}' of the existing table."
+        )
+    else:
+        assert index_key is None or index_key == existing_index_key
+
+    return SparseNumericTableWriter(
+        file=file,
+        dtypes=existing_dtypes,
+        index_key=existing_index_key,
+        mode="a",
+        next_block_ids=next_block_ids,
+        manifest=existing_has_manifest,
+        write_format_version=existing_format_version < FORMAT_VERSION,
+        sorted_index=sorted_index,
+        last_indices=last_indices,
+        **kwargs,
+    )
 
 
 class SparseNumericTableLevelWriter:
     def __init__(
         self,
-        zipfile,
+        member_writer,
         level_key,
         level_dtype,
-        compress=False,
+        index_key,
+        codec="none",
+        level=None,
+        shuffle=False,
         block_size=100_000,
+        sorted_index=False,
+        last_index=None,
     ):
-        self.zipfile = zipfile
+        self.member_writer = member_writer
         self.level_key = level_key
         self.level_dtype = level_dtype
-        self.gz = ".gz" if compress else ""
+        self.index_key = index_key
+        _codecs.assert_codec_is_valid(codec)
+        self.codec = codec
+        self.codec_level = level
+        self.shuffle = shuffle
         self.block_size = block_size
         assert self.block_size > 0
         self.block_id = 0
@@ -86,6 +247,9 @@ class SparseNumericTableLevelWriter:
             dtype=self.level_dtype,
         )
         self.size = 0
+        self.blocks = {}
+        self.sorted_index = sorted_index
+        self.last_index = last_index
 
     def _append_level(self, level):
         assert level.shape[0] <= self.block_size
@@ -109,6 +273,9 @@ class SparseNumericTableLevelWriter:
             self.size = new_size
 
     def append_level(self, level):
+        if self.sorted_index:
+            self._assert_index_continues_sorted(level[self.index_key])
+
         block_steps = set(
             np.arange(start=0, stop=level.shape[0], step=self.block_size)
         )
@@ -123,60 +290,410 @@ class SparseNumericTableLevelWriter:
             level_block = level[start:stop]
             self._append_level(level=level_block)
 
+    def _assert_index_continues_sorted(self, indices):
+        if len(indices) == 0:
+            return
+        assert np.all(indices[1:] > indices[:-1]), (
+            f"Expected index of level '{self.level_key:s}' to be strictly "
+            "increasing when 'sorted_index' is set."
+        )
+        if self.last_index is not None:
+            assert indices[0] > self.last_index, (
+                f"Expected index of level '{self.level_key:s}' to continue "
+                f"after {self.last_index} when 'sorted_index' is set, "
+                f"but it starts at {indices[0]}."
+            )
+        self.last_index = indices[-1]
+
+    def _assert_block_continues_sorted(self, stats):
+        if stats["num_rows"] == 0:
+            return
+        assert stats["index_sorted"], (
+            f"Expected the block of level '{self.level_key:s}' to be sorted "
+            "when 'sorted_index' is set."
+        )
+        if self.last_index is not None:
+            assert stats["index_min"] > self.last_index, (
+                f"Expected index of level '{self.level_key:s}' to continue "
+                f"after {self.last_index} when 'sorted_index' is set, "
+                f"but the block starts at {stats['index_min']}."
+            )
+        self.last_index = stats["index_max"]
+
     def flush(self):
         level_block_path = posixpath.join(
             self.level_key, f"{self.block_id:06d}"
         )
 
         for column_key in self.level.dtype.names:
-            column_dtype_key = self.level.dtype[column_key].str
+            column_dtype = self.level.dtype[column_key]
+            shuffle = self.shuffle and _is_shuffled(
+                codec=self.codec, dtype=column_dtype
+            )
+            extensions = _codecs.make_extensions(
+                codec=self.codec, shuffle=shuffle
+            )
             path = posixpath.join(
                 level_block_path,
-                f"{column_key:s}.{column_dtype_key:s}{self.gz:s}",
+                f"{column_key:s}.{column_dtype.str:s}{extensions:s}",
             )
-            with self.zipfile.open(path, mode="w") as fout:
-                payload = self.level[column_key][: self.size].tobytes()
-                if self.gz:
-                    payload = gzip.compress(payload)
-                fout.write(payload)
+            encode = functools.partial(
+                _codecs.encode,
+                payload=self.level[column_key][: self.size].tobytes(),
+                codec=self.codec,
+                level=self.codec_level,
+                shuffle=shuffle,
+                itemsize=column_dtype.itemsize,
+            )
+            self.member_writer.write_encoded(path=path, encode=encode)
+
+        stats = _make_index_stats(
+            indices=self.level[self.index_key][: self.size]
+        )
+        self.write_index_stats(level_block_path=level_block_path, stats=stats)
 
         self.block_id += 1
         self.size = 0
 
+    def write_index_stats(self, level_block_path, stats):
+        """
+        Writes the statistics of the block's index column. A reader can use
+        these to skip blocks which can not contain any of the queried indices
+        without reading the block.
+        The block is also recorded for the manifest.
+        """
+        path = posixpath.join(level_block_path, INDEX_STATS_FILENAME)
+        self.member_writer.write(path=path, payload=json.dumps(stats).encode())
+        self.blocks[f"{self.block_id:06d}"] = {
+            "codec": self.codec,
+            "shuffle": self.shuffle,
+            "index_stats": stats,
+        }
+
+    def copy_block(self, reader, block_key):
+        """
+        Copies a block of this level from a reader without decoding it.
+        The block gets the next block_id of this level. Rows which are still
+        buffered are flushed first to keep the order of the rows.
+        The caller must make sure that the reader's dtypes and codecs match
+        this writer.
+        """
+        stats = reader.get_index_stats(
+            level_key=self.level_key, block_key=block_key
+        )
+        if self.sorted_index:
+            self._assert_block_continues_sorted(stats=stats)
+
+        if self.size > 0:
+            self.flush()
+
+        level_block_path = posixpath.join(
+            self.level_key, f"{self.block_id:06d}"
+        )
+        for column_key in self.level.dtype.names:
+            filename = reader.info[self.level_key][column_key][block_key][
+                "filename"
+            ]
+            path = posixpath.join(
+                level_block_path, posixpath.basename(filename)
+            )
+            with reader.zipfile.open(filename, "r") as fin:
+                self.member_writer.write(path=path, payload=fin.read())
+
+        self.write_index_stats(level_block_path=level_block_path, stats=stats)
+        self.block_id += 1
+
+
+class ZipMemberWriter:
+    """
+    Writes members into a zip file right away.
+    """
+
+    def __init__(self, zipfile):
+        self.zipfile = zipfile
+
+    def write(self, path, payload):
+        with self.zipfile.open(path, mode="w") as fout:
+            fout.write(payload)
+
+    def write_encoded(self, path, encode):
+        """
+        Writes the payload returned by the function 'encode()'.
+        """
+        self.write(path=path, payload=encode())
+
+    def close(self):
+        pass
+
+
+class ThreadedZipMemberWriter:
+    """
+    Encodes the payloads of members in a pool of threads and writes the
+    members into a zip file in a single background thread. The members are
+    written in the order they were submitted. When too many members are
+    pending, submitting blocks until the background thread caught up.
+    """
+
+    def __init__(self, zipfile, workers, max_pending=None):
+        """
+        Parameters
+        ----------
+        zipfile : zipfile.ZipFile
+            Opened for writing. Must not be written to by anyone else.
+        workers : int
+            Number of threads encoding the payloads.
+        max_pending : int (default=None)
+            Maximum number of members waiting to be written.
+            Defaults to 4 * workers.
+        """
+        assert workers > 0
+        if max_pending is None:
+            max_pending = 4 * workers
+        assert max_pending > 0
+
+        self.zipfile = zipfile
+        self.error = None
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._write_pending, daemon=True)
+        self.thread.start()
+
+    def write(self, path, payload):
+        future = concurrent.futures.Future()
+        future.set_result(payload)
+        self._submit(path=path, future=future)
+
+    def write_encoded(self, path, encode):
+        """
+        Encodes the payload by calling 'encode()' in the pool of threads.
+        """
+        self._raise_if_failed()
+        future = self.pool.submit(encode)
+        self._submit(path=path, future=future)
+
+    def _submit(self, path, future):
+        self._raise_if_failed()
+        self.pending.put((path, future))
+
+    def _write_pending(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # keep draining so that submitting never blocks
+            path, future = item
+            try:
+                payload = future.result()
+                with self.zipfile.open(path, mode="w") as fout:
+                    fout.write(payload)
+            except BaseException as error:
+                self.error = error
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            raise RuntimeError("Failed to write zip member.") from self.error
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.pool.shutdown()
+        self._raise_if_failed()
+
 
 class SparseNumericTableWriter:
-    def __init__(self, file, dtypes, index_key, compress, block_size):
-        self.zipfile = zipfile.ZipFile(file=file, mode="w")
-        self.compress = compress
+    def __init__(
+        self,
+        file,
+        dtypes,
+        index_key,
+        compress,
+        block_size,
+        codec=None,
+        level=None,
+        shuffle=False,
+        workers=None,
+        mode="w",
+        next_block_ids=None,
+        manifest=True,
+        write_format_version=True,
+        sorted_index=False,
+        last_indices=None,
+    ):
+        """
+        Parameters
+        ----------
+        mode : str (default="w")
+            Either "w"rite a new table or "a"ppend to an existing one.
+        next_block_ids : dict (default=None)
+            When appending, the block_id of the next block of each level.
+        manifest : bool (default=True)
+            Write a manifest on close. When appending to a table which has
+            no manifest, a manifest would only describe the new blocks.
+        write_format_version : bool (default=True)
+            Write the format version. When appending, only to a table which
+            was written with an older format.
+        sorted_index : bool (default=False)
+            Require the index of each level to be strictly increasing.
+        last_indices : dict (default=None)
+            When appending with 'sorted_index', the largest index of each
+            level in the existing table.
+        """
+        if codec is None:
+            codec = "gzip" if compress else "none"
+        _codecs.assert_codec_is_valid(codec)
+        assert mode in ["w", "a"]
+
+        self.zipfile = zipfile.ZipFile(file=file, mode=mode)
+        if workers is None:
+            self.member_writer = ZipMemberWriter(zipfile=self.zipfile)
+        else:
+            self.member_writer = ThreadedZipMemberWriter(
+                zipfile=self.zipfile, workers=workers
+            )
+        self.compress = codec != "none"
+        self.codec = codec
+        self.codec_level = level
+        self.shuffle = shuffle
         self.block_size = block_size
         self.dtypes = dtypes
         self.index_key = index_key
         self.buffers = {}
-        self.write_index_key()
+        self.manifest = manifest
+        if mode == "w":
+            self.write_index_key()
+            self.manifest_id = 0
+        else:
+            self.manifest_id = _count_manifests(self.zipfile)
+        if mode == "w" or write_format_version:
+            self.write_format_version()
 
         for lk in self.dtypes:
             self.buffers[lk] = SparseNumericTableLevelWriter(
-                zipfile=self.zipfile,
+                member_writer=self.member_writer,
                 level_key=lk,
                 level_dtype=self.dtypes[lk],
-                compress=self.compress,
+                index_key=self.index_key,
+                codec=self.codec,
+                level=self.codec_level,
+                shuffle=self.shuffle,
                 block_size=self.block_size,
+                sorted_index=sorted_index,
             )
+            if last_indices is not None and lk in last_indices:
+                self.buffers[lk].last_index = last_indices[lk]
+            if next_block_ids is not None:
+                self.buffers[lk].block_id = next_block_ids[lk]
 
     def write_index_key(self):
         path = "__index_key__.txt"
-        with self.zipfile.open(path, mode="w") as fout:
-            _index_key_bytes = self.index_key.encode()
-            fout.write(_index_key_bytes)
+        _index_key_bytes = self.index_key.encode()
+        self.member_writer.write(path=path, payload=_index_key_bytes)
+
+    def write_format_version(self):
+        path = FORMAT_VERSION_FILENAME
+        _format_version_bytes = f"{FORMAT_VERSION:d}".encode()
+        self.member_writer.write(path=path, payload=_format_version_bytes)
 
     def append_table(self, table):
         for lk in table:
             self.buffers[lk].append_level(level=table[lk])
 
-    def close(self):
+    def can_copy_blocks_from(self, reader):
+        """
+        Returns True when the blocks of the reader can be copied into this
+        writer without decoding them. This requires the same index_key,
+        dtypes, codec and shuffle, and the reader's blocks must have index
+        statistics and must not be larger than this writer's block_size.
+        When this writer has 'sorted_index', the reader's levels must be
+        sorted and must continue after the indices written so far.
+        """
+        if reader.index_key != self.index_key:
+            return False
+        if not _dtypes_are_equal(reader.dtypes, self.dtypes):
+            return False
+
         for lk in self.buffers:
-            self.buffers[lk].flush()
-        self.zipfile.close()
+            level_writer = self.buffers[lk]
+            for ck in level_writer.level.dtype.names:
+                shuffle = self.shuffle and _is_shuffled(
+                    codec=self.codec, dtype=level_writer.level.dtype[ck]
+                )
+                for bk in reader.info[lk][ck]:
+                    block_info = reader.info[lk][ck][bk]
+                    if block_info["codec"] != self.codec:
+                        return False
+                    if block_info["shuffle"] != shuffle:
+                        return False
+
+            for bk in reader.info[lk][self.index_key]:
+                stats = reader.get_index_stats(level_key=lk, block_key=bk)
+                if stats is None:
+                    return False
+                if stats["num_rows"] > self.block_size:
+                    return False
+
+            if level_writer.sorted_index:
+                ranges = reader._get_sorted_block_ranges(level_key=lk)
+                if ranges is None:
+                    return False
+                _, index_mins, _ = ranges
+                if len(index_mins) > 0 and level_writer.last_index is not None:
+                    if index_mins[0] <= level_writer.last_index:
+                        return False
+        return True
+
+    def copy_blocks_from(self, reader):
+        """
+        Appends all non empty blocks of the reader by copying their
+        compressed payload. See can_copy_blocks_from().
+        """
+        for lk in self.buffers:
+            for bk in reader.info[lk][self.index_key]:
+                stats = reader.get_index_stats(level_key=lk, block_key=bk)
+                if stats["num_rows"] > 0:
+                    self.buffers[lk].copy_block(reader=reader, block_key=bk)
+
+    def write_manifest(self):
+        """
+        Writes the manifest of the blocks written in this session. A reader
+        loads the manifests instead of parsing the filenames of all members.
+        Must be the last member written.
+        """
+        manifest = {
+            "index_key": self.index_key,
+            "num_members": len(self.zipfile.infolist()) + 1,
+            "levels": {},
+        }
+        for lk in self.buffers:
+            level_writer = self.buffers[lk]
+            manifest["levels"][lk] = {
+                "dtype": [
+                    [ck, level_writer.level.dtype[ck].str]
+                    for ck in level_writer.level.dtype.names
+                ],
+                "blocks": level_writer.blocks,
+                "sorted_index": level_writer.sorted_index,
+            }
+        path = MANIFEST_FILENAME.format(self.manifest_id)
+        with self.zipfile.open(path, mode="w") as fout:
+            fout.write(json.dumps(manifest, separators=(",", ":")).encode())
+
+    def close(self):
+        try:
+            try:
+                for lk in self.buffers:
+                    level_writer = self.buffers[lk]
+                    # A level with no block at all gets an empty block to
+                    # preserve its dtypes.
+                    if level_writer.size > 0 or level_writer.block_id == 0:
+                        level_writer.flush()
+            finally:
+                self.member_writer.close()
+            if self.manifest:
+                self.write_manifest()
+        finally:
+            self.zipfile.close()
 
     def __enter__(self):
         return self
@@ -188,19 +705,185 @@ class SparseNumericTableWriter:
         return f"{self.__class__.__name__:s}()"
 
 
+class BlockCache:
+    """
+    A cache of decoded blocks which drops the least recently used blocks
+    first when the size of its blocks would exceed 'max_size' bytes.
+    Safe to be used by multiple threads.
+    """
+
+    def __init__(self, max_size):
+        """
+        Parameters
+        ----------
+        max_size : int
+            Maximum size in bytes of all blocks in the cache.
+        """
+        assert max_size > 0
+        self.max_size = max_size
+        self.size = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the block or None when it is not in the cache.
+        """
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                self.num_hits += 1
+                return self._blocks[key]
+            self.num_misses += 1
+            return None
+
+    def put(self, key, block):
+        """
+        Puts the block into the cache. Blocks larger than 'max_size' are
+        not cached.
+        """
+        with self._lock:
+            if block.nbytes > self.max_size or key in self._blocks:
+                return
+            while self.size + block.nbytes > self.max_size:
+                _, dropped = self._blocks.popitem(last=False)
+                self.size -= dropped.nbytes
+            self._blocks[key] = block
+            self.size += block.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__:s}("
+            f"size={self.size:d}, max_size={self.max_size:d}, "
+            f"num_hits={self.num_hits:d}, num_misses={self.num_misses:d})"
+        )
+
+
 class SparseNumericTableReader:
-    def __init__(self, file):
+    def __init__(self, file, workers=None, block_cache_size=0):
         self.zipfile = zipfile.ZipFile(file=file, mode="r")
+        self.workers = workers
+        if block_cache_size > 0:
+            self.block_cache = BlockCache(max_size=block_cache_size)
+        else:
+            self.block_cache = None
+        if isinstance(file, (str, os.PathLike)):
+            self._path = os.fspath(file)
+        else:
+            self._path = None
         self.infolist = self.zipfile.infolist()
+        self.format_version = self._read_format_version()
+        assert self.format_version <= FORMAT_VERSION, (
+            f"Expected format version <= {FORMAT_VERSION:d}, but the table "
+            f"has format version {self.format_version:d}. "
+            "Update sparse_numeric_table to read it."
+        )
 
         self.info = {}
+        self.index_stats_filenames = {}
+        self._index_stats = {}
         self._index_key = None
+        self.dtypes = {}
+        self._sorted_index = {}
+        self._sorted_block_ranges = {}
+
+        manifests = self._read_manifests()
+        self.has_manifest = manifests is not None
+        if self.has_manifest:
+            self._init_from_manifests(manifests=manifests)
+        else:
+            self._init_from_infolist()
 
+    def _read_format_version(self):
+        """
+        Returns the format version of the table. Tables written before there
+        was a format version are version 1.
+        """
+        try:
+            self.zipfile.getinfo(FORMAT_VERSION_FILENAME)
+        except KeyError:
+            return 1
+        with self.zipfile.open(FORMAT_VERSION_FILENAME, "r") as fin:
+            return int(fin.read().decode())
+
+    def _read_manifests(self):
+        """
+        Returns the manifests written by each writing session, or None when
+        the manifests do not describe all members in the zip file. This is
+        the case for tables written before there were manifests.
+        """
+        manifests = []
+        for manifest_id in range(_count_manifests(self.zipfile)):
+            filename = MANIFEST_FILENAME.format(manifest_id)
+            with self.zipfile.open(filename, "r") as fin:
+                manifests.append(json.loads(fin.read().decode()))
+
+        if len(manifests) == 0:
+            return None
+        if manifests[-1]["num_members"] != len(self.infolist):
+            return None
+        return manifests
+
+    def _init_from_manifests(self, manifests):
+        self._index_key = manifests[0]["index_key"]
+
+        for manifest in manifests:
+            for lk in manifest["levels"]:
+                level = manifest["levels"][lk]
+                level_dtype = [(ck, cd) for ck, cd in level["dtype"]]
+                if lk not in self.info:
+                    self.info[lk] = {}
+                    self.dtypes[lk] = level_dtype
+                    self._index_stats[lk] = {}
+                    self._sorted_index[lk] = True
+                assert self.dtypes[lk] == level_dtype
+                self._sorted_index[lk] &= level.get("sorted_index", False)
+
+                for bk in level["blocks"]:
+                    block = level["blocks"][bk]
+                    self._index_stats[lk][bk] = block["index_stats"]
+                    for ck, cd in level_dtype:
+                        shuffle = block["shuffle"] and _is_shuffled(
+                            codec=block["codec"], dtype=np.dtype(cd)
+                        )
+                        extensions = _codecs.make_extensions(
+                            codec=block["codec"], shuffle=shuffle
+                        )
+                        if ck not in self.info[lk]:
+                            self.info[lk][ck] = {}
+                        self.info[lk][ck][bk] = {
+                            "filename": posixpath.join(
+                                lk, bk, f"{ck:s}.{cd:s}{extensions:s}"
+                            ),
+                            "codec": block["codec"],
+                            "shuffle": shuffle,
+                            "dtype": cd,
+                        }
+
+    def _init_from_infolist(self):
         for item in self.infolist:
             oo = _properties_from_filename(filename=item.filename)
 
             if oo["is_index_key"]:
                 self._index_key = self._read_index_key(filename=item.filename)
+            elif oo["is_manifest"] or oo["is_format_version"]:
+                continue
+            elif oo["is_index_stats"]:
+                lk = oo["level_key"]
+                bk = oo["block_key"]
+                if lk not in self.index_stats_filenames:
+                    self.index_stats_filenames[lk] = {}
+                self.index_stats_filenames[lk][bk] = item.filename
             else:
                 lk = oo["level_key"]
                 ck = oo["column_key"]
@@ -214,18 +897,18 @@ class SparseNumericTableReader:
                 if bk not in self.info[lk][ck]:
                     self.info[lk][ck][bk] = {
                         "filename": item.filename,
-                        "compressed": oo["compressed"],
+                        "codec": oo["codec"],
+                        "shuffle": oo["shuffle"],
                         "dtype": oo["column_dtype_key"],
                     }
 
-        self.dtypes = {}
         for lk in self.list_level_keys():
             self.dtypes[lk] = []
             for ck in self.list_column_keys(lk):
                 block_dtypes = set()
                 for bk in self.info[lk][ck]:
                     block_dtype = self.info[lk][ck][bk]["dtype"]
-                block_dtypes.add(block_dtype)
+                    block_dtypes.add(block_dtype)
                 assert len(block_dtypes) == 1
                 entry = list(block_dtypes)[0]
                 self.dtypes[lk].append((ck, entry))
@@ -240,11 +923,20 @@ class SparseNumericTableReader:
     def list_column_keys(self, level_key):
         return list(self.info[level_key].keys())
 
-    def _get_level(self, level_key, column_keys, indices=None):
+    def _get_level(
+        self,
+        level_key,
+        column_keys,
+        indices=None,
+        conditions=None,
+        workers=None,
+    ):
         return self._read_level(
             level_key=level_key,
             column_keys=column_keys,
             indices=indices,
+            conditions=conditions,
+            workers=workers,
         )
 
     def _read_index_key(self, filename):
@@ -252,69 +944,730 @@ class SparseNumericTableReader:
             _index_key_bytes = fin.read()
             return _index_key_bytes.decode()
 
+    def get_index_stats(self, level_key, block_key):
+        """
+        Returns the statistics of the index column in a block, or None when
+        the file was written without them.
+
+        Returns
+        -------
+        stats : dict or None
+            Contains "num_rows", "index_min", "index_max", and "index_sorted".
+        """
+        lk = level_key
+        bk = block_key
+        if lk in self._index_stats and bk in self._index_stats[lk]:
+            return self._index_stats[lk][bk]
+
+        if lk not in self.index_stats_filenames:
+            return None
+        if bk not in self.index_stats_filenames[lk]:
+            return None
+
+        if lk not in self._index_stats:
+            self._index_stats[lk] = {}
+        if bk not in self._index_stats[lk]:
+            filename = self.index_stats_filenames[lk][bk]
+            with self.zipfile.open(filename, "r") as fin:
+                self._index_stats[lk][bk] = json.loads(fin.read().decode())
+        return self._index_stats[lk][bk]
+
+    def is_index_sorted(self, level_key):
+        """
+        Returns True when the index of the level is strictly increasing
+        across all its blocks. Either the table was written with
+        'sorted_index', or the block statistics show it.
+        """
+        if self._sorted_index.get(level_key, False):
+            return True
+        return self._get_sorted_block_ranges(level_key=level_key) is not None
+
+    def get_index_max(self, level_key):
+        """
+        Returns the largest index of a sorted level, or None when the level
+        is empty.
+        """
+        ranges = self._get_sorted_block_ranges(level_key=level_key)
+        assert ranges is not None, f"Level '{level_key:s}' is not sorted."
+        _, _, index_maxs = ranges
+        return index_maxs[-1] if len(index_maxs) > 0 else None
+
+    def _get_sorted_block_ranges(self, level_key):
+        """
+        Returns the keys, the smallest, and the largest index of the non
+        empty blocks of a level when the block statistics show that the
+        level is sorted. Returns None otherwise.
+        """
+        if level_key not in self._sorted_block_ranges:
+            block_keys = []
+            index_mins = []
+            index_maxs = []
+            for block_key in self.info[level_key][self.index_key]:
+                stats = self.get_index_stats(
+                    level_key=level_key, block_key=block_key
+                )
+                if stats is None or not stats["index_sorted"]:
+                    block_keys = None
+                    break
+                if stats["num_rows"] == 0:
+                    continue
+                if index_maxs and stats["index_min"] <= index_maxs[-1]:
+                    block_keys = None
+                    break
+                block_keys.append(block_key)
+                index_mins.append(stats["index_min"])
+                index_maxs.append(stats["index_max"])
+
+            if block_keys is None:
+                self._sorted_block_ranges[level_key] = None
+            else:
+                self._sorted_block_ranges[level_key] = (
+                    block_keys,
+                    index_mins,
+                    index_maxs,
+                )
+        return self._sorted_block_ranges[level_key]
+
+    def _find_block_keys(self, level_key, indices=None):
+        """
+        Returns the keys of the blocks which may contain any of the
+        'indices'. When the level is sorted, the range of candidate blocks
+        is found by binary search.
+        """
+        block_keys = list(self.info[level_key][self.index_key])
+        if indices is None:
+            return block_keys
+        if indices.size == 0:
+            return []
+
+        if isinstance(indices.min, (int, np.integer)):
+            ranges = self._get_sorted_block_ranges(level_key=level_key)
+            if ranges is not None:
+                sorted_block_keys, index_mins, index_maxs = ranges
+                start = bisect.bisect_left(index_maxs, int(indices.min))
+                stop = bisect.bisect_right(index_mins, int(indices.max))
+                block_keys = sorted_block_keys[start:stop]
+
+        out = []
+        for block_key in block_keys:
+            stats = self.get_index_stats(
+                level_key=level_key, block_key=block_key
+            )
+            if _may_contain_any(stats, indices):
+                out.append(block_key)
+        return out
+
     def _read_level_column_block(self, level_key, column_key, block_key):
-        filename = self.info[level_key][column_key][block_key]["filename"]
+        block_info = self.info[level_key][column_key][block_key]
+        if self._can_memory_map(block_info=block_info):
+            return self._memory_map_level_column_block(block_info=block_info)
+
+        if self.block_cache is None:
+            return self._decode_level_column_block(block_info=block_info)
+
+        cache_key = (level_key, column_key, block_key)
+        block = self.block_cache.get(cache_key)
+        if block is None:
+            block = self._decode_level_column_block(block_info=block_info)
+            self.block_cache.put(cache_key, block)
+        return block
+
+    def _decode_level_column_block(self, block_info):
+        filename = block_info["filename"]
         with self.zipfile.open(filename, "r") as fin:
             payload = fin.read()
-        if self.info[level_key][column_key][block_key]["compressed"]:
-            payload = gzip.decompress(payload)
-        block = np.frombuffer(
-            payload, dtype=self.info[level_key][column_key][block_key]["dtype"]
+        dtype = np.dtype(block_info["dtype"])
+        payload = _codecs.decode(
+            payload=payload,
+            codec=block_info["codec"],
+            shuffle=block_info["shuffle"],
+            itemsize=dtype.itemsize,
         )
+        block = np.frombuffer(payload, dtype=dtype)
         return block
 
-    def _read_level(self, level_key, column_keys, indices=None):
+    def _can_memory_map(self, block_info):
+        if self._path is None:
+            return False
+        if block_info["codec"] != "none" or block_info["shuffle"]:
+            return False
+        zinfo = self.zipfile.getinfo(block_info["filename"])
+        return zinfo.compress_type == zipfile.ZIP_STORED
+
+    def _memory_map_level_column_block(self, block_info):
+        """
+        Returns the block as a read only numpy.memmap into the zip file
+        without copying its payload. Only for blocks which are neither
+        compressed by the table nor by the zip file.
+        """
+        zinfo = self.zipfile.getinfo(block_info["filename"])
+        dtype = np.dtype(block_info["dtype"])
+        if zinfo.file_size == 0:
+            return np.zeros(shape=0, dtype=dtype)
+
+        if "offset" not in block_info:
+            block_info["offset"] = _get_zip_member_payload_offset(
+                path=self._path, zinfo=zinfo
+            )
+        return np.memmap(
+            self._path,
+            dtype=dtype,
+            mode="r",
+            offset=block_info["offset"],
+            shape=zinfo.file_size // dtype.itemsize,
+        )
+
+    def _read_level(
+        self,
+        level_key,
+        column_keys,
+        indices=None,
+        conditions=None,
+        workers=None,
+        block_keys=None,
+    ):
+        """
+        Reads the level in two passes. First, the rows of each block are
+        selected using the index column and the columns of the conditions.
+        Second, the output is allocated once with the exact number of rows
+        and the selected rows of each block are copied into it. Compressed
+        blocks are decoded into a temporary buffer first. Only stored blocks,
+        which are memory mapped, are copied without this extra buffer. Only
+        the blocks in 'block_keys' are read when given.
+        """
         out_dtype = _base._sub_level_dtypes(
             level_dtype=self.dtypes[level_key],
             column_keys=column_keys,
         )
-        out = dynamicsizerecarray.DynamicSizeRecarray(dtype=out_dtype)
+        column_keys = [column_key for column_key, _ in out_dtype]
+
+        block_plans = self._plan_level_blocks(
+            level_key=level_key,
+            indices=indices,
+            conditions=conditions,
+            workers=workers,
+            keep_column_keys=column_keys,
+            block_keys=block_keys,
+        )
+
+        out = dynamicsizerecarray.DynamicSizeRecarray(
+            dtype=out_dtype, shape=sum([p[2] for p in block_plans])
+        )
+        self._fill_level(
+            level_key=level_key,
+            column_keys=column_keys,
+            block_plans=block_plans,
+            out_recarray=out.to_recarray(),
+            workers=workers,
+        )
+        return out
+
+    def _fill_level(
+        self, level_key, column_keys, block_plans, out_recarray, workers=None
+    ):
+        """
+        Writes the rows selected by 'block_plans' into 'out_recarray', which
+        must have exactly as many rows. See _plan_level_blocks().
+        """
+        starts = np.cumsum([0] + [p[2] for p in block_plans])
+        assert out_recarray.shape[0] == starts[-1]
+
+        def read_level_block(i):
+            block_key, mask, num_rows, kept = block_plans[i]
+            for column_key in column_keys:
+                part = out_recarray[column_key][starts[i] : starts[i + 1]]
+                if column_key in kept:
+                    part[:] = kept.pop(column_key)
+                    continue
+                column = self._read_level_column_block(
+                    level_key=level_key,
+                    column_key=column_key,
+                    block_key=block_key,
+                )
+                if mask is None:
+                    part[:] = column
+                else:
+                    np.compress(mask, column, out=part)
+
+        self._map(read_level_block, range(len(block_plans)), workers)
+
+    def _make_level_block_column_getter(self, level_key, block_key):
+        """
+        Returns a function which reads a column of the block, and the dict
+        in which it keeps the columns it has read already.
+        """
+        columns = {}
+
+        def get_column(column_key):
+            if column_key not in columns:
+                columns[column_key] = self._read_level_column_block(
+                    level_key=level_key,
+                    column_key=column_key,
+                    block_key=block_key,
+                )
+            return columns[column_key]
+
+        return get_column, columns
+
+    def _make_level_block_mask(self, get_column, indices, conditions=None):
+        """
+        Returns the mask of the rows in a block which are in 'indices' and
+        which fulfill the 'conditions'.
+        """
+        level_block_indices = get_column(self.index_key)
+
+        if indices is not None:
+            level_block_mask = logic.make_mask_of_right_in_left(
+                left_indices=level_block_indices,
+                right_indices=indices,
+            )
+        else:
+            level_block_mask = np.ones(
+                shape=level_block_indices.shape[0],
+                dtype=bool,
+            )
+
+        if conditions is not None:
+            level_block_mask = _base.make_mask_of_conditions(
+                get_column=get_column,
+                conditions=conditions,
+                mask=level_block_mask,
+            )
+        return level_block_mask
+
+    def _plan_level(
+        self, level_key, indices=None, conditions=None, workers=None
+    ):
+        """
+        Returns the plan to read the rows of a level which are in 'indices'
+        and which fulfill the 'conditions'. Only the index column and the
+        columns of the conditions are read.
+
+        Returns
+        -------
+        plan : list of tuples
+            (block_key, mask, num_rows) for each block with selected rows.
+            The 'mask' is None when all rows of the block are selected.
+        """
+        block_plans = self._plan_level_blocks(
+            level_key=level_key,
+            indices=indices,
+            conditions=conditions,
+            workers=workers,
+        )
+        return [p[0:3] for p in block_plans]
+
+    def _plan_level_blocks(
+        self,
+        level_key,
+        indices=None,
+        conditions=None,
+        workers=None,
+        keep_column_keys=(),
+        block_keys=None,
+    ):
+        """
+        Same as _plan_level() but each tuple has a fourth item. It holds the
+        selected rows of the columns in 'keep_column_keys' which had to be
+        read anyhow to select the rows. When given, the blocks in
+        'block_keys' are planned as they are, without looking up the blocks
+        which may contain the 'indices' again.
+        """
+        if indices is not None:
+            indices = _base.make_index_membership(indices)
+
+        if block_keys is None:
+            block_keys = self._find_block_keys(
+                level_key=level_key, indices=indices
+            )
+
+        def plan_level_block(block_key):
+            get_column, columns = self._make_level_block_column_getter(
+                level_key=level_key, block_key=block_key
+            )
+            mask = self._make_level_block_mask(
+                get_column=get_column,
+                indices=indices,
+                conditions=conditions,
+            )
+            num_rows = int(np.sum(mask))
+            if num_rows == mask.shape[0]:
+                mask = None
+
+            kept = {}
+            if num_rows > 0:
+                for column_key in keep_column_keys:
+                    if column_key in columns:
+                        column = columns[column_key]
+                        kept[column_key] = (
+                            column if mask is None else column[mask]
+                        )
+            return block_key, mask, num_rows, kept
+
+        block_plans = []
+        for block_plan in self._map(plan_level_block, block_keys, workers):
+            if block_plan[2] > 0:
+                block_plans.append(block_plan)
+        return block_plans
+
+    def _read_planned_level_column(
+        self, level_key, column_key, plan, workers=None
+    ):
+        """
+        Returns the column of a level with the rows selected by 'plan',
+        see _plan_level().
+        """
+        dtype = dict(self.dtypes[level_key])[column_key]
+        out = np.empty(shape=sum([n for _, _, n in plan]), dtype=dtype)
 
-        for block_key in self.info[level_key][self.index_key]:
-            level_block_indices = self._read_level_column_block(
+        starts = np.cumsum([0] + [n for _, _, n in plan])
+
+        def read_level_column_block(i):
+            block_key, mask, num_rows = plan[i]
+            column = self._read_level_column_block(
                 level_key=level_key,
-                column_key=self.index_key,
+                column_key=column_key,
                 block_key=block_key,
             )
+            part = out[starts[i] : starts[i] + num_rows]
+            if mask is None:
+                part[:] = column
+            else:
+                np.compress(mask, column, out=part)
+
+        self._map(read_level_column_block, range(len(plan)), workers)
+        return out
+
+    def _map(self, func, items, workers=None):
+        """
+        Returns the results of 'func' on 'items' in order. Uses a pool of
+        threads when there are more than one 'workers'.
+        """
+        if workers is None:
+            workers = self.workers
+        if workers is None or workers <= 1:
+            return list(map(func, items))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(func, items))
+
+    def aggregate(
+        self,
+        level_key,
+        aggregations,
+        indices=None,
+        where=None,
+        workers=None,
+    ):
+        """
+        Returns aggregations of columns in a level without reading the
+        whole level. The blocks are aggregated one by one and the results
+        are merged.
+
+        Parameters
+        ----------
+        level_key : str
+            The level.
+        aggregations : dict
+            For each column a list of aggregations out of "count", "sum",
+            "mean", "min", "max", and ("hist", bin_edges). E.g.
+            {"energy": ["sum", "mean", ("hist", np.geomspace(1, 1e3, 31))]}.
+        indices : list of indices (default=None)
+            Only rows with these indices are aggregated. All rows when None.
+        where : list of conditions (default=None)
+            Only rows which fulfill all conditions are aggregated, e.g.
+            [("column", ">", 1e3)].
+        workers : int (default=None)
+            Number of threads to aggregate blocks in parallel. When None, the
+            reader's 'workers' is used.
+
+        Returns
+        -------
+        aggregations : dict
+            For each column a dict of the aggregations. Mean, min, and max
+            are None when there are no rows.
+        """
+        aggregations = _aggregate.normalize_aggregations(
+            aggregations=aggregations,
+            column_keys=self.list_column_keys(level_key=level_key),
+        )
+        partials = self._aggregate_partials(
+            level_key=level_key,
+            aggregations=aggregations,
+            indices=indices,
+            conditions=where,
+            workers=workers,
+        )
+        out = {}
+        for column_key in aggregations:
+            out[column_key] = _aggregate.finalize(
+                partial=partials[column_key],
+                aggregations=aggregations[column_key],
+            )
+        return out
+
+    def _aggregate_partials(
+        self,
+        level_key,
+        aggregations,
+        indices=None,
+        conditions=None,
+        workers=None,
+    ):
+        if conditions is not None:
+            _base.assert_conditions_are_valid(
+                conditions=conditions,
+                column_keys=self.list_column_keys(level_key=level_key),
+            )
+        if indices is not None:
+            indices = _base.make_index_membership(indices)
+
+        block_keys = self._find_block_keys(
+            level_key=level_key, indices=indices
+        )
 
-            if indices is not None:
-                level_block_mask = logic.make_mask_of_right_in_left(
-                    left_indices=level_block_indices,
-                    right_indices=indices,
+        def aggregate_level_block(block_key):
+            get_column, _ = self._make_level_block_column_getter(
+                level_key=level_key, block_key=block_key
+            )
+            mask = self._make_level_block_mask(
+                get_column=get_column,
+                indices=indices,
+                conditions=conditions,
+            )
+            if np.all(mask):
+                mask = None
+            return _aggregate.make_partials_of_block(
+                get_column=get_column,
+                mask=mask,
+                aggregations=aggregations,
+            )
+
+        return _aggregate.merge_partials_of_blocks(
+            partials_of_blocks=self._map(
+                aggregate_level_block, block_keys, workers
+            ),
+            aggregations=aggregations,
+            dtypes=dict(self.dtypes[level_key]),
+        )
+
+    def group_by(
+        self,
+        by,
+        levels_and_aggregations,
+        indices=None,
+        where=None,
+        workers=None,
+    ):
+        """
+        Returns reductions of columns per group without reading whole
+        levels into memory. Only the index and the column 'by' of the 'by'
+        level are read. The other levels are reduced block by block and
+        blocks without any index of the 'by' level are skipped. See
+        SparseNumericTable.group_by().
+
+        Parameters
+        ----------
+        by : tuple(str, str)
+            The level key and the column key to group by.
+        levels_and_aggregations : dict
+            For each level, for each column a list of reductions out of
+            "count", "sum", "mean", "min", "max", and ("hist", bin_edges).
+        indices : list of indices (default=None)
+            Only rows with these indices are reduced. All rows when None.
+        where : dict (default=None)
+            Only rows which fulfill all conditions of their level are
+            reduced, e.g. {"level": [("column", ">", 1e3)]}.
+        workers : int (default=None)
+            Number of threads to reduce blocks in parallel. When None, the
+            reader's 'workers' is used.
+
+        Returns
+        -------
+        (keys, reductions) : (array, dict)
+            See SparseNumericTable.group_by().
+        """
+        levels_and_aggregations = _groupby.normalize_levels_and_aggregations(
+            levels_and_aggregations=levels_and_aggregations,
+            dtypes=self.dtypes,
+        )
+        if where is None:
+            where = {}
+        for level_key in where:
+            _base.assert_conditions_are_valid(
+                conditions=where[level_key],
+                column_keys=self.list_column_keys(level_key=level_key),
+            )
+
+        by_level_key, by_column_key = by
+        by_table = self.query(
+            indices=indices,
+            levels_and_columns={by_level_key: [self.index_key, by_column_key]},
+            where={by_level_key: where.get(by_level_key, [])},
+            workers=workers,
+        )
+        groups = _groupby.Groups(
+            indices=by_table[by_level_key][self.index_key],
+            keys=by_table[by_level_key][by_column_key],
+        )
+        membership = _base.make_index_membership(groups.sorted_indices)
+
+        partials = {}
+        for level_key in levels_and_aggregations:
+            aggregations = levels_and_aggregations[level_key]
+            conditions = where.get(level_key, None)
+
+            def reduce_level_block(block_key):
+                get_column, _ = self._make_level_block_column_getter(
+                    level_key=level_key, block_key=block_key
                 )
-            else:
-                level_block_mask = np.ones(
-                    shape=level_block_indices.shape[0],
-                    dtype=bool,
+                mask = self._make_level_block_mask(
+                    get_column=get_column,
+                    indices=None,
+                    conditions=conditions,
                 )
-
-            if np.any(level_block_mask):
-                level_block = np.recarray(
-                    shape=level_block_indices.shape[0], dtype=out_dtype
+                if np.all(mask):
+                    return _groupby.reduce_level(
+                        groups=groups,
+                        indices=get_column(self.index_key),
+                        get_column=get_column,
+                        aggregations=aggregations,
+                    )
+                return _groupby.reduce_level(
+                    groups=groups,
+                    indices=get_column(self.index_key)[mask],
+                    get_column=lambda column_key: get_column(column_key)[mask],
+                    aggregations=aggregations,
                 )
-                for column_key, _ in out_dtype:
-                    level_block[column_key] = self._read_level_column_block(
-                        level_key=level_key,
-                        column_key=column_key,
-                        block_key=block_key,
+
+            merged = _groupby.empty_partials(
+                groups=groups,
+                aggregations=aggregations,
+                dtypes=dict(self.dtypes[level_key]),
+            )
+            block_keys = self._find_block_keys(
+                level_key=level_key, indices=membership
+            )
+            for partial in self._map(reduce_level_block, block_keys, workers):
+                for column_key in aggregations:
+                    merged[column_key] = _groupby.merge_partials(
+                        merged[column_key], partial[column_key]
                     )
-                level_block_part = level_block[level_block_mask]
-                out.append(level_block_part)
+            partials[level_key] = merged
 
-        out.shrink_to_fit()
-        return out
+        return groups.keys, _groupby.finalize_levels(
+            partials=partials,
+            levels_and_aggregations=levels_and_aggregations,
+        )
 
     def query(
         self,
         indices=None,
         levels_and_columns=None,
         sort=False,
+        where=None,
+        workers=None,
+        lazy=False,
     ):
+        """
+        Parameters
+        ----------
+        indices : list of indices (default=None)
+            Only rows with these indices are returned. All rows when None.
+        levels_and_columns : dict (default=None)
+            Only these levels and columns are returned. All when None.
+        sort : bool (default=False)
+            Sort the rows of each level in the order of 'indices'. With
+            'where', only the indices left in all levels are kept.
+        where : dict (default=None)
+            Only rows which fulfill all conditions of their level are
+            returned, e.g. {"level": [("column", ">", 1e3)]}. Operators are
+            '<', '<=', '>', '>=', '==', and '!='. In each block, the
+            columns of the conditions are read first and the other columns
+            only when rows are left.
+        workers : int (default=None)
+            Number of threads to read and decompress the blocks of a level.
+            When None, the reader's 'workers' is used.
+        lazy : bool (default=False)
+            Return a LazySparseNumericTable which only reads the index
+            column and the columns of the conditions right away. The other
+            columns are read when they are accessed for the first time.
+            The reader must stay open until then.
+        """
+        if lazy:
+            return self._lazy_query(
+                indices=indices,
+                levels_and_columns=levels_and_columns,
+                sort=sort,
+                where=where,
+                workers=workers,
+            )
         return _base._query(
             handle=self,
             indices=indices,
             levels_and_columns=levels_and_columns,
             sort=sort,
+            where=where,
+            workers=workers,
+        )
+
+    def _lazy_query(
+        self,
+        indices=None,
+        levels_and_columns=None,
+        sort=False,
+        where=None,
+        workers=None,
+    ):
+        levels_and_columns, where = _base._prepare_query(
+            handle=self,
+            levels_and_columns=levels_and_columns,
+            where=where,
+        )
+
+        if indices is not None:
+            membership = _base.make_index_membership(indices)
+        else:
+            membership = None
+
+        levels_and_plans = {}
+        for level_key in levels_and_columns:
+            level_dtype = _base._sub_level_dtypes(
+                level_dtype=self.dtypes[level_key],
+                column_keys=levels_and_columns[level_key],
+            )
+            plan = self._plan_level(
+                level_key=level_key,
+                indices=membership,
+                conditions=where.get(level_key, None),
+                workers=workers,
+            )
+            levels_and_plans[level_key] = (level_dtype, plan)
+
+        if sort:
+            assert indices is not None
+            levels_indices = []
+            if any(where.values()):
+                for level_key in levels_and_plans:
+                    levels_indices.append(
+                        self._read_planned_level_column(
+                            level_key=level_key,
+                            column_key=self.index_key,
+                            plan=levels_and_plans[level_key][1],
+                            workers=workers,
+                        )
+                    )
+            sort_indices = _base._make_sort_indices(
+                indices=indices,
+                levels_indices=levels_indices,
+                where=where,
+            )
+        else:
+            sort_indices = None
+
+        return _lazy.LazySparseNumericTable(
+            reader=self,
+            levels_and_plans=levels_and_plans,
+            sort_indices=sort_indices,
         )
 
     def close(self):
@@ -333,25 +1686,37 @@ class SparseNumericTableReader:
 def _properties_from_filename(filename):
     out = {}
     out["is_index_key"] = False
+    out["is_index_stats"] = False
+    out["is_manifest"] = False
+    out["is_format_version"] = False
 
     if filename == "__index_key__.txt":
         out["is_index_key"] = True
         return out
 
+    if filename == FORMAT_VERSION_FILENAME:
+        out["is_format_version"] = True
+        return out
+
+    if filename.startswith("__manifest__."):
+        out["is_manifest"] = True
+        return out
+
     filename, basename = posixpath.split(filename)
 
-    basename, ext = posixpath.splitext(basename)
-    if ext == ".gz":
-        out["compressed"] = True
-        out["column_key"], out["column_dtype_key"] = posixpath.splitext(
-            basename
-        )
-    else:
-        out["compressed"] = False
-        out["column_key"] = basename
-        out["column_dtype_key"] = ext
+    if basename == INDEX_STATS_FILENAME:
+        out["is_index_stats"] = True
+        out["level_key"], out["block_key"] = posixpath.split(filename)
+        return out
 
-    out["column_dtype_key"] = str.replace(out["column_dtype_key"], ".", "")
+    # column_key.dtype[.shuffle][.codec]
+    # neither the column_key nor the dtype contain a '.'
+    parts = str.split(basename, ".")
+    out["column_key"] = parts[0]
+    out["column_dtype_key"] = parts[1]
+    out["codec"], out["shuffle"] = _codecs.parse_extensions(
+        extensions=["." + part for part in parts[2:]]
+    )
     level_key, block_key = posixpath.split(filename)
 
     out["level_key"] = level_key
@@ -359,6 +1724,58 @@ def _properties_from_filename(filename):
     return out
 
 
+def _is_shuffled(codec, dtype):
+    """
+    Only blocks of float columns which get compressed are byte-shuffled.
+    """
+    return codec != "none" and dtype.kind == "f" and dtype.itemsize > 1
+
+
+def _get_zip_member_payload_offset(path, zinfo):
+    """
+    Returns the offset in bytes of the payload of a member in a zip file.
+    The payload starts after the member's local file header which has a
+    fixed size of 30 bytes followed by the filename and the extra field.
+    """
+    with builtins.open(path, "rb") as f:
+        f.seek(zinfo.header_offset)
+        header = f.read(30)
+    assert header[0:4] == b"PK\x03\x04", "Expected a zip local file header."
+    filename_size, extra_field_size = struct.unpack("<HH", header[26:30])
+    return zinfo.header_offset + 30 + filename_size + extra_field_size
+
+
+def _make_index_stats(indices):
+    num_rows = int(indices.shape[0])
+    if num_rows == 0:
+        return {
+            "num_rows": 0,
+            "index_min": None,
+            "index_max": None,
+            "index_sorted": True,
+        }
+    return {
+        "num_rows": num_rows,
+        "index_min": np.min(indices).item(),
+        "index_max": np.max(indices).item(),
+        "index_sorted": bool(np.all(indices[1:] >= indices[:-1])),
+    }
+
+
+def _may_contain_any(stats, membership):
+    """
+    Returns False only when the block described by 'stats' can not contain
+    any of the indices in 'membership'.
+    """
+    if stats is None:
+        return True
+    if stats["num_rows"] == 0:
+        return False
+    return membership.any_in_range(
+        start=stats["index_min"], stop=stats["index_max"]
+    )
+
+
 def concatenate_files(
     input_paths,
     output_path,
@@ -377,8 +1794,23 @@ def concatenate_files(
     ) as tout:
         for input_path in input_paths:
             with open(input_path, mode="r") as tin:
-                part = tin.query()
-                tout.append_table(part)
+                if tout.can_copy_blocks_from(tin):
+                    tout.copy_blocks_from(tin)
+                else:
+                    part = tin.query()
+                    tout.append_table(part)
+
+
+def _dtypes_are_equal(a, b):
+    if set(a.keys()) != set(b.keys()):
+        return False
+    for lk in a:
+        if len(a[lk]) != len(b[lk]):
+            return False
+        for (ack, adt), (bck, bdt) in zip(a[lk], b[lk]):
+            if ack != bck or np.dtype(adt) != np.dtype(bdt):
+                return False
+    return True
 
 
 def _get_dtypes_and_index_key(dtypes, index_key, dtypes_and_index_key_from):
@@ -412,9 +1844,20 @@ class LevelBlockLooper:
     Read and return the internal 'blocks' of the sparse_numeric_table's
     internal storage block structure. This will read and loop over all the
     'blocks' from a specific 'level' with name 'level_key'.
+
+    Optionally, the next blocks are read ahead in a background thread, and
+    the blocks are coalesced or split into chunks of 'chunk_size' rows.
     """
 
-    def __init__(self, reader, level_key):
+    def __init__(
+        self,
+        reader,
+        level_key,
+        block_keys=None,
+        column_keys=None,
+        read_ahead=0,
+        chunk_size=None,
+    ):
         """
         Parameters
         ----------
@@ -422,46 +1865,340 @@ class LevelBlockLooper:
             Reader for tables.
         level_key : str
             Name of the level to be read and looped over.
+        block_keys : list of str (default=None)
+            Only loop over these blocks. All blocks when None.
+        column_keys : list of str, or "__all__" (default=None)
+            Only read these columns. All when None.
+        read_ahead : int (default=0)
+            Number of blocks to read and decode ahead in a background thread
+            while the current block is processed. No thread when 0.
+        chunk_size : int (default=None)
+            Return chunks of this many rows, only the last chunk may be
+            smaller. Blocks are coalesced or split as needed, and empty
+            blocks are skipped. Returns the blocks as they are when None.
         """
         self.reader = reader
         self.level_key = level_key
         assert (
             level_key in self.reader.dtypes
         ), "Expected level '{level_key:s}' to be in reader's table."
-        self.block_keys = list(
-            self.reader.info[level_key][self.reader.index_key].keys()
+        if block_keys is None:
+            block_keys = self.reader.info[level_key][self.reader.index_key]
+        self.block_keys = list(block_keys)
+        self.dtype = _base._sub_level_dtypes(
+            level_dtype=self.reader.dtypes[level_key],
+            column_keys=column_keys,
+        )
+        assert read_ahead >= 0, "Expected read_ahead >= 0."
+        self.read_ahead = read_ahead
+        if chunk_size is not None:
+            assert chunk_size > 0, "Expected chunk_size > 0."
+        self.chunk_size = chunk_size
+
+        blocks = _iter_level_blocks(
+            reader=self.reader,
+            level_key=self.level_key,
+            dtype=self.dtype,
+            block_keys=self.block_keys,
         )
-        self._i_block = 0
+
+        # The thread and the generators must not refer to this looper.
+        # Otherwise the looper would never be collected and its finalizer
+        # would never stop the thread.
+        self._stop = threading.Event()
+        self._closed = False
+        self._thread = None
+        if self.read_ahead > 0:
+            self._queue = queue.Queue(maxsize=self.read_ahead)
+            self._thread = threading.Thread(
+                target=_read_ahead,
+                kwargs={
+                    "blocks": blocks,
+                    "out_queue": self._queue,
+                    "stop": self._stop,
+                },
+                daemon=True,
+            )
+            self._thread.start()
+            blocks = _iter_read_ahead_blocks(out_queue=self._queue)
+        self._finalizer = weakref.finalize(self, self._stop.set)
+
+        if self.chunk_size is not None:
+            blocks = _iter_chunks(blocks=blocks, chunk_size=self.chunk_size)
+        self._blocks = blocks
+
+    def close(self):
+        """
+        Stops reading ahead. Afterwards, the looper returns no more blocks.
+        When the looper is dropped without close(), reading ahead is stopped
+        once the looper is garbage collected.
+        """
+        self._closed = True
+        self._finalizer()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
 
     def __next__(self):
-        if self._i_block == len(self.block_keys):
+        if self._closed:
             raise StopIteration
+        try:
+            return next(self._blocks)
+        except StopIteration:
+            self.close()
+            raise
 
-        index_column = self.reader._read_level_column_block(
-            level_key=self.level_key,
-            column_key=self.reader.index_key,
-            block_key=self.block_keys[self._i_block],
-        )
-        out = np.recarray(
-            shape=index_column.shape[0],
-            dtype=self.reader.dtypes[self.level_key],
-        )
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
 
-        for column_dtype in self.reader.dtypes[self.level_key]:
-            column_key, _ = column_dtype
-            column = self.reader._read_level_column_block(
-                level_key=self.level_key,
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__:s}()"
+
+
+def _read_level_block(reader, level_key, dtype, block_key):
+    index_column = reader._read_level_column_block(
+        level_key=level_key,
+        column_key=reader.index_key,
+        block_key=block_key,
+    )
+    out = np.recarray(shape=index_column.shape[0], dtype=dtype)
+
+    for column_key, _ in dtype:
+        if column_key == reader.index_key:
+            column = index_column
+        else:
+            column = reader._read_level_column_block(
+                level_key=level_key,
                 column_key=column_key,
-                block_key=self.block_keys[self._i_block],
+                block_key=block_key,
+            )
+        out[column_key] = column
+    return out
+
+
+def _iter_level_blocks(reader, level_key, dtype, block_keys):
+    for block_key in block_keys:
+        yield _read_level_block(
+            reader=reader,
+            level_key=level_key,
+            dtype=dtype,
+            block_key=block_key,
+        )
+
+
+def _read_ahead(blocks, out_queue, stop):
+    """
+    Runs in the background thread of a LevelBlockLooper.
+    """
+    try:
+        for block in blocks:
+            if not _put(out_queue=out_queue, stop=stop, item=("block", block)):
+                return
+        _put(out_queue=out_queue, stop=stop, item=("end", None))
+    except BaseException as err:
+        _put(out_queue=out_queue, stop=stop, item=("error", err))
+
+
+def _put(out_queue, stop, item):
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_read_ahead_blocks(out_queue):
+    while True:
+        kind, payload = out_queue.get()
+        if kind == "end":
+            return
+        if kind == "error":
+            raise RuntimeError(
+                "Failed to read block ahead in background."
+            ) from payload
+        yield payload
+
+
+def _iter_chunks(blocks, chunk_size):
+    """
+    Yields chunks of 'chunk_size' rows from 'blocks'. Only the last chunk
+    may be smaller.
+    """
+    parts = []
+    size = 0
+    for block in blocks:
+        start = 0
+        while start < block.shape[0]:
+            take = min(chunk_size - size, block.shape[0] - start)
+            parts.append(block[start : start + take])
+            size += take
+            start += take
+            if size == chunk_size:
+                yield _concatenate_recarrays(parts)
+                parts = []
+                size = 0
+    if size > 0:
+        yield _concatenate_recarrays(parts)
+
+
+def _concatenate_recarrays(parts):
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts).view(np.recarray)
+
+
+class AlignedBlockLooper:
+    """
+    Loops over several levels at once in chunks of aligned index ranges.
+    Each chunk covers the index range of one block of the 'root' level and
+    contains the rows of all levels with indices in this range. The levels
+    must be sorted by index, see open(mode="w", sorted_index=True). Using
+    the statistics of the blocks, every block of every level is read only
+    once and only a few blocks are held in memory at a time.
+    """
+
+    def __init__(self, reader, levels_and_columns=None, root_level_key=None):
+        """
+        Parameters
+        ----------
+        reader : sparse_numeric_table.SparseNumericTableReader
+            Reader for tables.
+        levels_and_columns : dict (default=None)
+            Only these levels and columns are returned. All when None.
+        root_level_key : str (default=None)
+            The level whose blocks define the index ranges of the chunks.
+            The first level in 'levels_and_columns' when None.
+        """
+        self.reader = reader
+        self.levels_and_columns, _ = _base._prepare_query(
+            handle=reader,
+            levels_and_columns=levels_and_columns,
+        )
+        if root_level_key is None:
+            root_level_key = list(self.levels_and_columns.keys())[0]
+        assert (
+            root_level_key in self.levels_and_columns
+        ), f"Expected root level '{root_level_key:s}' to be looped over."
+        self.root_level_key = root_level_key
+
+        self._cursors = {}
+        for level_key in self.levels_and_columns:
+            self._cursors[level_key] = _SortedLevelCursor(
+                reader=reader,
+                level_key=level_key,
+                column_keys=self.levels_and_columns[level_key],
             )
-            out[column_key] = column
 
-        self._i_block += 1
+        root = self._cursors[self.root_level_key]
+        self._stops = list(root.index_mins[1:]) + [None]
+        self._i_chunk = 0
 
+    def __next__(self):
+        if self._i_chunk == len(self._stops):
+            raise StopIteration
+
+        stop = self._stops[self._i_chunk]
+        out = SparseNumericTable(index_key=self.reader.index_key)
+        for level_key in self._cursors:
+            out[level_key] = self._cursors[level_key].take_until(stop=stop)
+
+        self._i_chunk += 1
         return out
 
+    def __len__(self):
+        return len(self._stops)
+
     def __iter__(self):
         return self
 
     def __repr__(self):
         return f"{self.__class__.__name__:s}()"
+
+
+class _SortedLevelCursor:
+    """
+    Reads the blocks of a sorted level in order and hands out its rows in
+    ranges of increasing indices.
+    """
+
+    def __init__(self, reader, level_key, column_keys):
+        assert reader.is_index_sorted(level_key=level_key), (
+            f"Expected level '{level_key:s}' to be sorted by index. "
+            "Write the table with sorted_index=True."
+        )
+        ranges = reader._get_sorted_block_ranges(level_key=level_key)
+        assert (
+            ranges is not None
+        ), f"Expected statistics for the blocks of level '{level_key:s}'."
+        self.reader = reader
+        self.level_key = level_key
+        self.block_keys, self.index_mins, _ = ranges
+        self.out_dtype = _base._sub_level_dtypes(
+            level_dtype=reader.dtypes[level_key],
+            column_keys=column_keys,
+        )
+        self._read_column_keys = [reader.index_key] + [
+            column_key
+            for column_key, _ in self.out_dtype
+            if column_key != reader.index_key
+        ]
+        self._i_block = 0
+        level_dtype = dict(reader.dtypes[level_key])
+        self._buffer = {}
+        for column_key in self._read_column_keys:
+            self._buffer[column_key] = [
+                np.zeros(shape=0, dtype=level_dtype[column_key])
+            ]
+
+    def take_until(self, stop=None):
+        """
+        Returns the rows with indices below 'stop', or all remaining rows
+        when 'stop' is None.
+        """
+        while self._i_block < len(self.block_keys) and (
+            stop is None or self.index_mins[self._i_block] < stop
+        ):
+            self._read_next_block()
+
+        index = _concatenate(self._buffer[self.reader.index_key])
+        if stop is None:
+            num = index.shape[0]
+        else:
+            num = int(np.searchsorted(index, stop, side="left"))
+
+        out = dynamicsizerecarray.DynamicSizeRecarray(
+            dtype=self.out_dtype, shape=num
+        )
+        out_recarray = out.to_recarray()
+        for column_key in self._read_column_keys:
+            column = _concatenate(self._buffer[column_key])
+            if column_key in out_recarray.dtype.names:
+                out_recarray[column_key] = column[:num]
+            self._buffer[column_key] = [column[num:]]
+        return out
+
+    def _read_next_block(self):
+        block_key = self.block_keys[self._i_block]
+        for column_key in self._read_column_keys:
+            self._buffer[column_key].append(
+                self.reader._read_level_column_block(
+                    level_key=self.level_key,
+                    column_key=column_key,
+                    block_key=block_key,
+                )
+            )
+        self._i_block += 1
+
+
+def _concatenate(arrays):
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.concatenate(arrays)
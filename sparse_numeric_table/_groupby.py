@@ -0,0 +1,244 @@
+"""
+Reductions of the columns of levels per group. The group of a row is
+taken from a column in another level (the 'by' level) where the row's index
+is found. The levels are joined by index with a binary search in the sorted
+index of the 'by' level. No rectangular table is made.
+"""
+
+import numpy as np
+
+from . import _aggregate
+
+
+class Groups:
+    """
+    The groups of the indices in the 'by' level.
+    """
+
+    def __init__(self, indices, keys):
+        """
+        Parameters
+        ----------
+        indices : array of int/uint
+            The index column of the 'by' level. Must be unique.
+        keys : array
+            The column of the 'by' level to group by.
+        """
+        indices = np.asarray(indices)
+        keys = np.asarray(keys)
+        assert indices.shape == keys.shape
+
+        self.keys, group_ids = np.unique(keys, return_inverse=True)
+        group_ids = group_ids.reshape(-1)
+        if np.all(indices[1:] > indices[:-1]):
+            self.sorted_indices = indices
+            self.sorted_group_ids = group_ids
+        else:
+            order = np.argsort(indices, kind="stable")
+            self.sorted_indices = indices[order]
+            self.sorted_group_ids = group_ids[order]
+            assert np.all(
+                self.sorted_indices[1:] != self.sorted_indices[:-1]
+            ), "Expected the indices of the 'by' level to be unique."
+
+    @property
+    def num(self):
+        return self.keys.shape[0]
+
+    def find(self, indices):
+        """
+        Returns a mask of the 'indices' which are in the 'by' level, and the
+        group ids of these indices.
+        """
+        indices = np.asarray(indices)
+        if self.sorted_indices.shape[0] == 0:
+            return (
+                np.zeros(shape=indices.shape[0], dtype=bool),
+                np.zeros(shape=0, dtype=int),
+            )
+        positions = np.searchsorted(self.sorted_indices, indices)
+        positions[positions == self.sorted_indices.shape[0]] = 0
+        found = self.sorted_indices[positions] == indices
+        return found, self.sorted_group_ids[positions[found]]
+
+
+def make_partial(group_ids, values, aggregations, num_groups):
+    """
+    Returns the partial reductions per group of a column's 'values'.
+    The 'min' and 'max' of groups without rows are zero.
+    """
+    names = [name for name, _ in aggregations]
+    out = {"count": np.bincount(group_ids, minlength=num_groups)}
+
+    order = np.argsort(group_ids, kind="stable")
+    sorted_group_ids = group_ids[order]
+    sorted_values = values[order]
+    if sorted_group_ids.shape[0] > 0:
+        starts = np.r_[
+            0,
+            np.flatnonzero(sorted_group_ids[1:] != sorted_group_ids[:-1]) + 1,
+        ]
+    else:
+        starts = np.zeros(shape=0, dtype=int)
+
+    def reduce_per_group(ufunc, dtype):
+        reduced = np.zeros(shape=num_groups, dtype=dtype)
+        if starts.shape[0] > 0:
+            reduced[sorted_group_ids[starts]] = ufunc.reduceat(
+                sorted_values.astype(dtype, copy=False), starts
+            )
+        return reduced
+
+    if "sum" in names or "mean" in names:
+        sum_dtype = np.sum(np.zeros(shape=0, dtype=values.dtype)).dtype
+        out["sum"] = reduce_per_group(np.add, sum_dtype)
+    if "min" in names:
+        out["min"] = reduce_per_group(np.minimum, values.dtype)
+    if "max" in names:
+        out["max"] = reduce_per_group(np.maximum, values.dtype)
+    for name, bin_edges in aggregations:
+        if name == "hist":
+            out["hist"] = _histogram_per_group(
+                group_ids=group_ids,
+                values=values,
+                bin_edges=bin_edges,
+                num_groups=num_groups,
+            )
+    return out
+
+
+def _histogram_per_group(group_ids, values, bin_edges, num_groups):
+    num_bins = bin_edges.shape[0] - 1
+    bins = np.searchsorted(bin_edges, values, side="right") - 1
+    # The last bin includes its upper edge, same as in np.histogram().
+    bins[values == bin_edges[-1]] = num_bins - 1
+    valid = (bins >= 0) & (bins < num_bins)
+    counts = np.bincount(
+        group_ids[valid] * num_bins + bins[valid],
+        minlength=num_groups * num_bins,
+    )
+    return counts.reshape((num_groups, num_bins))
+
+
+def merge_partials(a, b):
+    """
+    Returns the partial reductions of the union of the rows of 'a' and 'b'.
+    """
+    out = {"count": a["count"] + b["count"]}
+    if "sum" in a:
+        out["sum"] = a["sum"] + b["sum"]
+    for name, ufunc in [("min", np.minimum), ("max", np.maximum)]:
+        if name in a:
+            out[name] = np.where(
+                a["count"] == 0,
+                b[name],
+                np.where(b["count"] == 0, a[name], ufunc(a[name], b[name])),
+            )
+    if "hist" in a:
+        out["hist"] = a["hist"] + b["hist"]
+    return out
+
+
+def finalize(partial, aggregations):
+    """
+    Returns the requested reductions per group from the merged 'partial'.
+    The 'mean' of groups without rows is NaN.
+    """
+    out = {}
+    for name, _ in aggregations:
+        if name == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out["mean"] = partial["sum"] / partial["count"]
+        else:
+            out[name] = partial[name]
+    return out
+
+
+def reduce_level(groups, indices, get_column, aggregations):
+    """
+    Returns the partial reductions of the columns of a level (or a block of
+    it) per group. Rows whose index is not in the 'by' level are skipped.
+
+    Parameters
+    ----------
+    groups : Groups
+        The groups of the 'by' level.
+    indices : array
+        The index column of the level.
+    get_column : function(column_key) -> array
+        Returns a column of the level.
+    aggregations : dict
+        The normalized aggregations of the level's columns, see
+        _aggregate.normalize_aggregations().
+    """
+    found, group_ids = groups.find(indices)
+    all_found = np.all(found)
+    out = {}
+    for column_key in aggregations:
+        column = get_column(column_key)
+        out[column_key] = make_partial(
+            group_ids=group_ids,
+            values=column if all_found else column[found],
+            aggregations=aggregations[column_key],
+            num_groups=groups.num,
+        )
+    return out
+
+
+def empty_partials(groups, aggregations, dtypes):
+    out = {}
+    for column_key in aggregations:
+        out[column_key] = make_partial(
+            group_ids=np.zeros(shape=0, dtype=int),
+            values=np.zeros(shape=0, dtype=dtypes[column_key]),
+            aggregations=aggregations[column_key],
+            num_groups=groups.num,
+        )
+    return out
+
+
+def normalize_levels_and_aggregations(levels_and_aggregations, dtypes):
+    """
+    Returns the aggregations of each level normalized, see
+    _aggregate.normalize_aggregations(). Raises KeyError for unknown
+    levels, columns, and aggregations.
+    """
+    out = {}
+    for level_key in levels_and_aggregations:
+        if level_key not in dtypes:
+            raise KeyError(f"Level '{level_key:s}' is not in table.")
+        out[level_key] = _aggregate.normalize_aggregations(
+            aggregations=levels_and_aggregations[level_key],
+            column_keys=[column_key for column_key, _ in dtypes[level_key]],
+        )
+    return out
+
+
+def finalize_levels(partials, levels_and_aggregations):
+    out = {}
+    for level_key in levels_and_aggregations:
+        out[level_key] = {}
+        for column_key in levels_and_aggregations[level_key]:
+            out[level_key][column_key] = finalize(
+                partial=partials[level_key][column_key],
+                aggregations=levels_and_aggregations[level_key][column_key],
+            )
+    return out
+
+
+def make_levels_and_columns(by, levels_and_aggregations, index_key, where):
+    """
+    Returns the levels and columns needed to reduce per group.
+    """
+    by_level_key, by_column_key = by
+    out = {by_level_key: [index_key, by_column_key]}
+    for level_key in levels_and_aggregations:
+        if level_key not in out:
+            out[level_key] = [index_key]
+        for column_key in levels_and_aggregations[level_key]:
+            if column_key not in out[level_key]:
+                out[level_key].append(column_key)
+    for level_key in where:
+        if level_key not in out:
+            out[level_key] = [index_key]
+    return out
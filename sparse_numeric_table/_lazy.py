@@ -0,0 +1,166 @@
+from ._sparse_numeric_table import SparseNumericTable
+from . import logic
+
+import copy
+import numpy as np
+from dynamicsizerecarray import DynamicSizeRecarray
+
+
+class LazySparseNumericTable:
+    """
+    The result of a query on a reader with lazy=True. Holds which rows of
+    which blocks were selected, but reads a column only when it is accessed
+    for the first time. Has the same mapping interface as
+    SparseNumericTable.
+
+    The reader must stay open while columns are accessed.
+    """
+
+    def __init__(self, reader, levels_and_plans, sort_indices=None):
+        """
+        Parameters
+        ----------
+        reader : SparseNumericTableReader
+            The reader the query ran on.
+        levels_and_plans : dict
+            For each level, the level's dtype and its plan, see
+            SparseNumericTableReader._plan_level().
+        sort_indices : array of indices (default=None)
+            When given, the rows of each level are in the order of
+            'sort_indices'.
+        """
+        self._index_key = copy.copy(reader.index_key)
+        self._table = {}
+        for level_key in levels_and_plans:
+            level_dtype, plan = levels_and_plans[level_key]
+            self._table[level_key] = LazyLevel(
+                reader=reader,
+                level_key=level_key,
+                dtype=level_dtype,
+                plan=plan,
+                sort_indices=sort_indices,
+            )
+
+    def __getitem__(self, level_key):
+        return self._table[level_key]
+
+    def __iter__(self):
+        return self._table.__iter__()
+
+    def keys(self):
+        return self._table.keys()
+
+    def list_level_keys(self):
+        return list(self._table.keys())
+
+    def list_column_keys(self, level_key):
+        return list(self._table[level_key].dtype.names)
+
+    @property
+    def index_key(self):
+        return copy.copy(self._index_key)
+
+    @property
+    def dtypes(self):
+        out = {}
+        for lk in self._table:
+            out[lk] = self._table[lk].level_dtype
+        return out
+
+    @property
+    def shapes(self):
+        out = {}
+        for lk in self._table:
+            out[lk] = self._table[lk].shape
+        return out
+
+    def materialize(self):
+        """
+        Returns a SparseNumericTable with all columns read.
+        """
+        out = SparseNumericTable(index_key=self.index_key)
+        for lk in self._table:
+            out[lk] = self._table[lk].materialize()
+        return out
+
+    def __repr__(self):
+        return f"{self.__class__.__name__:s}(index_key='{self._index_key:s}')"
+
+
+class LazyLevel:
+    """
+    A level of a LazySparseNumericTable. Reads a column on first access and
+    keeps it.
+    """
+
+    def __init__(self, reader, level_key, dtype, plan, sort_indices=None):
+        self._reader = reader
+        self._level_key = level_key
+        self.level_dtype = dtype
+        self.dtype = np.dtype(dtype)
+        self._plan = plan
+        self._sort_indices = sort_indices
+        self._order = None
+        self._columns = {}
+        self._size = sum([num_rows for _, _, num_rows in plan])
+
+    def __getitem__(self, column_key):
+        if column_key not in self._columns:
+            assert column_key in self.dtype.names, (
+                f"Column '{column_key:s}' was not queried "
+                f"in level '{self._level_key:s}'."
+            )
+            column = self._read_column(column_key)
+            if self._sort_indices is not None:
+                column = column[self._get_order()]
+            self._columns[column_key] = column
+        return self._columns[column_key]
+
+    def _read_column(self, column_key):
+        return self._reader._read_planned_level_column(
+            level_key=self._level_key,
+            column_key=column_key,
+            plan=self._plan,
+        )
+
+    def _get_order(self):
+        if self._order is None:
+            self._order = logic._make_gather_positions(
+                level_indices=self._read_column(self._reader.index_key),
+                indices=self._sort_indices,
+            )
+        return self._order
+
+    def keys(self):
+        return list(self.dtype.names)
+
+    def is_read(self, column_key):
+        """
+        Returns True when the column was already read.
+        """
+        return column_key in self._columns
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def __len__(self):
+        if self._sort_indices is not None:
+            return self._get_order().shape[0]
+        return self._size
+
+    def materialize(self):
+        """
+        Returns the level as a DynamicSizeRecarray with all columns read.
+        """
+        out = DynamicSizeRecarray(shape=len(self), dtype=self.level_dtype)
+        out_recarray = out.to_recarray()
+        for column_key in self.dtype.names:
+            out_recarray[column_key] = self[column_key]
+        return out
+
+    def to_recarray(self):
+        return self.materialize().to_recarray()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__:s}(level_key='{self._level_key:s}')"
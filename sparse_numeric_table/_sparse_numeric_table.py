@@ -6,6 +6,7 @@ from dynamicsizerecarray import DynamicSizeRecarray
 
 from . import validating
 from . import _base
+from . import _groupby
 
 
 class SparseNumericTable:
@@ -24,6 +25,7 @@ class SparseNumericTable:
 
     def __init__(self, index_key, dtypes=None):
         self.set_index_key(index_key=index_key)
+        self._is_rectangular = False
 
         if dtypes is None:
             self._table = {}
@@ -53,6 +55,7 @@ class SparseNumericTable:
                 f"but got '{repr(lr):s}'"
             )
         self._table[lk] = lr
+        self._is_rectangular = False
 
         validating.assert_all_levels_have_index_key(
             dtypes=self.dtypes, index_key=self.index_key
@@ -77,6 +80,7 @@ class SparseNumericTable:
         other : SparseNumericTable
             Will be appended to 'self'.
         """
+        self._is_rectangular = False
         for level_key in other.keys():
             _level_recarray = other[level_key].to_recarray()
 
@@ -94,13 +98,27 @@ class SparseNumericTable:
     def keys(self):
         return self._table.keys()
 
+    @property
+    def is_rectangular(self):
+        """
+        True when the table came out of logic.cut_and_sort_table_on_indices()
+        and no level was set since. Then the index columns of all levels are
+        equal and exports like logic.make_rectangular_DataFrame() skip
+        comparing them. Changing an index column in place after the cut and
+        sort is not noticed and invalidates the flag. Set the level again to
+        clear the flag.
+        """
+        return self._is_rectangular
+
     def list_level_keys(self):
         return list(self.keys())
 
     def list_column_keys(self, level_key):
         return list(self._table[level_key].dtype.names)
 
-    def _get_level(self, level_key, column_keys, indices=None):
+    def _get_level(
+        self, level_key, column_keys, indices=None, conditions=None
+    ):
         out_dtype = _base._sub_level_dtypes(
             level_dtype=self.dtypes[level_key],
             column_keys=column_keys,
@@ -118,6 +136,13 @@ class SparseNumericTable:
                 dtype=bool,
             )
 
+        if conditions is not None:
+            level_mask = _base.make_mask_of_conditions(
+                get_column=lambda column_key: self[level_key][column_key],
+                conditions=conditions,
+                mask=level_mask,
+            )
+
         out = DynamicSizeRecarray(shape=sum(level_mask), dtype=out_dtype)
         for column_key, _ in out_dtype:
             out[column_key] = self[level_key][column_key][level_mask]
@@ -174,12 +199,96 @@ class SparseNumericTable:
         indices=None,
         levels_and_columns=None,
         sort=False,
+        where=None,
     ):
+        """
+        Parameters
+        ----------
+        indices : list of indices (default=None)
+            Only rows with these indices are returned. All rows when None.
+        levels_and_columns : dict (default=None)
+            Only these levels and columns are returned. All when None.
+        sort : bool (default=False)
+            Sort the rows of each level in the order of 'indices'. With
+            'where', only the indices left in all levels are kept.
+        where : dict (default=None)
+            Only rows which fulfill all conditions of their level are
+            returned, e.g. {"level": [("column", ">", 1e3)]}. Operators are
+            '<', '<=', '>', '>=', '==', and '!='.
+        """
         return _base._query(
             handle=self,
             indices=indices,
             levels_and_columns=levels_and_columns,
             sort=sort,
+            where=where,
+        )
+
+    def group_by(self, by, levels_and_aggregations, indices=None, where=None):
+        """
+        Returns reductions of columns per group without making the table
+        rectangular. The group of a row is the value of the column 'by' in
+        the row with the same index in the 'by' level. Rows whose index is
+        not in the 'by' level are skipped.
+
+        Parameters
+        ----------
+        by : tuple(str, str)
+            The level key and the column key to group by.
+        levels_and_aggregations : dict
+            For each level, for each column a list of reductions out of
+            "count", "sum", "mean", "min", "max", and ("hist", bin_edges).
+            E.g. {"level": {"energy": ["mean", "max"]}}. Each reduction
+            may appear only once per column.
+        indices : list of indices (default=None)
+            Only rows with these indices are reduced. All rows when None.
+        where : dict (default=None)
+            Only rows which fulfill all conditions of their level are
+            reduced, e.g. {"level": [("column", ">", 1e3)]}. Conditions on
+            the 'by' level drop rows from the groups.
+
+        Returns
+        -------
+        (keys, reductions) : (array, dict)
+            The sorted unique values of the column 'by'. For each level, for
+            each column a dict of the reductions. Each reduction is an
+            array with one entry per key, or a 2D array for 'hist'. Groups
+            without rows have a 'mean' of NaN and a 'min' and 'max' of 0.
+        """
+        levels_and_aggregations = _groupby.normalize_levels_and_aggregations(
+            levels_and_aggregations=levels_and_aggregations,
+            dtypes=self.dtypes,
+        )
+        if where is None:
+            where = {}
+        table = self.query(
+            indices=indices,
+            levels_and_columns=_groupby.make_levels_and_columns(
+                by=by,
+                levels_and_aggregations=levels_and_aggregations,
+                index_key=self.index_key,
+                where=where,
+            ),
+            where=where,
+        )
+
+        by_level_key, by_column_key = by
+        groups = _groupby.Groups(
+            indices=table[by_level_key][self.index_key],
+            keys=table[by_level_key][by_column_key],
+        )
+        partials = {}
+        for level_key in levels_and_aggregations:
+            level = table[level_key]
+            partials[level_key] = _groupby.reduce_level(
+                groups=groups,
+                indices=level[self.index_key],
+                get_column=lambda column_key: level[column_key],
+                aggregations=levels_and_aggregations[level_key],
+            )
+        return groups.keys, _groupby.finalize_levels(
+            partials=partials,
+            levels_and_aggregations=levels_and_aggregations,
         )
 
 
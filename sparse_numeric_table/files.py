@@ -1,6 +1,11 @@
 from . import testing
 from . import _file_io
 import numpy as np
+import functools
+import tempfile
+import os
+
+MERGE_FAN_IN = 16
 
 
 def merge(
@@ -11,7 +16,33 @@ def merge(
     block_read_size=262_144,
     open_file_function=None,
     logger=None,
+    tmp_dir=None,
 ):
+    """
+    Writes the tables in 'in_paths' into one table in 'out_path'.
+    Each block of each input table is read only once.
+
+    Parameters
+    ----------
+    out_path : str
+        Path of the output table.
+    in_paths : list of str
+        Paths of the input tables.
+    sort_in_tables : bool (default=False)
+        When True, the rows of each level of each input table are sorted by
+        their index. Levels which are not sorted already are sorted with an
+        external k-way merge over the sorted blocks.
+    compress : bool (default=True)
+        Compress the output table.
+    block_read_size : int (default=262_144)
+        When sorting, the approximate number of rows held in memory.
+    open_file_function : function (default=None)
+        To open the input files. Defaults to builtins.open.
+    logger : logging.Logger (default=None)
+    tmp_dir : str (default=None)
+        Directory for the temporary sorted runs when sorting. Defaults to
+        the system's temporary directory.
+    """
     lg = logger
     if open_file_function is None:
         open_file_function = open
@@ -53,36 +84,215 @@ def merge(
                             f"'{level_key:s}'"
                         ),
                     )
-                    _index_table = in_table.query(
-                        levels_and_columns={level_key: [index_key]},
-                    )
-                    level_indices_all = _index_table[level_key][index_key]
                     if sort_in_tables:
-                        level_indices_all = sorted(level_indices_all)
+                        level_blocks = _iter_sorted_level_blocks(
+                            reader=in_table,
+                            level_key=level_key,
+                            block_read_size=block_read_size,
+                            tmp_dir=tmp_dir,
+                        )
+                    else:
+                        level_blocks = _file_io.LevelBlockLooper(
+                            reader=in_table,
+                            level_key=level_key,
+                        )
 
-                    # read in chunks of index
-                    # this is potentially slow as it reads the level again and
-                    # again but it avoids running out of memory
-                    level_indices_blocks = _split_into_chunks(
-                        x=level_indices_all, chunk_size=block_read_size
-                    )
-                    for bbb in range(len(level_indices_blocks)):
-                        level_indices_block = level_indices_blocks[bbb]
-                        _info(
-                            lg,
-                            (
-                                f"      block "
-                                f"({bbb+1:d} of {len(level_indices_blocks):d})"
+                    for level_block in level_blocks:
+                        out_table.append_table({level_key: level_block})
+    _info(logger, "merge complete")
+
+
+def _iter_sorted_level_blocks(
+    reader, level_key, block_read_size, tmp_dir=None
+):
+    """
+    Yields the rows of a level sorted by their index in blocks.
+
+    When the block statistics show that the blocks are sorted already, the
+    blocks are yielded as they are. Otherwise each block is sorted and
+    written as a sorted run to a temporary table. The runs are then merged
+    in passes of at most MERGE_FAN_IN runs until one run is left. Each run
+    holds a buffer of 'block_read_size' // MERGE_FAN_IN rows, so the memory
+    holds about 'block_read_size' rows no matter how many blocks there are.
+    """
+    if reader.is_index_sorted(level_key=level_key):
+        yield from _file_io.LevelBlockLooper(
+            reader=reader, level_key=level_key
+        )
+        return
+
+    index_key = reader.index_key
+    block_keys = reader.info[level_key][index_key]
+
+    if len(block_keys) <= 1:
+        for level_block in _file_io.LevelBlockLooper(
+            reader=reader, level_key=level_key
+        ):
+            yield _sort_level_block(level_block, index_key)
+        return
+
+    write_runs = functools.partial(
+        _write_runs,
+        level_key=level_key,
+        level_dtype=reader.dtypes[level_key],
+        index_key=index_key,
+        block_size=max(1, block_read_size // MERGE_FAN_IN),
+    )
+
+    with tempfile.TemporaryDirectory(
+        prefix="sparse_numeric_table_", dir=tmp_dir
+    ) as tmp:
+        runs_path = os.path.join(tmp, "sorted_runs.000000.zip")
+        runs_block_keys = write_runs(
+            path=runs_path,
+            runs=(
+                [_sort_level_block(level_block, index_key)]
+                for level_block in _file_io.LevelBlockLooper(
+                    reader=reader, level_key=level_key
+                )
+            ),
+        )
+
+        merge_pass = 0
+        while len(runs_block_keys) > MERGE_FAN_IN:
+            merge_pass += 1
+            next_runs_path = os.path.join(
+                tmp, f"sorted_runs.{merge_pass:06d}.zip"
+            )
+            with _file_io.open(file=runs_path, mode="r") as runs_table:
+                runs_block_keys = write_runs(
+                    path=next_runs_path,
+                    runs=(
+                        _merge_sorted_runs(
+                            runs=_open_runs(
+                                reader=runs_table,
+                                level_key=level_key,
+                                runs_block_keys=group,
                             ),
+                            index_key=index_key,
                         )
-                        out_table.append_table(
-                            in_table.query(
-                                levels_and_columns={level_key: "__all__"},
-                                indices=level_indices_block,
-                                sort=sort_in_tables,
-                            )
+                        for group in _split_into_chunks(
+                            runs_block_keys, MERGE_FAN_IN
                         )
-    _info(logger, "merge complete")
+                    ),
+                )
+            os.remove(runs_path)
+            runs_path = next_runs_path
+
+        with _file_io.open(file=runs_path, mode="r") as runs_table:
+            yield from _merge_sorted_runs(
+                runs=_open_runs(
+                    reader=runs_table,
+                    level_key=level_key,
+                    runs_block_keys=runs_block_keys,
+                ),
+                index_key=index_key,
+            )
+
+
+def _write_runs(path, level_key, level_dtype, index_key, block_size, runs):
+    """
+    Writes each run, an iterable of blocks sorted by their index, into its
+    own blocks of a temporary table. Returns the block keys of each run.
+    """
+    runs_block_keys = []
+    with _file_io.open(
+        file=path,
+        mode="w",
+        dtypes={level_key: level_dtype},
+        index_key=index_key,
+        compress=False,
+        block_size=block_size,
+    ) as runs_table:
+        level_runs_writer = runs_table.buffers[level_key]
+        for run in runs:
+            start = level_runs_writer.block_id
+            for level_block in run:
+                level_runs_writer.append_level(level_block)
+            if level_runs_writer.size > 0:
+                level_runs_writer.flush()
+            stop = level_runs_writer.block_id
+            if stop > start:
+                runs_block_keys.append(
+                    [f"{block_id:06d}" for block_id in range(start, stop)]
+                )
+    return runs_block_keys
+
+
+def _open_runs(reader, level_key, runs_block_keys):
+    return [
+        _SortedRun(reader=reader, level_key=level_key, block_keys=block_keys)
+        for block_keys in runs_block_keys
+    ]
+
+
+def _sort_level_block(level_block, index_key):
+    order = np.argsort(level_block[index_key], kind="stable")
+    return level_block[order]
+
+
+class _SortedRun:
+    """
+    A run of rows sorted by their index. Only one block of the run is held
+    in memory.
+    """
+
+    def __init__(self, reader, level_key, block_keys):
+        self.index_key = reader.index_key
+        self.blocks = _file_io.LevelBlockLooper(
+            reader=reader, level_key=level_key, block_keys=block_keys
+        )
+        self.buffer = None
+        self.next_block()
+
+    def next_block(self):
+        try:
+            self.buffer = next(self.blocks)
+        except StopIteration:
+            self.buffer = None
+
+    @property
+    def exhausted(self):
+        return self.buffer is None
+
+    def first_index(self):
+        return self.buffer[self.index_key][0]
+
+    def last_index(self):
+        return self.buffer[self.index_key][-1]
+
+    def pop_until(self, index):
+        """
+        Returns and removes the rows in the buffer with an index <= 'index'.
+        Reads the next block of the run when the buffer is empty.
+        """
+        num = np.searchsorted(self.buffer[self.index_key], index, side="right")
+        out = self.buffer[:num]
+        self.buffer = self.buffer[num:]
+        if self.buffer.shape[0] == 0:
+            self.next_block()
+        return out
+
+
+def _merge_sorted_runs(runs, index_key):
+    """
+    Yields the rows of all runs sorted by their index.
+    In each step, the rows up to the smallest last index among the runs'
+    buffers are taken from the runs which have any. This empties at least
+    one buffer and only the emptied buffers are refilled.
+    """
+    runs = [run for run in runs if not run.exhausted]
+    while len(runs) > 0:
+        cut = min([run.last_index() for run in runs])
+        parts = [
+            run.pop_until(cut) for run in runs if run.first_index() <= cut
+        ]
+        if len(parts) == 1:
+            yield parts[0]
+        else:
+            merged = np.concatenate(parts).view(np.recarray)
+            yield _sort_level_block(merged, index_key)
+        runs = [run for run in runs if not run.exhausted]
 
 
 def _info(logger, msg):
@@ -90,8 +300,13 @@ def _info(logger, msg):
         logger.info(msg)
 
 
-def sort(in_path, out_path):
-    merge(out_path=out_path, in_paths=[in_path], sort_in_tables=True)
+def sort(in_path, out_path, tmp_dir=None):
+    merge(
+        out_path=out_path,
+        in_paths=[in_path],
+        sort_in_tables=True,
+        tmp_dir=tmp_dir,
+    )
 
 
 def _split_into_chunks(x, chunk_size):
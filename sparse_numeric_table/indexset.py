@@ -0,0 +1,355 @@
+"""
+A compact set of non negative integer indices.
+
+The indices are split into chunks of 2**16 by their high bits. A chunk with
+only a few indices stores their low bits in a sorted array of uint16. A chunk
+with many indices stores them in a bitmap of 2**16 bits. This is the layout
+of roaring bitmaps. Set operations on two bitmaps are done on 64 bit words.
+"""
+
+import bisect
+import numpy as np
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+NUM_WORDS = CHUNK_SIZE // 64
+ARRAY_MAX_SIZE = 4096
+
+_ARRAY_DTYPE = np.dtype("<u2")
+_BITMAP_DTYPE = np.dtype("<u8")
+
+
+class IndexSet:
+    """
+    A set of non negative integer indices, e.g. the uids of a level.
+
+    Can be used wherever a list of indices is expected, e.g. in
+    query(indices=...), in logic.cut_table_on_indices(), and in
+    logic.intersection(), logic.union(), and logic.difference().
+    """
+
+    def __init__(self, indices=None):
+        """
+        Parameters
+        ----------
+        indices : array like of int/uint, or IndexSet (default=None)
+            The indices. Must be non negative. Duplicates are ignored.
+        """
+        self._keys = []
+        self._containers = {}
+        self._size = 0
+
+        if indices is None:
+            return
+        if isinstance(indices, IndexSet):
+            for key in indices._keys:
+                self._add_container(key, indices._containers[key].copy())
+            return
+
+        indices = np.asarray(indices)
+        if indices.shape[0] == 0:
+            return
+        if indices.dtype.kind not in ("i", "u"):
+            msg = "Expected int/uint like dtype "
+            msg += f"but got '{indices.dtype.name:s}'."
+            raise AssertionError(msg)
+        if indices.dtype.kind == "i":
+            assert np.min(indices) >= 0, "Expected indices to be >= 0."
+        indices = indices.astype(np.uint64, copy=False)
+        if not np.all(indices[1:] > indices[:-1]):
+            indices = np.unique(indices)
+
+        highs = indices >> np.uint64(CHUNK_BITS)
+        starts = np.r_[0, np.flatnonzero(highs[1:] != highs[:-1]) + 1]
+        stops = np.r_[starts[1:], indices.shape[0]]
+        for start, stop in zip(starts, stops):
+            lows = (indices[start:stop] & np.uint64(CHUNK_MASK)).astype(
+                _ARRAY_DTYPE
+            )
+            self._add_container(int(highs[start]), _make_container(lows))
+
+    def _add_container(self, key, container):
+        if container is None:
+            return
+        self._keys.append(key)
+        self._containers[key] = container
+        self._size += _cardinality(container)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def min(self):
+        assert self._size > 0, "IndexSet is empty."
+        key = self._keys[0]
+        low = _lows(self._containers[key])[0]
+        return np.uint64((key << CHUNK_BITS) + int(low))
+
+    @property
+    def max(self):
+        assert self._size > 0, "IndexSet is empty."
+        key = self._keys[-1]
+        low = _lows(self._containers[key])[-1]
+        return np.uint64((key << CHUNK_BITS) + int(low))
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self._containers.values())
+
+    def to_array(self, dtype="<u8"):
+        """
+        Returns the indices sorted in a numpy.array.
+        """
+        out = np.zeros(shape=self._size, dtype=dtype)
+        start = 0
+        for key in self._keys:
+            lows = _lows(self._containers[key])
+            stop = start + lows.shape[0]
+            out[start:stop] = (key << CHUNK_BITS) + lows.astype(np.uint64)
+            start = stop
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_array(dtype="<u8" if dtype is None else dtype)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def __contains__(self, index):
+        return bool(self.mask([index])[0])
+
+    def __eq__(self, other):
+        if not isinstance(other, IndexSet):
+            return NotImplemented
+        if self._keys != other._keys:
+            return False
+        for key in self._keys:
+            if not np.array_equal(
+                _lows(self._containers[key]), _lows(other._containers[key])
+            ):
+                return False
+        return True
+
+    def __repr__(self):
+        return f"{self.__class__.__name__:s}(size={self._size:d})"
+
+    def mask(self, left_indices):
+        """
+        Returns a mask for 'left_indices' indicating wheter an index is in
+        this set.
+        """
+        left = np.asarray(left_indices)
+        out = np.zeros(shape=left.shape[0], dtype=bool)
+        if self._size == 0 or left.shape[0] == 0:
+            return out
+        if left.dtype.kind not in ("i", "u"):
+            msg = "Expected int/uint like dtype "
+            msg += f"but got '{left.dtype.name:s}'."
+            raise AssertionError(msg)
+
+        (valid,) = np.nonzero(left >= 0)
+        values = left[valid].astype(np.uint64)
+        highs = values >> np.uint64(CHUNK_BITS)
+
+        keys = np.asarray(self._keys, dtype=np.uint64)
+        pos = np.searchsorted(keys, highs)
+        pos[pos == keys.shape[0]] = 0
+        found = keys[pos] == highs
+        valid = valid[found]
+        values = values[found]
+        pos = pos[found]
+
+        order = np.argsort(pos, kind="stable")
+        counts = np.bincount(pos, minlength=keys.shape[0])
+        start = 0
+        for i, key in enumerate(self._keys):
+            stop = start + counts[i]
+            if stop > start:
+                sel = order[start:stop]
+                lows = (values[sel] & np.uint64(CHUNK_MASK)).astype(
+                    _ARRAY_DTYPE
+                )
+                out[valid[sel]] = _contains(self._containers[key], lows)
+            start = stop
+        return out
+
+    def any_in_range(self, start, stop):
+        """
+        Returns True when any index 'i' is in start <= i <= stop.
+        """
+        start = max(int(start), 0)
+        stop = int(stop)
+        if self._size == 0 or stop < start:
+            return False
+
+        first_key = start >> CHUNK_BITS
+        last_key = stop >> CHUNK_BITS
+        lo = bisect.bisect_left(self._keys, first_key)
+        hi = bisect.bisect_right(self._keys, last_key)
+        for key in self._keys[lo:hi]:
+            if first_key < key < last_key:
+                return True
+            lows = _lows(self._containers[key])
+            low_start = start & CHUNK_MASK if key == first_key else 0
+            low_stop = stop & CHUNK_MASK if key == last_key else CHUNK_MASK
+            a = np.searchsorted(lows, low_start, side="left")
+            b = np.searchsorted(lows, low_stop, side="right")
+            if b > a:
+                return True
+        return False
+
+    def intersection(self, *others):
+        out = self
+        for other in others:
+            out = out._combine(_as_indexset(other), _and, keep="both")
+        return out
+
+    def union(self, *others):
+        out = self
+        for other in others:
+            out = out._combine(_as_indexset(other), _or, keep="any")
+        return out
+
+    def difference(self, *others):
+        out = self
+        for other in others:
+            out = out._combine(_as_indexset(other), _andnot, keep="left")
+        return out
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def _combine(self, other, operation, keep):
+        if keep == "both":
+            keys = sorted(set(self._keys) & set(other._keys))
+        elif keep == "any":
+            keys = sorted(set(self._keys) | set(other._keys))
+        else:
+            keys = self._keys
+
+        out = IndexSet()
+        for key in keys:
+            a = self._containers.get(key, None)
+            b = other._containers.get(key, None)
+            if a is None:
+                container = b.copy()
+            elif b is None:
+                container = a.copy()
+            else:
+                container = operation(a, b)
+            out._add_container(key, _normalize(container))
+        return out
+
+
+def _as_indexset(x):
+    if isinstance(x, IndexSet):
+        return x
+    return IndexSet(x)
+
+
+def _is_bitmap(container):
+    return container.dtype == _BITMAP_DTYPE
+
+
+def _make_container(lows):
+    """
+    Returns an array container for few, and a bitmap container for many
+    'lows'. Returns None when 'lows' is empty.
+    """
+    if lows.shape[0] == 0:
+        return None
+    if lows.shape[0] <= ARRAY_MAX_SIZE:
+        return lows
+    return _bitmap_from_lows(lows)
+
+
+def _normalize(container):
+    if _is_bitmap(container):
+        if _popcount(container) <= ARRAY_MAX_SIZE:
+            return _make_container(_lows(container))
+        return container
+    return _make_container(container)
+
+
+def _bitmap_from_lows(lows):
+    bits = np.zeros(shape=CHUNK_SIZE, dtype=bool)
+    bits[lows] = True
+    return np.packbits(bits, bitorder="little").view(_BITMAP_DTYPE)
+
+
+def _bits(container):
+    if _is_bitmap(container):
+        return np.unpackbits(container.view(np.uint8), bitorder="little").view(
+            bool
+        )
+    bits = np.zeros(shape=CHUNK_SIZE, dtype=bool)
+    bits[container] = True
+    return bits
+
+
+def _lows(container):
+    if _is_bitmap(container):
+        return np.flatnonzero(_bits(container)).astype(_ARRAY_DTYPE)
+    return container
+
+
+def _cardinality(container):
+    if _is_bitmap(container):
+        return _popcount(container)
+    return container.shape[0]
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return int(np.sum(np.bitwise_count(words)))
+    return int(np.sum(np.unpackbits(words.view(np.uint8))))
+
+
+def _contains(container, lows):
+    if _is_bitmap(container):
+        words = container[lows >> 6]
+        shifts = (lows & 63).astype(np.uint64)
+        return ((words >> shifts) & np.uint64(1)).astype(bool)
+    pos = np.searchsorted(container, lows)
+    pos[pos == container.shape[0]] = 0
+    return container[pos] == lows
+
+
+def _and(a, b):
+    if _is_bitmap(a) and _is_bitmap(b):
+        return a & b
+    if _is_bitmap(a):
+        return b[_contains(a, b)]
+    return a[_contains(b, a)]
+
+
+def _or(a, b):
+    if _is_bitmap(a) and _is_bitmap(b):
+        return a | b
+    if not _is_bitmap(a) and not _is_bitmap(b):
+        if a.shape[0] + b.shape[0] <= ARRAY_MAX_SIZE:
+            return np.union1d(a, b)
+    return np.packbits(_bits(a) | _bits(b), bitorder="little").view(
+        _BITMAP_DTYPE
+    )
+
+
+def _andnot(a, b):
+    if _is_bitmap(a) and _is_bitmap(b):
+        return a & ~b
+    if not _is_bitmap(a):
+        return a[~_contains(b, a)]
+    out = _bits(a)
+    out[b] = False
+    return np.packbits(out, bitorder="little").view(_BITMAP_DTYPE)
@@ -1,8 +1,10 @@
 import pandas as pd
 import numpy as np
+import importlib
 from dynamicsizerecarray import DynamicSizeRecarray
 
 from ._sparse_numeric_table import SparseNumericTable
+from .indexset import IndexSet
 from . import _base
 
 
@@ -25,61 +27,89 @@ def make_mask_of_right_in_left(left_indices, right_indices):
     )
 
 
-def intersection(*args):
+def intersection(*args, assume_unique=False, assume_sorted=False):
     """
     Returns the logical intersection of indices among the '*args'.
 
     Parameters
     ----------
-    *args : variable number of array like
+    *args : variable number of array like, or IndexSet
         Lists of indices.
+    assume_unique : bool (default=False)
+        Skip the check that the indices in each list are unique.
+    assume_sorted : bool (default=False)
+        The indices in each list are already sorted and unique. Skips sorting
+        and all checks but the one for the dtype.
 
     Returns
     -------
-    intersection : numpy.array(dtype=int)
+    intersection : numpy.array(dtype=int), or IndexSet
+        Sorted. An IndexSet when all '*args' are IndexSets.
 
     Example
     -------
     [4, 5, 6] = intersection([1,2,3,4,5,6], [3,4,5,6,7,8], [4,5,6,7,8,9,10])
 
     """
-    num = len(args)
-
-    if num == 0:
+    if _all_are_indexsets(args):
+        return args[0].intersection(*args[1:])
+
+    arrays = [
+        _asarray(a, assume_unique=assume_unique, assume_sorted=assume_sorted)
+        for a in args
+    ]
+    if len(arrays) == 0:
         return np.array([], dtype=int)
-    else:
-        out = _asarray(args[0])
-        for i in range(1, num):
-            out = np.intersect1d(out, _asarray(args[i]))
-        return out
+
+    arrays = sorted(arrays, key=lambda a: a.shape[0])
+    out = arrays[0]
+    for other in arrays[1:]:
+        if out.shape[0] == 0:
+            break
+        out = out[_base.make_index_membership(other).mask(out)]
+    return out
 
 
-def difference(first, *others):
+def difference(first, *others, assume_unique=False, assume_sorted=False):
     """
     Returns the logical difference of indices in between 'first' and 'others'.
 
     Parameters
     ----------
-    first : array like
+    first : array like, or IndexSet
         List of arrays to be subtracted from.
-    *others : variable number of array like
+    *others : variable number of array like, or IndexSet
         Lists being subtracted from 'first'.
+    assume_unique : bool (default=False)
+        Skip the check that the indices in each list are unique.
+    assume_sorted : bool (default=False)
+        The indices in each list are already sorted and unique. Skips sorting
+        and all checks but the one for the dtype.
 
     Returns
     -------
-    difference : numpy.array(dtype=int)
+    difference : numpy.array(dtype=int), or IndexSet
+        Sorted. An IndexSet when 'first' and all 'others' are IndexSets.
 
     Example
     -------
     [5] = difference([1,2,3,4,5,6], [2,4,6], [1,2,3])
     """
-    sfirst = set(_asarray(first))
-    sothers = set(union(*others))
-    diff = sfirst.difference(sothers)
-    return np.asarray(list(diff), dtype=int)
+    if _all_are_indexsets((first,) + others):
+        return first.difference(*others)
+
+    out = _asarray(
+        first, assume_unique=assume_unique, assume_sorted=assume_sorted
+    )
+    subtrahend = union(
+        *others, assume_unique=assume_unique, assume_sorted=assume_sorted
+    )
+    if out.shape[0] == 0 or subtrahend.shape[0] == 0:
+        return out
+    return out[~_base.make_index_membership(subtrahend).mask(out)]
 
 
-def union(*args):
+def union(*args, assume_unique=False, assume_sorted=False):
     """
     Returns the logical union of indices in '*args'.
 
@@ -87,38 +117,88 @@ def union(*args):
     ----------
     *args : variable number of array like
         Lists of indices.
+    assume_unique : bool (default=False)
+        Skip the check that the indices in each list are unique.
+    assume_sorted : bool (default=False)
+        The indices in each list are already sorted and unique. Skips sorting
+        and all checks but the one for the dtype.
 
     Returns
     -------
-    union : numpy.array(dtype=int)
+    union : numpy.array(dtype=int), or IndexSet
+        Sorted. An IndexSet when all '*args' are IndexSets.
 
     Example
     -------
     [1,2,3,4,5] = union([[1], [2], [3,4,5], [])
     """
-    num = len(args)
+    if _all_are_indexsets(args):
+        return args[0].union(*args[1:])
 
-    if num == 0:
-        return np.array([], dtype=int)
+    each_is_sorted = not assume_unique or assume_sorted
+    if not each_is_sorted:
+        # No need to sort each list on its own, all are sorted at once.
+        arrays = [_asarray_of_int(a) for a in args]
     else:
-        out = _asarray(args[0])
-        for i in range(1, num):
-            out = np.union1d(out, _asarray(args[i]))
+        arrays = [
+            _asarray(
+                a, assume_unique=assume_unique, assume_sorted=assume_sorted
+            )
+            for a in args
+        ]
+
+    if len(arrays) == 0:
+        return np.array([], dtype=int)
+    if len(arrays) == 1:
+        return arrays[0] if each_is_sorted else np.sort(arrays[0])
+
+    out = np.concatenate(arrays)
+    # The stable sort merges runs which are already sorted.
+    out.sort(kind="stable")
+    return _drop_adjacent_duplicates(out)
+
+
+def _asarray(x, assume_unique=False, assume_sorted=False):
+    """
+    Returns the indices 'x' as a sorted numpy.array(dtype=int).
+    Raises AssertionError when the indices are not int/uint like or are not
+    unique.
+    """
+    if isinstance(x, IndexSet):
+        return x.to_array(dtype=int)
+
+    out = _asarray_of_int(x)
+    if assume_sorted:
+        return out
+
+    out = np.sort(out)
+    if not assume_unique:
+        if np.any(out[1:] == out[:-1]):
+            raise AssertionError("Expected values to be unique")
     return out
 
 
-def _asarray(x):
+def _all_are_indexsets(args):
+    return len(args) > 0 and all(isinstance(a, IndexSet) for a in args)
+
+
+def _asarray_of_int(x):
+    if isinstance(x, IndexSet):
+        return x.to_array(dtype=int)
     a = np.asarray(x)
     is_empty_anyhow = a.shape[0] == 0
     if not _is_int_uint_like_dtype(a.dtype) and not is_empty_anyhow:
         msg = f"Expected int/uint like dtype but got '{a.dtype.name:s}'."
         raise AssertionError(msg)
-    out = np.asarray(x, int)
+    return np.asarray(a, dtype=int)
 
-    is_unique = out.shape[0] == np.unique(out).shape[0]
-    if not is_unique:
-        raise AssertionError("Expected values to be unique")
-    return out
+
+def _drop_adjacent_duplicates(sorted_values):
+    if sorted_values.shape[0] == 0:
+        return sorted_values
+    mask = np.ones(shape=sorted_values.shape[0], dtype=bool)
+    np.not_equal(sorted_values[1:], sorted_values[:-1], out=mask[1:])
+    return sorted_values[mask]
 
 
 def _is_int_uint_like_dtype(dtype):
@@ -138,7 +218,7 @@ def _cut_level_on_indices(level, indices, index_key, column_keys=None):
     ----------
     level : recarray
         A level in a sparse table.
-    indices : list
+    indices : list, IndexMembership, or IndexSet
         The row-indices to be written to the output-level.
     index_key : str
         Key of the index column.
@@ -167,13 +247,13 @@ def cut_table_on_indices(table, common_indices, inplace=False):
     ----------
     table : dict of recarrays, or SparseNumericTable.
         The sparse numeric table.
-    common_indices : list of indices
+    common_indices : list of indices, or IndexSet
         The row-indices to cut on. Only row-indices in this list will go in the
         output-table.
     inplace : bool
         Returns modified table if True.
     """
-    common_indices = np.asarray(common_indices)
+    membership = _base.make_index_membership(common_indices)
 
     if inplace:
         out = table
@@ -183,7 +263,7 @@ def cut_table_on_indices(table, common_indices, inplace=False):
     for lk in table:
         out[lk] = _cut_level_on_indices(
             level=table[lk],
-            indices=common_indices,
+            indices=membership,
             index_key=table.index_key,
         )
     return out
@@ -202,26 +282,11 @@ def sort_table_on_common_indices(table, common_indices, inplace=False):
     inplace : bool
         Returns modified table if True.
     """
-    common_indices = np.asarray(common_indices)
-
-    order = np.argsort(common_indices)
-    inv_order = np.zeros(shape=common_indices.shape, dtype=int)
-    inv_order[order] = np.arange(len(common_indices))
-    del order
-
-    if inplace:
-        out = table
-    else:
-        out = SparseNumericTable(index_key=table.index_key)
-
-    for lk in table:
-        level = table[lk]
-        level_order_args = np.argsort(level[table.index_key])
-        level_sorted = level[level_order_args]
-        del level_order_args
-        level_same_order_as_common = level_sorted[inv_order]
-        out[lk] = level_same_order_as_common
-    return out
+    return cut_and_sort_table_on_indices(
+        table=table,
+        common_indices=common_indices,
+        inplace=inplace,
+    )
 
 
 def cut_and_sort_table_on_indices(table, common_indices, inplace=False):
@@ -232,7 +297,8 @@ def cut_and_sort_table_on_indices(table, common_indices, inplace=False):
     Parameters
     ----------
     table : dict of recarrays, or SparseNumericTable.
-        The sparse numeric table.
+        The sparse numeric table. Each level must contain all
+        'common_indices'.
     common_indices : list of indices
         The row-indices to cut on and sort by.
     inplace : bool
@@ -240,31 +306,172 @@ def cut_and_sort_table_on_indices(table, common_indices, inplace=False):
     """
     common_indices = np.asarray(common_indices)
 
-    out = cut_table_on_indices(
-        table=table,
-        common_indices=common_indices,
-        inplace=inplace,
-    )
-    out = sort_table_on_common_indices(
-        table=out,
-        common_indices=common_indices,
-        inplace=inplace,
+    if inplace:
+        out = table
+    else:
+        out = SparseNumericTable(index_key=table.index_key)
+
+    for lk in table:
+        out[lk] = _cut_and_sort_level_on_indices(
+            level=table[lk],
+            indices=common_indices,
+            index_key=table.index_key,
+        )
+    if isinstance(out, SparseNumericTable):
+        out._is_rectangular = True
+    return out
+
+
+def _cut_and_sort_level_on_indices(level, indices, index_key):
+    """
+    Returns a level (DynamicSizeRecarray) with the rows of 'indices' in the
+    order of 'indices'. Each column is gathered once.
+    """
+    positions = _make_gather_positions(
+        level_indices=level[index_key],
+        indices=indices,
     )
+    out_dtype = _base._get_simple_dtype_from_recarray(level)
+    out = DynamicSizeRecarray(shape=positions.shape[0], dtype=out_dtype)
+    out_recarray = out.to_recarray()
+    for ck, _ in out_dtype:
+        # "clip" only skips the bounds check, _make_gather_positions()
+        # already asserts that all positions are valid.
+        np.take(level[ck], positions, out=out_recarray[ck], mode="clip")
     return out
 
 
-def make_rectangular_DataFrame(table, delimiter="/"):
+def _make_gather_positions(level_indices, indices):
+    """
+    Returns the positions of the rows in a level with the 'indices', in the
+    order of 'indices'. The level's indices are only sorted when they are
+    not sorted already.
+
+    Parameters
+    ----------
+    level_indices : array of int/uint
+        The index column of the level. Must be unique.
+    indices : array of int/uint
+        Must all be in 'level_indices'.
+    """
+    level_indices = np.asarray(level_indices)
+    indices = np.asarray(indices)
+
+    if _base._is_sorted_and_unique(level_indices):
+        order = None
+        sorted_level_indices = level_indices
+    else:
+        order = np.argsort(level_indices, kind="stable")
+        sorted_level_indices = level_indices[order]
+
+    both_are_integer = level_indices.dtype.kind in ("i", "u") and (
+        indices.dtype.kind in ("i", "u")
+    )
+    if both_are_integer:
+        num = indices.shape[0]
+        indices = _base._cast_indices(indices, dtype=level_indices.dtype)
+        assert indices.shape[0] == num, "Expected all indices to be in level."
+
+    positions = np.searchsorted(sorted_level_indices, indices)
+    found = positions < sorted_level_indices.shape[0]
+    found[found] = sorted_level_indices[positions[found]] == indices[found]
+    assert np.all(found), "Expected all indices to be in level."
+
+    if order is None:
+        return positions
+    return order[positions]
+
+
+def make_rectangular_DataFrame(table, delimiter="/", copy=True):
     """
     Returns a pandas.DataFrame made from a table.
     The table must already be rectangular, i.e. not sparse anymore.
     The row-indices among all levels in the table must have the same ordering.
 
+    With 'copy' False, the columns are not consolidated into blocks and the
+    DataFrame holds views on the columns of the table. No values are copied,
+    and changes to the table show up in the DataFrame. The index columns of
+    all levels are only compared when the table is not known to be
+    rectangular, see SparseNumericTable.is_rectangular.
+
     Parameters
     ----------
     table : dict of recarrays, or SparseNumericTable.
         The sparse numeric table.
     delimiter : str
         To join a level key with a column key.
+    copy : bool (default=True)
+        Copy the columns into the DataFrame.
+    """
+    columns = _make_rectangular_columns(
+        table=table,
+        delimiter=delimiter,
+        check_index=not getattr(table, "is_rectangular", False),
+    )
+    return pd.DataFrame(columns, copy=copy)
+
+
+def make_rectangular_arrow_RecordBatches(table, delimiter="/", max_rows=None):
+    """
+    Yields pyarrow.RecordBatches made from a table, see
+    make_rectangular_DataFrame(). Columns which are contiguous in memory
+    are not copied. The columns of a level are interleaved in its
+    recarray, so they are copied one batch at a time. Requires pyarrow.
+
+    Parameters
+    ----------
+    table : dict of recarrays, or SparseNumericTable.
+        The sparse numeric table.
+    delimiter : str
+        To join a level key with a column key.
+    max_rows : int (default=None)
+        Maximum number of rows in a batch. One batch when None.
+    """
+    pa = _import_pyarrow()
+    columns = _make_rectangular_columns(
+        table=table,
+        delimiter=delimiter,
+        check_index=not getattr(table, "is_rectangular", False),
+    )
+    names = list(columns.keys())
+    num_rows = columns[names[0]].shape[0] if names else 0
+    if max_rows is None:
+        max_rows = max(num_rows, 1)
+    assert max_rows > 0, "Expected max_rows > 0."
+
+    for start in range(0, max(num_rows, 1), max_rows):
+        stop = min(start + max_rows, num_rows)
+        arrays = [pa.array(columns[name][start:stop]) for name in names]
+        yield pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def make_rectangular_arrow_Table(table, delimiter="/"):
+    """
+    Returns a pyarrow.Table made from a table, see
+    make_rectangular_arrow_RecordBatches(). Requires pyarrow.
+
+    Parameters
+    ----------
+    table : dict of recarrays, or SparseNumericTable.
+        The sparse numeric table.
+    delimiter : str
+        To join a level key with a column key.
+    """
+    pa = _import_pyarrow()
+    return pa.Table.from_batches(
+        list(
+            make_rectangular_arrow_RecordBatches(
+                table=table, delimiter=delimiter
+            )
+        )
+    )
+
+
+def _make_rectangular_columns(table, delimiter, check_index=True):
+    """
+    Returns a dict of views on the columns of a rectangular table. The index
+    column is taken once. With 'check_index', the index columns of all
+    levels are compared.
     """
     ik = table.index_key
 
@@ -273,9 +480,21 @@ def make_rectangular_DataFrame(table, delimiter="/"):
         for ck in table[lk].dtype.names:
             if ck == ik:
                 if ik in out:
-                    np.testing.assert_array_equal(out[ik], table[lk][ik])
+                    if check_index:
+                        np.testing.assert_array_equal(out[ik], table[lk][ik])
                 else:
                     out[ik] = table[lk][ik]
             else:
                 out[f"{lk:s}{delimiter:s}{ck:s}"] = table[lk][ck]
-    return pd.DataFrame(out)
+    return out
+
+
+def _import_pyarrow():
+    try:
+        return importlib.import_module("pyarrow")
+    except ImportError as err:
+        raise ImportError(
+            "Export to arrow requires the module 'pyarrow'. "
+            "Install with: pip install "
+            "sparse_numeric_table_sebastian-achim-mueller[arrow]"
+        ) from err
@@ -0,0 +1,120 @@
+import sparse_numeric_table as snt
+import numpy as np
+import tempfile
+import pytest
+import os
+
+
+def _write(path, table, block_size=1_000):
+    with snt.open(
+        path, "w", dtypes_and_index_key_from=table, block_size=block_size
+    ) as f:
+        f.append_table(table)
+
+
+def test_aggregate_matches_numpy():
+    prng = np.random.Generator(np.random.MT19937(seed=1))
+    table = snt.testing.make_example_table(prng=prng, size=10_000)
+    level = table["elementary_school"]
+    indices = prng.choice(10_000, size=4_000, replace=False)
+    bin_edges = np.linspace(0, 1, 11)
+
+    mask = np.isin(level["uid"], indices) & (level["num_friends"] > 1)
+    lunch = level["lunchpack_size"][mask]
+    friends = level["num_friends"][mask]
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        _write(path=path, table=table)
+
+        for workers in [None, 3]:
+            with snt.open(path, "r", workers=workers) as f:
+                out = f.aggregate(
+                    level_key="elementary_school",
+                    aggregations={
+                        "lunchpack_size": [
+                            "count",
+                            "sum",
+                            "mean",
+                            "min",
+                            "max",
+                            ("hist", bin_edges),
+                        ],
+                        "num_friends": ["sum", "max"],
+                    },
+                    indices=indices,
+                    where=[("num_friends", ">", 1)],
+                )
+
+            assert out["lunchpack_size"]["count"] == lunch.shape[0]
+            np.testing.assert_allclose(
+                out["lunchpack_size"]["sum"], np.sum(lunch)
+            )
+            np.testing.assert_allclose(
+                out["lunchpack_size"]["mean"], np.mean(lunch)
+            )
+            assert out["lunchpack_size"]["min"] == np.min(lunch)
+            assert out["lunchpack_size"]["max"] == np.max(lunch)
+            np.testing.assert_array_equal(
+                out["lunchpack_size"]["hist"],
+                np.histogram(lunch, bins=bin_edges)[0],
+            )
+            assert out["num_friends"]["sum"] == np.sum(friends)
+            assert out["num_friends"]["max"] == np.max(friends)
+
+
+def test_aggregate_empty_and_bad_names():
+    prng = np.random.Generator(np.random.MT19937(seed=2))
+    table = snt.testing.make_example_table(prng=prng, size=1_000)
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        _write(path=path, table=table)
+
+        with snt.open(path, "r") as f:
+            out = f.aggregate(
+                level_key="university",
+                aggregations={"uid": ["count", "mean", "min"]},
+                indices=[],
+            )
+            assert out["uid"] == {"count": 0, "mean": None, "min": None}
+
+            with pytest.raises(KeyError):
+                f.aggregate("university", {"uid": ["median"]})
+            with pytest.raises(KeyError):
+                f.aggregate("university", {"nope": ["sum"]})
+            with pytest.raises(KeyError):
+                f.aggregate(
+                    "university",
+                    {
+                        "uid": [
+                            ("hist", [0, 2, 4, 100]),
+                            ("hist", [0, 50, 100]),
+                        ]
+                    },
+                )
+
+
+def test_dataset_aggregate():
+    prng = np.random.Generator(np.random.MT19937(seed=3))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        expected = snt.testing.make_example_table(prng=prng, size=0)
+        for i in range(3):
+            part = snt.testing.make_example_table(
+                prng=prng, size=1_000, start_index=i * 1_000
+            )
+            expected.append(part)
+            _write(path=os.path.join(tmp, f"{i:06d}.zip"), table=part)
+
+        with snt.Dataset(tmp) as ds:
+            out = ds.aggregate(
+                level_key="high_school",
+                aggregations={"time_spent_on_homework": ["count", "sum"]},
+            )
+
+    column = expected["high_school"]["time_spent_on_homework"]
+    assert out["time_spent_on_homework"]["count"] == column.shape[0]
+    np.testing.assert_allclose(
+        out["time_spent_on_homework"]["sum"], np.sum(column)
+    )
@@ -3,6 +3,8 @@ import numpy as np
 import tempfile
 import pytest
 import os
+import zipfile
+import gc
 
 
 def test_write_read_full_table():
@@ -119,3 +121,614 @@ def test_preserves_dtypes_when_table_empty():
             back = f.query()
 
         snt.testing.assert_dtypes_are_equal(table.dtypes, back.dtypes)
+
+
+def test_index_stats_skip_blocks():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    my_table = snt.testing.make_example_table(prng=prng, size=100_000)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=my_table, block_size=10_000
+        ) as f:
+            f.append_table(my_table)
+
+        with snt.open(path, "r") as f:
+            stats = f.get_index_stats("elementary_school", "000003")
+            assert stats["num_rows"] == 10_000
+            assert stats["index_min"] == 30_000
+            assert stats["index_max"] == 39_999
+            assert stats["index_sorted"]
+
+            num_reads = {"n": 0}
+            _read_block = f._read_level_column_block
+
+            def counting_read_block(**kwargs):
+                num_reads["n"] += 1
+                return _read_block(**kwargs)
+
+            f._read_level_column_block = counting_read_block
+            indices = [31_000, 31_001, 35_000]
+            back = f.query(
+                levels_and_columns={"elementary_school": "__all__"},
+                indices=indices,
+            )
+
+        num_columns = len(my_table.dtypes["elementary_school"])
+        assert num_reads["n"] == num_columns
+        np.testing.assert_array_equal(
+            back["elementary_school"]["uid"], indices
+        )
+
+
+def test_memory_map_uncompressed_blocks():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    my_table = snt.testing.make_example_table(prng=prng, size=25_000)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+
+        with snt.open(
+            path,
+            "w",
+            dtypes_and_index_key_from=my_table,
+            block_size=10_000,
+            compress=False,
+        ) as f:
+            f.append_table(my_table)
+
+        with snt.open(path, "r") as f:
+            block = f._read_level_column_block(
+                level_key="elementary_school",
+                column_key="lunchpack_size",
+                block_key="000001",
+            )
+            assert isinstance(block, np.memmap)
+            np.testing.assert_array_equal(
+                block,
+                my_table["elementary_school"]["lunchpack_size"][10_000:20_000],
+            )
+            my_table_back = f.query()
+
+        snt.testing.assert_tables_are_equal(my_table, my_table_back)
+
+
+def test_read_with_workers():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    my_table = snt.testing.make_example_table(prng=prng, size=50_000)
+    indices = prng.choice(
+        my_table["elementary_school"]["uid"], size=1_000, replace=False
+    )
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=my_table, block_size=1_000
+        ) as f:
+            f.append_table(my_table)
+
+        with snt.open(path, "r", workers=4) as f:
+            my_table_back = f.query()
+            part_back = f.query(indices=indices, workers=3)
+
+        with snt.open(path, "r") as f:
+            part_back_serial = f.query(indices=indices)
+
+    snt.testing.assert_tables_are_equal(my_table, my_table_back)
+    snt.testing.assert_tables_are_equal(part_back, part_back_serial)
+
+
+def test_write_with_workers():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    my_table = snt.testing.make_example_table(prng=prng, size=50_000)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        filenames = {}
+        for workers in [None, 3]:
+            path = os.path.join(tmp, f"my_table_{workers}.zip")
+            with snt.open(
+                path,
+                "w",
+                dtypes_and_index_key_from=my_table,
+                block_size=1_000,
+                workers=workers,
+            ) as f:
+                f.append_table(my_table)
+
+            with snt.open(path, "r") as f:
+                filenames[workers] = [item.filename for item in f.infolist]
+                my_table_back = f.query()
+
+            snt.testing.assert_tables_are_equal(my_table, my_table_back)
+
+    assert filenames[None] == filenames[3]
+
+
+def test_append_mode():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    expected = snt.testing.make_example_table(prng=prng, size=0)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+
+        for hour in range(3):
+            part = snt.testing.make_example_table(
+                prng=prng, size=2_500, start_index=hour * 2_500
+            )
+            expected.append(part)
+            kwargs = {}
+            if hour == 0:
+                kwargs["dtypes_and_index_key_from"] = part
+            with snt.open(path, "a", block_size=1_000, **kwargs) as f:
+                f.append_table(part)
+
+        with snt.open(path, "r") as f:
+            block_keys = list(f.info["elementary_school"]["uid"].keys())
+            back = f.query()
+
+    assert block_keys == [f"{i:06d}" for i in range(9)]
+    snt.testing.assert_tables_are_equal(expected, back)
+
+
+def test_append_mode_dtypes_must_match():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    table = snt.testing.make_example_table(prng=prng, size=100)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(path, "w", dtypes_and_index_key_from=table) as f:
+            f.append_table(table)
+
+        other_dtypes = snt.testing.make_example_table_dtypes(
+            index_dtype=("uid", "<i4")
+        )
+        with pytest.raises(AssertionError):
+            snt.open(path, "a", dtypes=other_dtypes, index_key="uid")
+
+
+def _copy_without_manifests(src, dst):
+    with zipfile.ZipFile(src, "r") as zin, zipfile.ZipFile(dst, "w") as zout:
+        for item in zin.infolist():
+            if not item.filename.startswith("__manifest__"):
+                zout.writestr(item, zin.read(item.filename))
+
+
+def test_manifest_and_legacy_scan_agree():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    my_table = snt.testing.make_example_table(prng=prng, size=25_000)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        legacy_path = os.path.join(tmp, "legacy.zip")
+
+        with snt.open(
+            path,
+            "w",
+            dtypes_and_index_key_from=my_table,
+            block_size=3_000,
+            shuffle=True,
+        ) as f:
+            f.append_table(my_table)
+        _copy_without_manifests(path, legacy_path)
+
+        with snt.open(path, "r") as f, snt.open(legacy_path, "r") as legacy:
+            assert f.has_manifest
+            assert not legacy.has_manifest
+            assert f.index_key == legacy.index_key
+            assert f.dtypes == legacy.dtypes
+            assert f.info == legacy.info
+            for lk in f.info:
+                for bk in f.info[lk][f.index_key]:
+                    assert f.get_index_stats(lk, bk) == (
+                        legacy.get_index_stats(lk, bk)
+                    )
+            back = f.query()
+
+    snt.testing.assert_tables_are_equal(my_table, back)
+
+
+def test_append_to_table_without_manifest():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    a = snt.testing.make_example_table(prng=prng, size=2_000)
+    b = snt.testing.make_example_table(
+        prng=prng, size=2_000, start_index=2_000
+    )
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        legacy_path = os.path.join(tmp, "legacy.zip")
+
+        with snt.open(path, "w", dtypes_and_index_key_from=a) as f:
+            f.append_table(a)
+        _copy_without_manifests(path, legacy_path)
+
+        for p in [path, legacy_path]:
+            with snt.open(p, "a") as f:
+                f.append_table(b)
+
+        with snt.open(path, "r") as f:
+            assert f.has_manifest
+            back = f.query()
+        with snt.open(legacy_path, "r") as f:
+            assert not f.has_manifest
+            legacy_back = f.query()
+
+    a.append(b)
+    snt.testing.assert_tables_are_equal(a, back)
+    snt.testing.assert_tables_are_equal(a, legacy_back)
+
+
+def test_block_cache():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    my_table = snt.testing.make_example_table(prng=prng, size=10_000)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=my_table, block_size=1_000
+        ) as f:
+            f.append_table(my_table)
+
+        lc = {"elementary_school": ["uid", "num_friends"]}
+        with snt.open(path, "r", block_cache_size=10 * 1000**2) as f:
+            first = f.query(levels_and_columns=lc)
+            assert f.block_cache.num_misses == 2 * 10
+            assert f.block_cache.num_hits == 0
+
+            second = f.query(levels_and_columns=lc)
+            assert f.block_cache.num_misses == 2 * 10
+            assert f.block_cache.num_hits == 2 * 10
+
+        snt.testing.assert_tables_are_equal(first, second)
+
+        one_block_size = 1_000 * 8
+        with snt.open(path, "r", block_cache_size=3 * one_block_size) as f:
+            f.query(levels_and_columns=lc)
+            assert len(f.block_cache) == 3
+            assert f.block_cache.size == 3 * one_block_size
+
+
+def _sort_table_on_index(table):
+    for lk in table.list_level_keys():
+        level = table[lk].to_recarray()
+        order = np.argsort(level[table.index_key], kind="stable")
+        table[lk] = level[order]
+    return table
+
+
+def test_sorted_index_mode():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    expected = snt.testing.make_example_table(prng=prng, size=0)
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+
+        for hour in range(3):
+            part = _sort_table_on_index(
+                snt.testing.make_example_table(
+                    prng=prng, size=2_500, start_index=hour * 2_500
+                )
+            )
+            expected.append(part)
+            kwargs = {}
+            if hour == 0:
+                kwargs["dtypes_and_index_key_from"] = part
+            with snt.open(
+                path, "a", block_size=1_000, sorted_index=True, **kwargs
+            ) as f:
+                f.append_table(part)
+
+        indices = prng.choice(7_500, size=100, replace=False)
+        with snt.open(path, "r") as f:
+            for lk in f.list_level_keys():
+                assert f._sorted_index[lk]
+                assert f.is_index_sorted(level_key=lk)
+            back = f.query()
+            back_part = f.query(indices=indices)
+
+    snt.testing.assert_tables_are_equal(expected, back)
+    for lk in expected.list_level_keys():
+        mask = np.isin(expected[lk]["uid"], indices)
+        np.testing.assert_array_equal(
+            expected[lk]["uid"][mask], back_part[lk]["uid"]
+        )
+
+
+def test_sorted_index_mode_rejects_unsorted():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+
+    table = _sort_table_on_index(
+        snt.testing.make_example_table(prng=prng, size=1_000)
+    )
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, sorted_index=True
+        ) as f:
+            f.append_table(table)
+            with pytest.raises(AssertionError):
+                f.append_table(table)
+
+        unsorted = snt.testing.make_example_table(prng=prng, size=1_000)
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, sorted_index=True
+        ) as f:
+            with pytest.raises(AssertionError):
+                f.append_table(unsorted)
+
+
+def test_sorted_index_mode_rejects_copied_unsorted_blocks():
+    dtypes = {"a": [("uid", "<u8"), ("x", "<f4")]}
+    source = snt.SparseNumericTable(index_key="uid", dtypes=dtypes)
+    level = np.recarray(shape=6, dtype=dtypes["a"])
+    level["uid"] = [9, 3, 7, 1, 5, 2]
+    level["x"] = 0.0
+    source["a"] = level
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        source_path = os.path.join(tmp, "source.zip")
+        with snt.open(
+            source_path, "w", dtypes_and_index_key_from=source, block_size=2
+        ) as f:
+            f.append_table(source)
+
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(source_path, "r") as src, snt.open(
+            path,
+            "w",
+            dtypes_and_index_key_from=source,
+            block_size=2,
+            sorted_index=True,
+        ) as f:
+            assert not f.can_copy_blocks_from(src)
+            with pytest.raises(AssertionError):
+                f.copy_blocks_from(src)
+
+
+def test_lazy_query():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = snt.testing.make_example_table(prng=prng, size=20_000)
+
+    indices = prng.choice(20_000, size=5_000, replace=False)
+    where = {"elementary_school": [("lunchpack_size", ">", 0.5)]}
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=3_000
+        ) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            expected = f.query(indices=indices, where=where)
+            lazy = f.query(indices=indices, where=where, lazy=True)
+
+            assert lazy.list_level_keys() == expected.list_level_keys()
+            assert lazy.shapes == expected.shapes
+            school = lazy["elementary_school"]
+            np.testing.assert_array_equal(
+                school["num_friends"],
+                expected["elementary_school"]["num_friends"],
+            )
+            assert school.is_read("num_friends")
+            assert not school.is_read("lunchpack_size")
+
+            snt.testing.assert_tables_are_equal(expected, lazy.materialize())
+
+            uni = table["university"]["uid"].copy()
+            prng.shuffle(uni)
+            lazy_sorted = f.query(
+                indices=uni,
+                levels_and_columns={"university": "__all__"},
+                sort=True,
+                lazy=True,
+            )
+            np.testing.assert_array_equal(
+                lazy_sorted["university"]["uid"], uni
+            )
+
+
+def test_read_level_allocates_exact_size():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = snt.testing.make_example_table(prng=prng, size=10_000)
+    indices = prng.choice(10_000, size=3_000, replace=False)
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=1_000
+        ) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            level = f._read_level(
+                level_key="elementary_school",
+                column_keys="__all__",
+                indices=indices,
+                conditions=[("num_friends", ">", 1)],
+            )
+
+    expected = table["elementary_school"]
+    mask = np.isin(expected["uid"], indices) & (expected["num_friends"] > 1)
+    assert level._capacity() == np.sum(mask)
+    for ck in expected.dtype.names:
+        np.testing.assert_array_equal(level[ck], expected[ck][mask])
+
+
+def test_aligned_block_looper():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = _sort_table_on_index(
+        snt.testing.make_example_table(prng=prng, size=10_000)
+    )
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path,
+            "w",
+            dtypes_and_index_key_from=table,
+            block_size=1_000,
+            sorted_index=True,
+        ) as f:
+            f.append_table(table)
+
+        chunks = []
+        with snt.open(path, "r") as f:
+            looper = snt.AlignedBlockLooper(
+                reader=f,
+                levels_and_columns={
+                    "elementary_school": ["uid"],
+                    "high_school": "__all__",
+                    "university": "__all__",
+                },
+            )
+            assert len(looper) == 10
+            for chunk in looper:
+                chunks.append(chunk)
+
+    for chunk in chunks:
+        root = chunk["elementary_school"]["uid"]
+        assert chunk["elementary_school"].dtype.names == ("uid",)
+        for lk in ["high_school", "university"]:
+            assert np.all(np.isin(chunk[lk]["uid"], root))
+
+    for lk in ["high_school", "university"]:
+        back = np.concatenate([chunk[lk]["uid"] for chunk in chunks])
+        np.testing.assert_array_equal(back, table[lk]["uid"])
+
+    back = np.concatenate(
+        [c["high_school"]["num_best_friends"] for c in chunks]
+    )
+    np.testing.assert_array_equal(
+        back, table["high_school"]["num_best_friends"]
+    )
+
+
+def test_aligned_block_looper_requires_sorted_levels():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = snt.testing.make_example_table(prng=prng, size=1_000)
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(path, "w", dtypes_and_index_key_from=table) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            with pytest.raises(AssertionError):
+                snt.AlignedBlockLooper(reader=f)
+
+
+def test_level_block_looper_read_ahead_and_chunks():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = snt.testing.make_example_table(prng=prng, size=10_000)
+    level = table["elementary_school"]
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=1_000
+        ) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            for read_ahead in [0, 2]:
+                for chunk_size in [None, 300, 2_500]:
+                    with snt._file_io.LevelBlockLooper(
+                        reader=f,
+                        level_key="elementary_school",
+                        column_keys=["uid", "num_friends"],
+                        read_ahead=read_ahead,
+                        chunk_size=chunk_size,
+                    ) as looper:
+                        chunks = list(looper)
+
+                    expected_size = 1_000 if chunk_size is None else chunk_size
+                    for chunk in chunks[:-1]:
+                        assert chunk.shape[0] == expected_size
+                        assert chunk.dtype.names == ("uid", "num_friends")
+                    for ck in ["uid", "num_friends"]:
+                        np.testing.assert_array_equal(
+                            np.concatenate([c[ck] for c in chunks]), level[ck]
+                        )
+
+
+def test_level_block_looper_stops_reading_ahead_when_dropped():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = snt.testing.make_example_table(prng=prng, size=10_000)
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=500
+        ) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            looper = snt._file_io.LevelBlockLooper(
+                reader=f, level_key="elementary_school", read_ahead=1
+            )
+            next(looper)
+            thread = looper._thread
+            del looper
+            gc.collect()
+            thread.join(timeout=5)
+            assert not thread.is_alive()
+
+            looper = snt._file_io.LevelBlockLooper(
+                reader=f, level_key="elementary_school", read_ahead=1
+            )
+            next(looper)
+            looper.close()
+            with pytest.raises(StopIteration):
+                next(looper)
+            assert list(looper) == []
+
+
+def _copy_zip_members(src_path, dst_path, skip=None, add=None):
+    with zipfile.ZipFile(src_path, "r") as zin, zipfile.ZipFile(
+        dst_path, "w"
+    ) as zout:
+        for item in zin.infolist():
+            if skip is None or item.filename != skip:
+                zout.writestr(item, zin.read(item.filename))
+        if add is not None:
+            zout.writestr(*add)
+
+
+def test_format_version():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    table = snt.testing.make_example_table(prng=prng, size=1_000)
+    version_filename = snt._file_io.FORMAT_VERSION_FILENAME
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(path, "w", dtypes_and_index_key_from=table) as f:
+            f.append_table(table)
+        with zipfile.ZipFile(path, "r") as z:
+            assert z.read(version_filename) == b"2"
+        with snt.open(path, "r") as f:
+            assert f.format_version == snt._file_io.FORMAT_VERSION
+
+        future_path = os.path.join(tmp, "future.zip")
+        _copy_zip_members(
+            path,
+            future_path,
+            skip=version_filename,
+            add=(version_filename, "3"),
+        )
+        with pytest.raises(AssertionError):
+            snt.open(future_path, "r")
+
+        legacy_path = os.path.join(tmp, "legacy.zip")
+        _copy_zip_members(path, legacy_path, skip=version_filename)
+        with snt.open(legacy_path, "r") as f:
+            assert f.format_version == 1
+        with snt.open(legacy_path, "a") as f:
+            f.append_table(table)
+        with snt.open(legacy_path, "r") as f:
+            assert f.format_version == snt._file_io.FORMAT_VERSION
+            back = f.query()
+        assert back["university"].shape[0] == 2 * table["university"].shape[0]
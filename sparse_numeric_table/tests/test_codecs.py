@@ -0,0 +1,81 @@
+import sparse_numeric_table as snt
+import numpy as np
+import tempfile
+import pytest
+import os
+
+
+def write_and_read(table, **kwargs):
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, **kwargs
+        ) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            filenames = [item.filename for item in f.infolist]
+            back = f.query()
+    return back, filenames
+
+
+def test_codecs_write_read():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    my_table = snt.testing.make_example_table(prng=prng, size=10_000)
+
+    cases = {
+        "none": "lunchpack_size.<f8",
+        "gzip": "lunchpack_size.<f8.gz",
+        "zstd": "lunchpack_size.<f8.zst",
+        "lz4": "lunchpack_size.<f8.lz4",
+    }
+
+    for codec in cases:
+        if codec == "zstd":
+            pytest.importorskip("zstandard")
+        if codec == "lz4":
+            pytest.importorskip("lz4")
+
+        back, filenames = write_and_read(
+            my_table, block_size=3_000, codec=codec
+        )
+        snt.testing.assert_tables_are_equal(my_table, back)
+        path = "elementary_school/000000/" + cases[codec]
+        assert path in filenames
+
+
+def test_compress_false_is_codec_none():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    my_table = snt.testing.make_example_table(prng=prng, size=1_000)
+
+    back, filenames = write_and_read(my_table, compress=False)
+    snt.testing.assert_tables_are_equal(my_table, back)
+    assert "elementary_school/000000/lunchpack_size.<f8" in filenames
+
+
+def test_byte_shuffle_only_float_columns():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    my_table = snt.testing.make_example_table(prng=prng, size=10_000)
+
+    back, filenames = write_and_read(my_table, codec="gzip", shuffle=True)
+    snt.testing.assert_tables_are_equal(my_table, back)
+    assert "elementary_school/000000/lunchpack_size.<f8.shuffle.gz" in (
+        filenames
+    )
+    assert "elementary_school/000000/num_friends.<i8.gz" in filenames
+
+
+def test_byte_shuffle_roundtrip():
+    x = np.arange(100, dtype="<f4")
+    payload = snt._codecs.byte_shuffle(x.tobytes(), itemsize=4)
+    assert payload != x.tobytes()
+    back = snt._codecs.byte_unshuffle(payload, itemsize=4)
+    assert back == x.tobytes()
+
+
+def test_unknown_codec():
+    with pytest.raises(KeyError):
+        snt._codecs.assert_codec_is_valid("foo")
+
+    with pytest.raises(KeyError):
+        snt._codecs.parse_extensions([".foo"])
@@ -0,0 +1,127 @@
+import sparse_numeric_table as snt
+import numpy as np
+import tempfile
+import pytest
+import os
+
+
+def _write_shards(tmp, prng, num_shards, size):
+    expected = snt.testing.make_example_table(prng=prng, size=0)
+    paths = []
+    for i in range(num_shards):
+        part = snt.testing.make_example_table(
+            prng=prng, size=size, start_index=i * size
+        )
+        expected.append(part)
+        path = os.path.join(tmp, f"{i:06d}.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=part, block_size=size // 4
+        ) as f:
+            f.append_table(part)
+        paths.append(path)
+    return expected, paths
+
+
+def test_dataset_query_all():
+    prng = np.random.Generator(np.random.MT19937(seed=1))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        expected, paths = _write_shards(
+            tmp=tmp, prng=prng, num_shards=4, size=2_000
+        )
+        for workers in [None, 3]:
+            with snt.Dataset(tmp, workers=workers) as ds:
+                assert ds.paths == paths
+                assert ds.list_level_keys() == expected.list_level_keys()
+                back = ds.query()
+            snt.testing.assert_tables_are_equal(expected, back)
+
+
+def test_dataset_query_opens_only_needed_shards():
+    prng = np.random.Generator(np.random.MT19937(seed=2))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        expected, paths = _write_shards(
+            tmp=tmp, prng=prng, num_shards=4, size=2_000
+        )
+        indices = np.arange(2_100, 2_300)
+        where = {"elementary_school": [("num_friends", ">", 2)]}
+        with snt.Dataset(paths) as ds:
+            back = ds.query(indices=indices, where=where)
+            assert list(ds._readers.keys()) == [1]
+
+    school = expected["elementary_school"]
+    mask = np.isin(school["uid"], indices) & (school["num_friends"] > 2)
+    np.testing.assert_array_equal(
+        back["elementary_school"]["uid"], school["uid"][mask]
+    )
+
+
+def test_dataset_shards_must_match():
+    prng = np.random.Generator(np.random.MT19937(seed=3))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        _, paths = _write_shards(tmp=tmp, prng=prng, num_shards=1, size=100)
+        other = snt.testing.make_example_table(
+            prng=prng, size=100, index_dtype=("uid", "<i4")
+        )
+        other_path = os.path.join(tmp, "other.zip")
+        with snt.open(other_path, "w", dtypes_and_index_key_from=other) as f:
+            f.append_table(other)
+
+        with pytest.raises(AssertionError):
+            snt.Dataset(paths + [other_path])
+
+
+def test_dataset_needs_shards():
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        with pytest.raises(AssertionError):
+            snt.Dataset(tmp)
+    with pytest.raises(AssertionError):
+        snt.Dataset([])
+
+
+def test_dataset_query_in_processes():
+    prng = np.random.Generator(np.random.MT19937(seed=4))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        expected, paths = _write_shards(
+            tmp=tmp, prng=prng, num_shards=3, size=2_000
+        )
+        indices = prng.choice(6_000, size=1_500, replace=False)
+        where = {"elementary_school": [("lunchpack_size", "<", 0.5)]}
+        with snt.Dataset(paths, blocks_per_task=3) as ds:
+            in_threads = ds.query(indices=indices, where=where)
+            in_processes = ds.query(indices=indices, where=where, processes=2)
+            full = ds.query(processes=2)
+
+    snt.testing.assert_tables_are_equal(in_threads, in_processes)
+    snt.testing.assert_tables_are_equal(expected, full)
+
+
+def test_dataset_get_level_allocates_exact_size():
+    prng = np.random.Generator(np.random.MT19937(seed=5))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        expected, paths = _write_shards(
+            tmp=tmp, prng=prng, num_shards=3, size=2_000
+        )
+        indices = prng.choice(6_000, size=2_500, replace=False)
+        for workers in [None, 3]:
+            with snt.Dataset(tmp, workers=workers) as ds:
+                level = ds._get_level(
+                    level_key="elementary_school",
+                    column_keys="__all__",
+                    indices=indices,
+                    conditions=[("num_friends", ">", 1)],
+                )
+
+            level_expected = expected["elementary_school"]
+            mask = np.isin(level_expected["uid"], indices) & (
+                level_expected["num_friends"] > 1
+            )
+            assert level._capacity() == np.sum(mask)
+            for ck in level_expected.dtype.names:
+                np.testing.assert_array_equal(
+                    level[ck], level_expected[ck][mask]
+                )
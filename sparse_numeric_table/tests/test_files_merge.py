@@ -105,3 +105,52 @@ def test_merge():
                 collect_as_we_go,
                 back_from_merger,
             )
+
+
+def test_merge_sort_in_tables():
+    prng = np.random.Generator(np.random.PCG64(4))
+
+    with tempfile.TemporaryDirectory(prefix="snt_") as tmp_dir:
+        in_paths = []
+        in_tables = []
+        for b in range(3):
+            block_table = sparse_numeric_table.testing.make_example_table(
+                prng=prng,
+                size=5_000,
+                start_index=5_000 * b,
+            )
+            in_tables.append(block_table)
+            in_paths.append(os.path.join(tmp_dir, f"{b:06d}.snt.zip"))
+            with sparse_numeric_table.open(
+                file=in_paths[-1],
+                mode="w",
+                dtypes_and_index_key_from=block_table,
+                block_size=100,
+            ) as tout:
+                tout.append_table(block_table)
+
+        runs_dir = os.path.join(tmp_dir, "runs")
+        os.makedirs(runs_dir)
+        merge_path = os.path.join(tmp_dir, "merge.snt.zip")
+        sparse_numeric_table.files.merge(
+            out_path=merge_path,
+            in_paths=in_paths,
+            sort_in_tables=True,
+            block_read_size=1_000,
+            tmp_dir=runs_dir,
+        )
+        assert os.listdir(runs_dir) == []
+
+        with sparse_numeric_table.open(merge_path, "r") as tin:
+            back = tin.query()
+
+    for level_key in back:
+        expected = []
+        for in_table in in_tables:
+            level = in_table[level_key].to_recarray()
+            expected.append(np.sort(level, order="uid"))
+        expected = np.concatenate(expected)
+        np.testing.assert_array_equal(back[level_key], expected)
+
+    uid = back["high_school"]["uid"]
+    assert np.all(uid[1:] > uid[:-1])
@@ -0,0 +1,184 @@
+import sparse_numeric_table as snt
+import numpy as np
+import tempfile
+import pytest
+import os
+
+
+def _reference(table, by, level_key, column_key, where_by=None):
+    """
+    Returns the group keys and the values of 'column_key' per group made
+    with a plain python join on the index.
+    """
+    by_level_key, by_column_key = by
+    by_level = table[by_level_key]
+    mask = np.ones(by_level.shape[0], dtype=bool)
+    if where_by is not None:
+        mask = where_by(by_level)
+    key_of_index = dict(
+        zip(by_level["uid"][mask].tolist(), by_level[by_column_key][mask])
+    )
+    keys = np.unique(by_level[by_column_key][mask])
+    values = {key: [] for key in keys.tolist()}
+    level = table[level_key]
+    for uid, value in zip(level["uid"].tolist(), level[column_key]):
+        if uid in key_of_index:
+            values[key_of_index[uid].item()].append(value)
+    return keys, values
+
+
+def _assert_matches_reference(keys, out, ref_keys, ref_values):
+    np.testing.assert_array_equal(keys, ref_keys)
+    for i, key in enumerate(ref_keys.tolist()):
+        values = np.asarray(ref_values[key])
+        assert out["count"][i] == values.shape[0]
+        if values.shape[0] == 0:
+            assert np.isnan(out["mean"][i])
+            continue
+        np.testing.assert_allclose(out["sum"][i], np.sum(values))
+        np.testing.assert_allclose(out["mean"][i], np.mean(values))
+        assert out["min"][i] == np.min(values)
+        assert out["max"][i] == np.max(values)
+
+
+def test_group_by_table_and_reader():
+    prng = np.random.Generator(np.random.MT19937(seed=3))
+    table = snt.testing.make_example_table(prng=prng, size=10_000)
+    by = ("elementary_school", "num_friends")
+    levels_and_aggregations = {
+        "high_school": {
+            "time_spent_on_homework": ["count", "sum", "mean", "min", "max"]
+        },
+    }
+    ref_keys, ref_values = _reference(
+        table=table,
+        by=by,
+        level_key="high_school",
+        column_key="time_spent_on_homework",
+    )
+
+    keys, out = table.group_by(
+        by=by, levels_and_aggregations=levels_and_aggregations
+    )
+    _assert_matches_reference(
+        keys=keys,
+        out=out["high_school"]["time_spent_on_homework"],
+        ref_keys=ref_keys,
+        ref_values=ref_values,
+    )
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=1_000
+        ) as f:
+            f.append_table(table)
+
+        for workers in [None, 3]:
+            with snt.open(path, "r", workers=workers) as f:
+                keys, out = f.group_by(
+                    by=by, levels_and_aggregations=levels_and_aggregations
+                )
+            _assert_matches_reference(
+                keys=keys,
+                out=out["high_school"]["time_spent_on_homework"],
+                ref_keys=ref_keys,
+                ref_values=ref_values,
+            )
+
+
+def test_group_by_with_where_and_histogram():
+    prng = np.random.Generator(np.random.MT19937(seed=4))
+    table = snt.testing.make_example_table(prng=prng, size=5_000)
+    by = ("high_school", "num_best_friends")
+    bin_edges = np.array([0, 1, 2, 3, 5, 10])
+    levels_and_aggregations = {
+        "elementary_school": {
+            "lunchpack_size": ["count", "sum", "mean", "min", "max"],
+            "num_friends": [("hist", bin_edges)],
+        },
+    }
+    where = {"high_school": [("time_spent_on_homework", ">", 0.5)]}
+
+    ref_keys, ref_values = _reference(
+        table=table,
+        by=by,
+        level_key="elementary_school",
+        column_key="lunchpack_size",
+        where_by=lambda level: level["time_spent_on_homework"] > 0.5,
+    )
+    _, ref_friends = _reference(
+        table=table,
+        by=by,
+        level_key="elementary_school",
+        column_key="num_friends",
+        where_by=lambda level: level["time_spent_on_homework"] > 0.5,
+    )
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=1_000
+        ) as f:
+            f.append_table(table)
+        with snt.open(path, "r") as f:
+            reader_result = f.group_by(
+                by=by,
+                levels_and_aggregations=levels_and_aggregations,
+                where=where,
+            )
+
+    for keys, out in [
+        table.group_by(
+            by=by,
+            levels_and_aggregations=levels_and_aggregations,
+            where=where,
+        ),
+        reader_result,
+    ]:
+        _assert_matches_reference(
+            keys=keys,
+            out=out["elementary_school"]["lunchpack_size"],
+            ref_keys=ref_keys,
+            ref_values=ref_values,
+        )
+        hist = out["elementary_school"]["num_friends"]["hist"]
+        assert hist.shape == (ref_keys.shape[0], bin_edges.shape[0] - 1)
+        for i, key in enumerate(ref_keys.tolist()):
+            np.testing.assert_array_equal(
+                hist[i],
+                np.histogram(ref_friends[key], bins=bin_edges)[0],
+            )
+
+    with pytest.raises(KeyError):
+        table.group_by(
+            by=by, levels_and_aggregations={"kindergarden": {"uid": ["sum"]}}
+        )
+    with pytest.raises(KeyError):
+        table.group_by(
+            by=by,
+            levels_and_aggregations={
+                "elementary_school": {
+                    "num_friends": [
+                        ("hist", [0, 2, 4, 100]),
+                        ("hist", [0, 50, 100]),
+                    ]
+                }
+            },
+        )
+
+
+def test_group_by_needs_unique_indices_in_by_level():
+    prng = np.random.Generator(np.random.MT19937(seed=3))
+    table = snt.testing.make_example_table(prng=prng, size=1_000)
+    school = table["elementary_school"].to_recarray()
+    school["uid"][1] = school["uid"][0]
+    table["elementary_school"] = school
+
+    with pytest.raises(AssertionError):
+        table.group_by(
+            by=("elementary_school", "num_friends"),
+            levels_and_aggregations={
+                "high_school": {"time_spent_on_homework": ["count"]}
+            },
+        )
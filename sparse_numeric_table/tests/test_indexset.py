@@ -0,0 +1,90 @@
+import sparse_numeric_table as snt
+import numpy as np
+import tempfile
+import pytest
+import os
+
+
+def _random_indices(prng, size, high):
+    return np.unique(prng.integers(low=0, high=high, size=size))
+
+
+def test_indexset_round_trip():
+    prng = np.random.Generator(np.random.MT19937(seed=1))
+
+    for size in [0, 1, 100, 10_000, 200_000]:
+        indices = _random_indices(prng=prng, size=size, high=1_000_000)
+        iset = snt.IndexSet(indices)
+        assert len(iset) == len(indices)
+        np.testing.assert_array_equal(iset.to_array(), indices)
+        np.testing.assert_array_equal(np.asarray(iset), indices)
+
+    with pytest.raises(AssertionError):
+        snt.IndexSet([-1, 2])
+    with pytest.raises(AssertionError):
+        snt.IndexSet([1.5])
+
+
+def test_indexset_operations_match_numpy():
+    prng = np.random.Generator(np.random.MT19937(seed=2))
+
+    a = _random_indices(prng=prng, size=150_000, high=1_000_000)
+    b = _random_indices(prng=prng, size=20_000, high=1_000_000)
+    sa = snt.IndexSet(a)
+    sb = snt.IndexSet(b)
+
+    np.testing.assert_array_equal((sa & sb).to_array(), np.intersect1d(a, b))
+    np.testing.assert_array_equal((sa | sb).to_array(), np.union1d(a, b))
+    np.testing.assert_array_equal((sa - sb).to_array(), np.setdiff1d(a, b))
+    np.testing.assert_array_equal((sb - sa).to_array(), np.setdiff1d(b, a))
+
+    left = prng.integers(low=-10, high=1_100_000, size=10_000)
+    np.testing.assert_array_equal(sa.mask(left), np.isin(left, a))
+    assert int(a[0]) in sa
+    assert -1 not in sa
+
+    assert sa.any_in_range(start=a[10], stop=a[10])
+    assert not sa.any_in_range(start=a[10] + 1, stop=a[11] - 1)
+
+
+def test_indexset_in_logic():
+    a = snt.IndexSet([1, 2, 3, 4, 5, 6])
+    b = snt.IndexSet([3, 4, 5, 6, 7, 8])
+
+    out = snt.logic.intersection(a, b)
+    assert isinstance(out, snt.IndexSet)
+    np.testing.assert_array_equal(out.to_array(), [3, 4, 5, 6])
+    np.testing.assert_array_equal(
+        snt.logic.union(a, b).to_array(), [1, 2, 3, 4, 5, 6, 7, 8]
+    )
+    np.testing.assert_array_equal(
+        snt.logic.difference(a, b).to_array(), [1, 2]
+    )
+    np.testing.assert_array_equal(snt.logic.intersection(a, [4, 6, 9]), [4, 6])
+
+
+def test_indexset_query_and_cut():
+    prng = np.random.Generator(np.random.MT19937(seed=3))
+    table = snt.testing.make_example_table(prng=prng, size=20_000)
+
+    indices = table["high_school"]["uid"]
+    iset = snt.IndexSet(indices)
+
+    expected = snt.logic.cut_table_on_indices(table, indices)
+    snt.testing.assert_tables_are_equal(
+        expected, snt.logic.cut_table_on_indices(table, iset)
+    )
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        path = os.path.join(tmp, "my_table.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=5_000
+        ) as f:
+            f.append_table(table)
+        with snt.open(path, "r") as f:
+            back = f.query(indices=iset)
+
+    for lk in expected.list_level_keys():
+        np.testing.assert_array_equal(
+            np.sort(expected[lk]["uid"]), np.sort(back[lk]["uid"])
+        )
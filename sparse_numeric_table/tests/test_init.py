@@ -355,3 +355,46 @@ def test_only_index_in_level():
             table_back = tin.query()
         snt.testing.assert_dtypes_are_equal(table_back.dtypes, dtypes)
         snt.testing.assert_tables_are_equal(table, table_back)
+
+
+def test_concatenate_copies_blocks_or_decodes():
+    prng = np.random.Generator(np.random.MT19937(seed=1337))
+    dtypes = snt.testing.make_example_table_dtypes(index_dtype=("uid", "<u8"))
+
+    with tempfile.TemporaryDirectory(prefix="test_sparse_table") as tmp:
+        expected = snt.testing.make_example_table(prng=prng, size=0)
+        paths = []
+        for i, codec in enumerate(["gzip", "gzip", "none", "gzip"]):
+            table_i = snt.testing.make_example_table(
+                prng=prng, size=1_000, start_index=i * 1_000
+            )
+            expected.append(table_i)
+            paths.append(os.path.join(tmp, f"{i:06d}.zip"))
+            with snt.open(
+                paths[-1],
+                "w",
+                dtypes_and_index_key_from=table_i,
+                codec=codec,
+                block_size=300,
+            ) as f:
+                f.append_table(table_i)
+
+        output_path = os.path.join(tmp, "full.zip")
+        with snt.open(
+            output_path, "w", dtypes=dtypes, index_key="uid"
+        ) as tout:
+            with snt.open(paths[0], "r") as tin:
+                assert tout.can_copy_blocks_from(tin)
+            with snt.open(paths[2], "r") as tin:
+                assert not tout.can_copy_blocks_from(tin)
+
+        snt.concatenate_files(
+            input_paths=paths,
+            output_path=output_path,
+            dtypes=dtypes,
+            index_key="uid",
+        )
+        with snt.open(output_path, "r") as tin:
+            full_table = tin.query()
+
+    snt.testing.assert_tables_are_equal(full_table, expected)
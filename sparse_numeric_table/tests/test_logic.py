@@ -135,3 +135,166 @@ def test_difference_case1():
 def test_difference_case2():
     w = snt.logic.difference([], [1, 2, 3, 4, 5, 6], [2, 4, 6], [1, 2, 3])
     assert w.shape[0] == 0
+
+
+def test_make_mask_of_right_in_left():
+    mask = snt.logic.make_mask_of_right_in_left([1, 2, 3, 4], [0, 2, 9])
+    np.testing.assert_array_equal(mask, [False, True, False, False])
+
+    mask = snt.logic.make_mask_of_right_in_left([1, 2, 3], [])
+    np.testing.assert_array_equal(mask, [False, False, False])
+
+    mask = snt.logic.make_mask_of_right_in_left([], [1, 2])
+    assert mask.shape[0] == 0
+
+
+def test_make_mask_of_right_in_left_dense_and_sparse():
+    prng = np.random.Generator(np.random.MT19937(seed=0))
+    left = prng.integers(low=0, high=1_000, size=500).astype("<u8")
+
+    for high in [100, 1_000_000]:
+        right = prng.integers(low=-10, high=high, size=50).astype("<i8")
+        mask = snt.logic.make_mask_of_right_in_left(left, right)
+        expected = [int(i) in set(right.tolist()) for i in left]
+        np.testing.assert_array_equal(mask, expected)
+
+
+def test_index_membership_reused():
+    membership = snt._base.IndexMembership([9, 3, 5, 3])
+    assert len(membership) == 3
+
+    mask = snt.logic.make_mask_of_right_in_left([3, 4, 5], membership)
+    np.testing.assert_array_equal(mask, [True, False, True])
+    mask = snt.logic.make_mask_of_right_in_left([9, 10], membership)
+    np.testing.assert_array_equal(mask, [True, False])
+
+    assert membership.any_in_range(start=4, stop=5)
+    assert not membership.any_in_range(start=6, stop=8)
+
+
+def test_set_algebra_matches_python_sets():
+    prng = np.random.Generator(np.random.MT19937(seed=42))
+
+    lists = [
+        prng.choice(1_000, size=size, replace=False)
+        for size in [300, 500, 700]
+    ]
+    sets = [set(a.tolist()) for a in lists]
+    sorted_lists = [np.sort(a) for a in lists]
+
+    for kwargs, args in [
+        ({}, lists),
+        ({"assume_unique": True}, lists),
+        ({"assume_sorted": True}, sorted_lists),
+    ]:
+        np.testing.assert_array_equal(
+            snt.logic.intersection(*args, **kwargs),
+            sorted(sets[0] & sets[1] & sets[2]),
+        )
+        np.testing.assert_array_equal(
+            snt.logic.union(*args, **kwargs),
+            sorted(sets[0] | sets[1] | sets[2]),
+        )
+        np.testing.assert_array_equal(
+            snt.logic.difference(*args, **kwargs),
+            sorted(sets[0] - sets[1] - sets[2]),
+        )
+
+
+def test_set_algebra_rejects_duplicates():
+    for func in [
+        snt.logic.intersection,
+        snt.logic.union,
+        snt.logic.difference,
+    ]:
+        with pytest.raises(AssertionError):
+            func([1, 2, 2], [2, 3])
+
+
+def test_cut_and_sort_table_on_indices():
+    prng = np.random.Generator(np.random.MT19937(seed=4))
+    table = snt.testing.make_example_table(prng=prng, size=10_000)
+
+    common = snt.logic.intersection(
+        table["elementary_school"]["uid"],
+        table["high_school"]["uid"],
+        table["university"]["uid"],
+    )
+    prng.shuffle(common)
+
+    out = snt.logic.cut_and_sort_table_on_indices(table, common)
+    for lk in out:
+        np.testing.assert_array_equal(out[lk]["uid"], common)
+        level = table[lk]
+        for i in [0, len(common) // 2, len(common) - 1]:
+            row = np.flatnonzero(level["uid"] == common[i])[0]
+            for ck in level.dtype.names:
+                assert out[lk][ck][i] == level[ck][row]
+
+    with pytest.raises(AssertionError):
+        snt.logic.cut_and_sort_table_on_indices(
+            table, table["high_school"]["uid"]
+        )
+
+
+def _make_rectangular_example_table(size=1_000):
+    prng = np.random.Generator(np.random.MT19937(seed=7))
+    table = snt.testing.make_example_table(prng=prng, size=size)
+    common_indices = snt.logic.intersection(
+        *[table[lk]["uid"] for lk in table]
+    )
+    return snt.logic.cut_and_sort_table_on_indices(
+        table=table, common_indices=common_indices
+    )
+
+
+def test_is_rectangular_flag():
+    table = _make_rectangular_example_table()
+    assert table.is_rectangular
+    table["university"] = table["university"].to_recarray()
+    assert not table.is_rectangular
+
+    table = _make_rectangular_example_table()
+    table["university"]["uid"][0] += 1
+    table["university"] = table["university"].to_recarray()
+    assert not table.is_rectangular
+    for copy in [True, False]:
+        with pytest.raises(AssertionError):
+            snt.logic.make_rectangular_DataFrame(table, copy=copy)
+
+
+def test_make_rectangular_DataFrame_copy():
+    table = _make_rectangular_example_table()
+    level = table["high_school"].to_recarray()
+
+    df = snt.logic.make_rectangular_DataFrame(table)
+    assert not np.shares_memory(
+        df["high_school/time_spent_on_homework"], level
+    )
+    np.testing.assert_array_equal(
+        df["high_school/time_spent_on_homework"],
+        table["high_school"]["time_spent_on_homework"],
+    )
+
+    df = snt.logic.make_rectangular_DataFrame(table, copy=False)
+    assert np.shares_memory(df["high_school/time_spent_on_homework"], level)
+
+
+def test_make_rectangular_arrow_Table():
+    pa = pytest.importorskip("pyarrow")
+    table = _make_rectangular_example_table(size=10_000)
+    df = snt.logic.make_rectangular_DataFrame(table)
+
+    arrow_table = snt.logic.make_rectangular_arrow_Table(table)
+    assert isinstance(arrow_table, pa.Table)
+    assert arrow_table.column_names == list(df.columns)
+    for name in df.columns:
+        np.testing.assert_array_equal(
+            arrow_table[name].to_numpy(), df[name].to_numpy()
+        )
+
+    batches = list(
+        snt.logic.make_rectangular_arrow_RecordBatches(table, max_rows=7)
+    )
+    assert all(batch.num_rows <= 7 for batch in batches)
+    assert pa.Table.from_batches(batches).equals(arrow_table)
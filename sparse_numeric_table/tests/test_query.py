@@ -104,3 +104,79 @@ def test_query_indices():
             a_level_part = a[level][a_level_mask]
 
             np.testing.assert_array_equal(a_level_part, b[level])
+
+
+def test_query_where():
+    for query in FILE_AND_SELF:
+        a = make_example_table()
+        b = query(
+            table=a,
+            levels_and_columns={"A": ("i", "b"), "B": "__all__"},
+            where={"A": [("a", ">", 500), ("b", "<=", 150)]},
+        )
+
+        a_mask = (a["A"]["a"] > 500) & (a["A"]["b"] <= 150)
+        np.testing.assert_array_equal(a["A"]["i"][a_mask], b["A"]["i"])
+        np.testing.assert_array_equal(a["A"]["b"][a_mask], b["A"]["b"])
+        np.testing.assert_array_equal(a["B"], b["B"])
+
+
+def test_query_where_and_indices():
+    for query in FILE_AND_SELF:
+        a = make_example_table()
+        indices = np.arange(0, 1_000, 3)
+        b = query(
+            table=a,
+            indices=indices,
+            where={"B": [("d", "==", 3)]},
+        )
+
+        b_mask = a["B"]["d"] == 3
+        b_mask &= snt.logic.make_mask_of_right_in_left(a["B"]["i"], indices)
+        np.testing.assert_array_equal(a["B"]["i"][b_mask], b["B"]["i"])
+        assert b["A"].shape[0] == len(
+            snt.logic.intersection(a["A"]["i"], indices)
+        )
+
+
+def query_lazy_from_file(table, block_size=100, **query_kwargs):
+    with tempfile.TemporaryDirectory(prefix="test_snt_") as tmp:
+        path = os.path.join(tmp, "table.snt.zip")
+        with snt.open(
+            path, "w", dtypes_and_index_key_from=table, block_size=block_size
+        ) as f:
+            f.append_table(table)
+
+        with snt.open(path, "r") as f:
+            back = f.query(lazy=True, **query_kwargs).materialize()
+    return back
+
+
+def test_query_where_and_sort():
+    for query in FILE_AND_SELF + [query_lazy_from_file]:
+        a = make_example_table()
+        prng = np.random.Generator(np.random.MT19937(seed=1))
+        indices = prng.permutation(
+            snt.logic.intersection(a["A"]["i"], a["B"]["i"])
+        )
+        b = query(
+            table=a,
+            indices=indices,
+            levels_and_columns={"A": "__all__", "B": "__all__"},
+            where={"B": [("d", "==", 3)]},
+            sort=True,
+        )
+
+        left = a["B"]["i"][a["B"]["d"] == 3]
+        expected = indices[np.isin(indices, left)]
+        assert 0 < expected.shape[0] < indices.shape[0]
+        np.testing.assert_array_equal(b["A"]["i"], expected)
+        np.testing.assert_array_equal(b["B"]["i"], expected)
+        assert np.all(b["B"]["d"] == 3)
+
+
+def test_query_where_bad_operator():
+    for query in FILE_AND_SELF:
+        a = make_example_table(size=10)
+        with pytest.raises(KeyError):
+            query(table=a, where={"A": [("a", "=>", 1)]})
@@ -1 +1 @@
-__version__ = "1.2.18"
+__version__ = "2.0.0"